@@ -1,5 +1,6 @@
 from pathlib import Path
 from decouple import config
+from corsheaders.defaults import default_headers
 import os
 
 # Base directory
@@ -112,12 +113,57 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploads are named by content hash (store/storage.py), so their URLs never
+# change meaning and can be served with "Cache-Control: immutable".
+STORAGES = {
+    'default': {'BACKEND': 'store.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+MEDIA_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+# Uploaded image derivatives (store/images.py)
+IMAGE_DERIVATIVE_WIDTHS = (320, 640, 1024)
+IMAGE_DERIVATIVE_QUALITY = config('IMAGE_DERIVATIVE_QUALITY', default=80, cast=int)
+IMAGE_LQIP_WIDTH = 16
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Razorpay Keys
 RAZORPAY_KEY_ID = config('RAZORPAY_KEY_ID', default='')
 RAZORPAY_KEY_SECRET = config('RAZORPAY_KEY_SECRET', default='')
+RAZORPAY_WEBHOOK_SECRET = config('RAZORPAY_WEBHOOK_SECRET', default='')
+
+# 'razorpay', 'fake' (in-process, for offline testing/benchmarks) or a dotted path; see payment.gateways
+PAYMENT_GATEWAY = config('PAYMENT_GATEWAY', default='razorpay')
+PAYMENT_GATEWAY_FAKE_LATENCY = config('PAYMENT_GATEWAY_FAKE_LATENCY', default=0, cast=float)   # seconds per call
+PAYMENT_GATEWAY_FAKE_ERROR_RATE = config('PAYMENT_GATEWAY_FAKE_ERROR_RATE', default=0, cast=float)
+
+# Outbound gateway calls (payment.resilience): timeouts in seconds
+PAYMENT_GATEWAY_POOL_SIZE = 10            # keep-alive connections per worker process
+PAYMENT_GATEWAY_CONNECT_TIMEOUT = 3
+PAYMENT_GATEWAY_READ_TIMEOUT = 5
+PAYMENT_GATEWAY_DEADLINE = 8              # total budget for one call, retries included
+PAYMENT_GATEWAY_RETRIES = 2
+PAYMENT_GATEWAY_BACKOFF = 0.2             # full jitter: sleep up to BACKOFF * 2**attempt
+PAYMENT_GATEWAY_BACKOFF_CAP = 2
+PAYMENT_GATEWAY_BREAKER_WINDOW = 20       # recent calls considered
+PAYMENT_GATEWAY_BREAKER_MIN_CALLS = 10
+PAYMENT_GATEWAY_BREAKER_FAILURE_RATIO = 0.5
+PAYMENT_GATEWAY_BREAKER_RESET_TIMEOUT = 30
+
+# reconcile_payments: settle orders the browser never confirmed
+RECONCILE_MIN_AGE_MINUTES = 30     # leave younger orders to the browser/webhook
+RECONCILE_GIVE_UP_HOURS = 24       # cancel unpaid orders older than this
+RECONCILE_CHECKPOINT_FILE = config(
+    'RECONCILE_CHECKPOINT_FILE', default=os.path.join(BASE_DIR, 'var', 'reconcile_payments.checkpoint.json')
+)
+
+# Webhook worker (payment.webhooks / process_webhook_events)
+WEBHOOK_BATCH_SIZE = 100
+WEBHOOK_MAX_ATTEMPTS = 5
+WEBHOOK_RETRY_DELAY = 30     # seconds between attempts at a failing event
+WEBHOOK_LOCK_TIMEOUT = 300   # seconds before a claimed event is retried
 
 # Email Configuration
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -152,12 +198,102 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Catalog listings
+PRODUCT_PAGE_SIZE = config('PRODUCT_PAGE_SIZE', default=24, cast=int)
+PRODUCT_MAX_PAGE_SIZE = config('PRODUCT_MAX_PAGE_SIZE', default=100, cast=int)
+PRODUCT_LIST_PAGINATE_BY_DEFAULT = config('PRODUCT_LIST_PAGINATE_BY_DEFAULT', default=False, cast=bool)
+
+# Catalog response cache
+# "file" is shared by every worker and management command on the host and
+# "redis" talks to any Redis-compatible server. The catalog version lives in
+# this cache, so "locmem" (per process: other workers and commands never see
+# its bumps) is only for single-process development.
+CATALOG_CACHE_ALIAS = 'catalog'
+CATALOG_CACHE_ENABLED = config('CATALOG_CACHE_ENABLED', default=True, cast=bool)
+CATALOG_CACHE_BACKEND = config('CATALOG_CACHE_BACKEND', default='file')
+CATALOG_CACHE_TIMEOUT = config('CATALOG_CACHE_TIMEOUT', default=60 * 60 * 24, cast=int)
+CATALOG_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+        'OPTIONS': {'MAX_ENTRIES': config('CATALOG_CACHE_MAX_ENTRIES', default=2000, cast=int)},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': config('CATALOG_CACHE_LOCATION', default=os.path.join(BASE_DIR, 'var', 'cache', 'catalog')),
+        'OPTIONS': {'MAX_ENTRIES': config('CATALOG_CACHE_MAX_ENTRIES', default=2000, cast=int)},
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('CATALOG_CACHE_URL', default='redis://127.0.0.1:6379/1'),
+    },
+}
+
+# Pre-compressed /api/catalog-snapshot/ files (python manage.py build_catalog_snapshot --loop)
+CATALOG_SNAPSHOT_DIR = config('CATALOG_SNAPSHOT_DIR', default=os.path.join(BASE_DIR, 'var', 'catalog_snapshot'))
+
+# "Frequently bought together" (python manage.py build_recommendations, nightly)
+RECOMMENDATIONS_TOP_N = config('RECOMMENDATIONS_TOP_N', default=10, cast=int)
+RECOMMENDATIONS_WINDOW_DAYS = config('RECOMMENDATIONS_WINDOW_DAYS', default=365, cast=int)
+
+# Basket stock holds expire after this long without cart activity
+# (released by python manage.py release_expired_reservations)
+CART_RESERVATION_MINUTES = config('CART_RESERVATION_MINUTES', default=30, cast=int)
+
+# Guest carts live in a signed cookie until login
+GUEST_CART_COOKIE = 'guest_cart'
+GUEST_CART_MAX_AGE = config('GUEST_CART_MAX_AGE', default=60 * 60 * 24 * 30, cast=int)
+GUEST_CART_MAX_LINES = 50
+# Use "None" (with HTTPS) when the storefront is on another origin
+GUEST_CART_COOKIE_SAMESITE = config('GUEST_CART_COOKIE_SAMESITE', default='Lax')
+GUEST_CART_COOKIE_SECURE = config('GUEST_CART_COOKIE_SECURE', default=not DEBUG, cast=bool)
+
+# Idempotency-Key handling for checkout / payment-status (payment.idempotency)
+IDEMPOTENCY_KEY_TTL = config('IDEMPOTENCY_KEY_TTL', default=60 * 60 * 24, cast=int)
+IDEMPOTENCY_WAIT_SECONDS = 5       # how long a duplicate waits for the original
+IDEMPOTENCY_LOCK_TIMEOUT = 120     # an unfinished claim older than this is abandoned
+
+# Flash sales (store.flash): stock counters and waiting-room tickets live in
+# this cache. Every worker must share it and it must not evict, so point
+# FLASH_SALE_CACHE_URL at Redis in production; the locmem fallback only
+# works for a single process.
+FLASH_SALE_CACHE_ALIAS = 'flash'
+FLASH_SALE_CACHE_URL = config('FLASH_SALE_CACHE_URL', default='')
+FLASH_SALE_FLUSH_SECONDS = config('FLASH_SALE_FLUSH_SECONDS', default=5, cast=int)
+FLASH_SALE_ADMISSION_MINUTES = config('FLASH_SALE_ADMISSION_MINUTES', default=10, cast=int)
+FLASH_SALE_GRACE_SECONDS = 10      # after ends_at, before the final flush
+FLASH_SALE_SALES_TTL = 30          # how long workers cache the list of sales
+
+# Transactional email outbox (store.outbox), drained by python manage.py send_outbox --loop
+OUTBOX_BATCH_SIZE = config('OUTBOX_BATCH_SIZE', default=50, cast=int)
+OUTBOX_MAX_ATTEMPTS = config('OUTBOX_MAX_ATTEMPTS', default=8, cast=int)
+OUTBOX_RETRY_DELAY = 60            # seconds before the first retry; doubles per attempt
+OUTBOX_RETRY_MAX_DELAY = 60 * 60
+OUTBOX_LOCK_TIMEOUT = 300          # a batch claimed this long ago by a dead worker is retried
+OUTBOX_KEEP_DAYS = config('OUTBOX_KEEP_DAYS', default=30, cast=int)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    CATALOG_CACHE_ALIAS: CATALOG_CACHE_BACKENDS[CATALOG_CACHE_BACKEND],
+    FLASH_SALE_CACHE_ALIAS: {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': FLASH_SALE_CACHE_URL,
+    } if FLASH_SALE_CACHE_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'flash',
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    },
+}
+
 # CORS settings
 # CORS_ALLOW_ALL_ORIGINS = True
 # or specific origins from env
 # CORS_ALLOWED_ORIGINS = config('CORS_ALLOWED_ORIGINS', default='http://localhost:3000').split(',')
 
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
 
 CORS_ALLOWED_ORIGINS = [
     "http://127.0.0.1:5501",  # your frontend origin
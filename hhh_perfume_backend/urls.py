@@ -5,6 +5,7 @@ from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from django.conf import settings
 from django.conf.urls.static import static
+from store.storage import serve_media
 
 
 # ---------- Import ViewSets ----------
@@ -24,7 +25,7 @@ from store.views import (
     product_delete_view,
     WishListViewSet
 )
-from payment.views import PaymentViewSet, InvoiceViewSet
+from payment.views import PaymentViewSet, InvoiceViewSet, gateway_metrics, razorpay_webhook
 
 # ---------- DRF Router ----------
 router = DefaultRouter()
@@ -91,6 +92,10 @@ urlpatterns = [
     path('product/<int:pk>/delete/', product_delete_view, name='product-delete'),
     path('api/', include('store.urls')),
 
+    # Before the router so these aren't taken for a payment pk
+    path('payments/webhook/', razorpay_webhook, name='razorpay-webhook'),
+    path('payments/gateway-metrics/', gateway_metrics, name='gateway-metrics'),
+
     # All ViewSets from router
     path('', include(router.urls)),
-]+static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+]+static(settings.MEDIA_URL, view=serve_media, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
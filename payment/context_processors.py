@@ -1,16 +1,9 @@
-from django.db.models import Sum
+from store.models import Basket
 
 
 def cart_count(request):
-
-    count=0
-
+    # Reads the basket's maintained item_count instead of aggregating items.
+    count = 0
     if request.user.is_authenticated:
-
-        if request.user.cart.get_cart_item.all.count()>0:
-
-            data=request.user.cart.cartitems.filter(is_order_placed=False).values_list('quantity').aggregate(total=Sum('quantity'))
-
-            count= data.get('total')
-
-    return{'item_count':count}
\ No newline at end of file
+        count = Basket.objects.filter(owner=request.user).values_list('item_count', flat=True).first() or 0
+    return {'item_count': count}
@@ -0,0 +1,299 @@
+"""
+Payment gateway interface used by checkout, payment-status and the webhook.
+
+``get_gateway()`` returns the backend named by PAYMENT_GATEWAY: ``razorpay``
+(the real API) or ``fake``, an in-process stand-in that creates orders,
+signs and verifies payments like Razorpay does and can be slowed down or
+made to fail, so checkout can be exercised and benchmarked offline. A
+dotted path to another PaymentGateway subclass works too. Either way the
+backend is wrapped in payment.resilience.ResilientGateway, which adds
+deadlines, retries and a circuit breaker.
+
+Calls that go over the network take a ``timeout`` (seconds) and raise
+GatewayError, flagged ``transient`` when retrying might help and
+``maybe_applied`` when the gateway may already have acted on the request.
+"""
+import hashlib
+import hmac
+import random
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.crypto import get_random_string
+from django.utils.module_loading import import_string
+
+
+class GatewayError(Exception):
+    """The gateway couldn't be reached or refused the call."""
+    transient = False
+    maybe_applied = True
+
+    def __init__(self, message='', transient=None, maybe_applied=None):
+        super().__init__(message)
+        if transient is not None:
+            self.transient = transient
+        if maybe_applied is not None:
+            self.maybe_applied = maybe_applied
+
+
+class GatewayTimeout(GatewayError):
+    transient = True
+
+
+class CircuitOpen(GatewayError):
+    """Calls are being refused locally because the gateway keeps failing."""
+    maybe_applied = False
+
+    def __init__(self, message='', retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SignatureError(GatewayError):
+    """A payment or webhook signature didn't match."""
+
+
+def _hmac(secret, message):
+    return hmac.new(secret.encode('utf-8'), message.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+class PaymentGateway:
+    def create_order(self, amount, currency='INR', receipt=None, timeout=None):
+        """Creates a gateway order for ``amount`` paise and returns it as a dict with an ``id``."""
+        raise NotImplementedError
+
+    def verify_payment_signature(self, order_id, payment_id, signature):
+        """Raises SignatureError unless ``signature`` is the gateway's for this payment."""
+        raise NotImplementedError
+
+    def verify_webhook_signature(self, body, signature, secret):
+        if not hmac.compare_digest(_hmac(secret, body), signature or ''):
+            raise SignatureError("Webhook signature mismatch")
+
+    def fetch_payment(self, payment_id, timeout=None):
+        raise NotImplementedError
+
+    def fetch_order_payments(self, order_id, timeout=None):
+        """Every payment attempt made against a gateway order, as a list of dicts."""
+        raise NotImplementedError
+
+
+class RazorpayGateway(PaymentGateway):
+    """
+    The Razorpay SDK on a shared keep-alive session. The SDK sets no
+    timeout of its own, so every call passes ``(connect, read)`` explicitly.
+    """
+
+    def __init__(self, key_id=None, key_secret=None):
+        import razorpay
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.errors = razorpay.errors
+        self.requests = requests
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=settings.PAYMENT_GATEWAY_POOL_SIZE, max_retries=0, pool_block=False
+        )
+        session.mount('https://', adapter)
+        self.client = razorpay.Client(session=session, auth=(
+            key_id if key_id is not None else settings.RAZORPAY_KEY_ID,
+            key_secret if key_secret is not None else settings.RAZORPAY_KEY_SECRET,
+        ))
+
+    def _timeout(self, timeout):
+        connect = settings.PAYMENT_GATEWAY_CONNECT_TIMEOUT
+        read = settings.PAYMENT_GATEWAY_READ_TIMEOUT
+        if timeout is not None:
+            connect, read = min(connect, timeout), min(read, timeout)
+        return (connect, read)
+
+    def _request(self, call, *args, timeout=None):
+        requests = self.requests
+        try:
+            return call(*args, timeout=self._timeout(timeout))
+        except requests.ConnectTimeout as exc:
+            raise GatewayTimeout(str(exc), maybe_applied=False) from exc
+        except requests.Timeout as exc:
+            raise GatewayTimeout(str(exc)) from exc
+        except requests.ConnectionError as exc:
+            # Refused/reset before a response; can't tell whether it was sent.
+            raise GatewayError(str(exc), transient=True) from exc
+        except self.errors.BadRequestError as exc:
+            raise GatewayError(str(exc)) from exc
+        except (self.errors.ServerError, self.errors.GatewayError, ValueError) as exc:
+            raise GatewayError(str(exc), transient=True) from exc
+
+    def create_order(self, amount, currency='INR', receipt=None, timeout=None):
+        return self._request(self.client.order.create, {
+            "amount": amount,
+            "currency": currency,
+            "receipt": receipt,
+            "payment_capture": "1",
+        }, timeout=timeout)
+
+    def verify_payment_signature(self, order_id, payment_id, signature):
+        try:
+            self.client.utility.verify_payment_signature({
+                'razorpay_order_id': order_id,
+                'razorpay_payment_id': payment_id,
+                'razorpay_signature': signature,
+            })
+        except self.errors.SignatureVerificationError as exc:
+            raise SignatureError(str(exc)) from exc
+
+    def verify_webhook_signature(self, body, signature, secret):
+        try:
+            self.client.utility.verify_webhook_signature(body, signature, secret)
+        except self.errors.SignatureVerificationError as exc:
+            raise SignatureError(str(exc)) from exc
+
+    def fetch_payment(self, payment_id, timeout=None):
+        return self._request(self.client.payment.fetch, payment_id, timeout=timeout)
+
+    def fetch_order_payments(self, order_id, timeout=None):
+        return self._request(self.client.order.payments, order_id, timeout=timeout).get('items', [])
+
+
+class FakeGateway(PaymentGateway):
+    """
+    In-memory gateway. ``latency`` is the delay added to every call, either
+    seconds or a ``(low, high)`` range; ``error_rate`` is the share of calls
+    that raise GatewayError. Signatures use the same HMAC scheme as Razorpay,
+    keyed with ``key_secret``. Orders it didn't create itself (say, from an
+    earlier run) report a captured payment for ``unknown_paid_rate`` of ids
+    and a failed one otherwise, decided by hashing the id so repeated runs
+    agree. Safe to share between threads.
+    """
+
+    def __init__(self, latency=0, error_rate=0.0, key_secret='fake_secret', seed=None, unknown_paid_rate=0.5):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.unknown_paid_rate = unknown_paid_rate
+        self.key_secret = key_secret
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.orders = {}
+        self.payments = {}
+
+    def _call(self, timeout=None):
+        with self.lock:
+            if isinstance(self.latency, (tuple, list)):
+                delay = self.random.uniform(*self.latency)
+            else:
+                delay = self.latency
+            fail = self.error_rate and self.random.random() < self.error_rate
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise GatewayTimeout(f"No response within {timeout:.2f}s")
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise GatewayError("Injected gateway failure", transient=True, maybe_applied=False)
+
+    def create_order(self, amount, currency='INR', receipt=None, timeout=None):
+        self._call(timeout)
+        order = {
+            "id": f"order_fake{get_random_string(14)}",
+            "entity": "order",
+            "amount": amount,
+            "amount_paid": 0,
+            "amount_due": amount,
+            "currency": currency,
+            "receipt": receipt,
+            "status": "created",
+            "created_at": int(time.time()),
+        }
+        with self.lock:
+            self.orders[order["id"]] = order
+        return dict(order)
+
+    def sign_payment(self, order_id, payment_id):
+        return _hmac(self.key_secret, f"{order_id}|{payment_id}")
+
+    def capture(self, order_id):
+        """
+        Pays a fake order the way the checkout widget would and returns the
+        ``razorpay_*`` fields the client posts to payment-status.
+        """
+        with self.lock:
+            order = self.orders[order_id]
+            payment_id = f"pay_fake{get_random_string(14)}"
+            order.update(status="paid", amount_paid=order["amount"], amount_due=0)
+            self.payments[payment_id] = {
+                "id": payment_id,
+                "entity": "payment",
+                "amount": order["amount"],
+                "currency": order["currency"],
+                "order_id": order_id,
+                "status": "captured",
+                "captured": True,
+                "created_at": int(time.time()),
+            }
+        return {
+            "razorpay_order_id": order_id,
+            "razorpay_payment_id": payment_id,
+            "razorpay_signature": self.sign_payment(order_id, payment_id),
+        }
+
+    def verify_payment_signature(self, order_id, payment_id, signature):
+        expected = self.sign_payment(order_id or '', payment_id or '')
+        if not hmac.compare_digest(expected, signature or ''):
+            raise SignatureError("Payment signature mismatch")
+
+    def fetch_payment(self, payment_id, timeout=None):
+        self._call(timeout)
+        with self.lock:
+            if payment_id not in self.payments:
+                raise GatewayError(f"Payment {payment_id} does not exist")
+            return dict(self.payments[payment_id])
+
+    def fetch_order_payments(self, order_id, timeout=None):
+        self._call(timeout)
+        with self.lock:
+            if order_id in self.orders:
+                return [dict(p) for p in self.payments.values() if p["order_id"] == order_id]
+        digest = hashlib.sha256(order_id.encode('utf-8')).digest()
+        paid = int.from_bytes(digest[:4], 'big') / 2 ** 32 < self.unknown_paid_rate
+        return [{
+            "id": f"pay_fake{digest[4:11].hex()}",
+            "entity": "payment",
+            "order_id": order_id,
+            "status": "captured" if paid else "failed",
+            "captured": paid,
+        }]
+
+
+GATEWAYS = {
+    'razorpay': RazorpayGateway,
+    'fake': FakeGateway,
+}
+
+
+def build_gateway(name=None):
+    name = name or settings.PAYMENT_GATEWAY
+    gateway_class = GATEWAYS.get(name) or import_string(name)
+    if gateway_class is FakeGateway:
+        return FakeGateway(
+            latency=settings.PAYMENT_GATEWAY_FAKE_LATENCY,
+            error_rate=settings.PAYMENT_GATEWAY_FAKE_ERROR_RATE,
+            key_secret=settings.RAZORPAY_KEY_SECRET or 'fake_secret',
+        )
+    return gateway_class()
+
+
+@lru_cache(maxsize=None)
+def get_gateway():
+    from payment.resilience import ResilientGateway
+
+    return ResilientGateway(build_gateway())
+
+
+@receiver(setting_changed)
+def _reset_gateway(setting, **kwargs):
+    if setting.startswith('PAYMENT_GATEWAY') or setting.startswith('RAZORPAY_'):
+        get_gateway.cache_clear()
@@ -0,0 +1,135 @@
+"""
+Idempotency-Key support for the payment endpoints mobile clients retry.
+
+The first request with a given key inserts an IdempotencyKey row before the
+view runs; the unique (user, key) constraint makes that insert the lock, so
+a concurrent duplicate fails to claim it and waits for the stored response
+instead of creating a second order. Finished responses are replayed as-is,
+without touching the cart, the order tables or Razorpay.
+"""
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from payment.models import IdempotencyKey
+
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.1
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, cls=DjangoJSONEncoder, sort_keys=True, default=str)
+    raw = f"{request.method}\n{request.path}\n{body}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _claim(user, key, fingerprint):
+    """Returns the new row if we own the key, else None."""
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user,
+                key=key,
+                request_hash=fingerprint,
+                expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+            )
+    except IntegrityError:
+        return None
+
+
+def _stale(record, now):
+    if record.expires_at <= now:
+        return True
+    lock_timeout = timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+    return record.status == IdempotencyKey.PROCESSING and record.created_at <= now - lock_timeout
+
+
+def _replay(record):
+    response = Response(record.response_body, status=record.response_status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _conflict(message, code=status.HTTP_409_CONFLICT, retry_after=None):
+    response = Response({"error": message}, status=code)
+    if retry_after:
+        response['Retry-After'] = str(retry_after)
+    return response
+
+
+def idempotent(view):
+    """
+    Makes a DRF view/action idempotent for requests carrying an
+    ``Idempotency-Key`` header. Requests without the header run as before.
+    Responses with a 5xx status aren't stored, so the client can retry them.
+    """
+    @wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get(HEADER, '').strip()
+        if not key or not request.user.is_authenticated:
+            return view(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {"error": f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        fingerprint = request_fingerprint(request)
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            record = _claim(request.user, key, fingerprint)
+            if record is not None:
+                break
+
+            existing = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+            if existing is None:
+                continue  # deleted between our insert and read; try again
+            if _stale(existing, timezone.now()):
+                IdempotencyKey.objects.filter(pk=existing.pk, created_at=existing.created_at).delete()
+                continue
+            if existing.request_hash != fingerprint:
+                return _conflict(
+                    "Idempotency-Key was already used with a different request",
+                    code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            if existing.status == IdempotencyKey.DONE:
+                return _replay(existing)
+            if time.monotonic() >= deadline:
+                return _conflict("A request with this Idempotency-Key is still in progress", retry_after=1)
+            time.sleep(POLL_INTERVAL)
+
+        try:
+            response = view(self, request, *args, **kwargs)
+        except BaseException:
+            record.delete()
+            raise
+
+        if response.status_code >= 500:
+            record.delete()
+            return response
+        IdempotencyKey.objects.filter(pk=record.pk).update(
+            status=IdempotencyKey.DONE,
+            response_status=response.status_code,
+            response_body=getattr(response, 'data', None),
+        )
+        return response
+
+    return wrapper
+
+
+def purge_expired(now=None):
+    now = now or timezone.now()
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=now).delete()
+    return deleted
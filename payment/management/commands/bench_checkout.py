@@ -0,0 +1,105 @@
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from payment.gateways import get_gateway
+from store import cart
+from store.models import Basket, Category, CustomUser, Product
+
+
+class Rollback(Exception):
+    pass
+
+
+def _summary(label, timings, errors, elapsed):
+    if not timings:
+        return f"{label:>15}: no successful calls, {errors} errors"
+    timings.sort()
+    p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+    return (
+        f"{label:>15}: {len(timings) / elapsed:8.1f} req/s  median {statistics.median(timings):7.2f} ms"
+        f"  p95 {p95:7.2f} ms  errors {errors}"
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks user-cart-checkout and payment-status against the in-process fake gateway. "
+        "Users, carts and orders are created inside a transaction and rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=200)
+        parser.add_argument('--items', type=int, default=3, help="Cart lines per order.")
+        parser.add_argument('--latency', type=float, default=0.0, help="Fake gateway delay per call, seconds.")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Share of gateway calls that fail.")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        with override_settings(
+            PAYMENT_GATEWAY='fake',
+            PAYMENT_GATEWAY_FAKE_LATENCY=options['latency'],
+            PAYMENT_GATEWAY_FAKE_ERROR_RATE=options['error_rate'],
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+        ):
+            try:
+                with transaction.atomic():
+                    self._run(options)
+                    raise Rollback
+            except Rollback:
+                pass
+
+    def _run(self, options):
+        rng = random.Random(options['seed'])
+        gateway = get_gateway()
+        category = Category.objects.create(name="Bench checkout", slug=f"bench-checkout-{rng.random()}")
+        products = Product.objects.bulk_create([
+            Product(category=category, name=f"Bench {i}", description="", price=rng.randint(200, 9000), stock=10 ** 6)
+            for i in range(max(options['items'] * 4, 10))
+        ])
+        if not all(p.pk for p in products):
+            products = list(Product.objects.filter(category=category))
+
+        users = []
+        for i in range(options['orders']):
+            user = CustomUser.objects.create_user(username=f"bench-checkout-{i}", email=f"bench-checkout-{i}@example.com")
+            basket = Basket.objects.get(owner=user)
+            for product in rng.sample(products, options['items']):
+                cart.add_to_cart(basket, product.pk, quantity=rng.randint(1, 3))
+            users.append(user)
+        self.stdout.write(f"Prepared {len(users)} carts of {options['items']} lines")
+
+        client = APIClient()
+        checkouts, paid = [], []
+        errors = 0
+        start = time.perf_counter()
+        for user in users:
+            client.force_authenticate(user)
+            t0 = time.perf_counter()
+            response = client.post('/payments/user-cart-checkout/', {"first_name": "Bench"}, format='json')
+            if response.status_code != 200:
+                errors += 1
+                continue
+            checkouts.append(((time.perf_counter() - t0) * 1000, user, response.data["razorpay_order"]["id"]))
+        checkout_elapsed = time.perf_counter() - start
+        self.stdout.write(_summary("checkout", [ms for ms, _, _ in checkouts], errors, checkout_elapsed))
+
+        errors = 0
+        start = time.perf_counter()
+        for _, user, gateway_order_id in checkouts:
+            client.force_authenticate(user)
+            data = gateway.capture(gateway_order_id)
+            t0 = time.perf_counter()
+            response = client.post('/payments/payment-status/', data, format='json')
+            if response.status_code != 200:
+                errors += 1
+                continue
+            paid.append((time.perf_counter() - t0) * 1000)
+        self.stdout.write(_summary("payment-status", paid, errors, time.perf_counter() - start))
@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payment.webhooks import process_pending
+
+
+class Command(BaseCommand):
+    help = "Applies recorded Razorpay webhook events in batches. Use --loop to keep draining."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.WEBHOOK_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help="Keep polling instead of exiting when drained.")
+        parser.add_argument('--sleep', type=float, default=2.0, help="Seconds to wait when there is nothing to do.")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            handled = process_pending(options['batch_size'])
+            total += handled
+            if handled:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f"Processed {total} webhook events."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from payment.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Deletes stored Idempotency-Key responses past their TTL. Run daily from cron."
+
+    def handle(self, *args, **options):
+        deleted = purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency keys."))
@@ -0,0 +1,149 @@
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max, Sum
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from payment.gateways import get_gateway
+from store.cart import refresh_summaries, release_expired
+from store.models import Basket, BasketItem, Category, CustomUser, OrderItem, OutboundEmail, Product, StockReservation
+
+
+class Command(BaseCommand):
+    help = (
+        "Fires concurrent checkouts and payments for a few scarce products through a thread pool "
+        "against the configured database and the fake gateway, then checks nothing was oversold. "
+        "Uses committed data (threads need their own connections) and deletes it afterwards; "
+        "run it against a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=300)
+        parser.add_argument('--products', type=int, default=3)
+        parser.add_argument('--stock', type=int, default=25, help="Starting stock of every product.")
+        parser.add_argument('--workers', type=int, default=32, help="Concurrent threads.")
+        parser.add_argument('--latency', type=float, default=0.0, help="Fake gateway delay per call, seconds.")
+        parser.add_argument('--expire-holds', action='store_true',
+                            help="Let every checkout hold lapse before paying, so payments race for stock.")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--keep', action='store_true', help="Leave the generated data in place.")
+
+    def handle(self, *args, **options):
+        with override_settings(
+            PAYMENT_GATEWAY='fake',
+            PAYMENT_GATEWAY_FAKE_LATENCY=options['latency'],
+            PAYMENT_GATEWAY_FAKE_ERROR_RATE=0,
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+        ):
+            last_email = OutboundEmail.objects.aggregate(n=Max('pk'))['n'] or 0
+            category, products, users = self._setup(options)
+            try:
+                self._run(options, products, users)
+            finally:
+                if not options['keep']:
+                    # Confirmations queued for the fake buyers.
+                    OutboundEmail.objects.filter(pk__gt=last_email).delete()
+                    CustomUser.objects.filter(pk__in=[user.pk for user in users]).delete()
+                    Product.objects.filter(pk__in=[product.pk for product in products]).delete()
+                    category.delete()
+
+    def _setup(self, options):
+        rng = random.Random(options['seed'])
+        tag = f"stress-{int(time.time())}"
+        category = Category.objects.create(name=tag, slug=tag)
+        products = [
+            Product.objects.create(category=category, name=f"{tag} {i}", description="", price=100, stock=options['stock'])
+            for i in range(options['products'])
+        ]
+        users = [
+            CustomUser.objects.create_user(username=f"{tag}-{i}", email=f"{tag}-{i}@example.com")
+            for i in range(options['buyers'])
+        ]
+        # Carts are written directly, without holds: every buyer wants stock
+        # and checkout is where they first compete for it.
+        lines = []
+        baskets = Basket.objects.filter(owner__in=users)
+        for basket in baskets:
+            for product in rng.sample(products, rng.randint(1, len(products))):
+                lines.append(BasketItem(basket_object=basket, product_object=product, quantity=rng.randint(1, 2)))
+        BasketItem.objects.bulk_create(lines)
+        refresh_summaries(baskets)
+        self.stdout.write(
+            f"{len(users)} buyers, {len(lines)} cart lines over {len(products)} products with {options['stock']} each"
+        )
+        return category, products, users
+
+    def _post(self, user, path, data):
+        """One request on this thread's own connection: ``(user, status, ms, response data)``."""
+        client = APIClient()
+        client.force_authenticate(user)
+        started = time.perf_counter()
+        try:
+            response = client.post(path, data, format='json')
+        finally:
+            connection.close()
+        return user, response.status_code, (time.perf_counter() - started) * 1000, getattr(response, 'data', None)
+
+    def _checkout(self, user):
+        return self._post(user, '/payments/user-cart-checkout/', {"first_name": "Stress"})
+
+    def _pay(self, user, gateway_order_id):
+        return self._post(user, '/payments/payment-status/', get_gateway().capture(gateway_order_id))
+
+    def _phase(self, label, pool, fn, jobs):
+        started = time.perf_counter()
+        results = list(pool.map(lambda job: fn(*job), jobs))
+        elapsed = time.perf_counter() - started
+        timings = sorted(ms for _, _, ms, _ in results)
+        codes = {}
+        for _, code, _, _ in results:
+            codes[code] = codes.get(code, 0) + 1
+        if timings:
+            p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+            self.stdout.write(
+                f"{label:>9}: {len(results)} in {elapsed:.2f}s = {len(results) / elapsed:7.1f} req/s  "
+                f"median {statistics.median(timings):7.1f} ms  p99 {p99:7.1f} ms  statuses {dict(sorted(codes.items()))}"
+            )
+        return results
+
+    def _run(self, options, products, users):
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            results = self._phase('checkout', pool, self._checkout, [(user,) for user in users])
+            orders = [(user, data["razorpay_order"]["id"]) for user, code, _, data in results if code == 200]
+            if options['expire_holds']:
+                # Holds lapse and buyers who were turned away try again, so
+                # more orders are awaiting payment than there is stock.
+                for _ in range(3):
+                    lapsed = timezone.now() - timedelta(seconds=1)
+                    StockReservation.objects.filter(product__in=products).update(expires_at=lapsed)
+                    self.stdout.write(f"Released {release_expired()} lapsed holds")
+                    waiting = {user for user, _ in orders}
+                    retry = [(user,) for user in users if user not in waiting]
+                    if not retry:
+                        break
+                    results = self._phase('checkout', pool, self._checkout, retry)
+                    orders += [(user, data["razorpay_order"]["id"]) for user, code, _, data in results if code == 200]
+                StockReservation.objects.filter(product__in=products).update(expires_at=timezone.now() - timedelta(seconds=1))
+                self.stdout.write(f"Released {release_expired()} lapsed holds; {len(orders)} orders now race to pay")
+            to_pay = orders
+            self._phase('payment', pool, self._pay, to_pay)
+
+        oversold = []
+        for product in Product.objects.filter(pk__in=[product.pk for product in products]).order_by('pk'):
+            sold = OrderItem.objects.filter(product=product, order__status="Paid").aggregate(n=Sum('quantity'))['n'] or 0
+            held = StockReservation.objects.filter(product=product).aggregate(n=Sum('quantity'))['n'] or 0
+            self.stdout.write(f"  {product.name}: sold {sold}, held {held}, left {product.stock} of {options['stock']}")
+            if product.stock < 0 or sold > options['stock'] or sold + held + product.stock != options['stock']:
+                oversold.append(product.name)
+        if oversold:
+            raise CommandError(f"Stock invariant broken for: {', '.join(oversold)}")
+        self.stdout.write(self.style.SUCCESS("No oversells: sold + held + left == starting stock for every product."))
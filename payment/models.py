@@ -1,3 +1,4 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.contrib.auth import get_user_model
 from store.models import Order  # Correct import from store app
@@ -44,3 +45,63 @@ class Invoice(models.Model):
 
     def __str__(self):
         return f"Invoice {self.invoice_number} for Order {self.order.order_id}"
+
+
+# ---------------------------
+# Idempotency Keys
+# ---------------------------
+class IdempotencyKey(models.Model):
+    """
+    One row per (user, Idempotency-Key). The row is inserted before the view
+    runs, so its unique constraint is the lock that collapses concurrent
+    duplicates; once the view finishes, its response is stored for replay.
+    """
+    PROCESSING = 'processing'
+    DONE = 'done'
+    STATUS_CHOICES = [(PROCESSING, 'Processing'), (DONE, 'Done')]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PROCESSING)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('user', 'key')
+
+    def __str__(self):
+        return f"{self.user_id}:{self.key} ({self.status})"
+
+
+# ---------------------------
+# Webhook Events
+# ---------------------------
+class WebhookEvent(models.Model):
+    """
+    A verified Razorpay webhook delivery. ``event_id`` is unique, so a
+    redelivered event is dropped on insert; the worker drains pending rows.
+    """
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (PROCESSING, 'Processing'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    event_id = models.CharField(max_length=100, unique=True)
+    event = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'id'], name='webhook_status_id_idx')]
+
+    def __str__(self):
+        return f"{self.event} {self.event_id} ({self.status})"
@@ -0,0 +1,185 @@
+"""
+Settles orders the browser never came back for.
+
+Stale Pending orders are read in keyset-paginated chunks (``id > last``, on
+the status/id index), their gateway state is fetched on a bounded thread
+pool, and each chunk's transitions are written with a handful of bulk
+UPDATEs: captured orders become Paid, orders whose attempts all failed (or
+that never saw one) become Cancelled once they are old enough to give up on.
+Worker threads only talk to the gateway; all database work stays on the
+calling thread.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.db.models import Case, CharField, F, Value, When
+from django.utils import timezone
+
+from payment.gateways import CircuitOpen, GatewayError, get_gateway
+from payment.models import Payment
+from payment.services import queue_order_confirmations, settle_paid_orders
+from store.cart import OutOfStock
+from store.models import Order
+
+
+PAID = 'paid'
+FAILED = 'failed'
+
+
+@dataclass
+class ReconcileStats:
+    checked: int = 0
+    paid: int = 0
+    cancelled: int = 0
+    unchanged: int = 0
+    sold_out: int = 0
+    errors: int = 0
+    last_id: int = 0
+    error_samples: list = field(default_factory=list)
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in ('checked', 'paid', 'cancelled', 'sold_out', 'unchanged', 'errors', 'last_id')}
+
+
+def stale_orders(older_than, after_id=0, chunk_size=500):
+    """Yields chunks of pending orders created before ``older_than``, in id order."""
+    last_id = after_id
+    while True:
+        chunk = list(
+            Order.objects.filter(status="Pending", pk__gt=last_id, created_at__lt=older_than)
+            .exclude(razorpay_order_id=None)
+            .order_by('pk')
+            .only('id', 'razorpay_order_id', 'created_at')[:chunk_size]
+        )
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1].pk
+
+
+def classify(payments):
+    """``(PAID|FAILED|None, payment id)`` from a gateway order's payment attempts."""
+    captured = [p for p in payments if p.get('status') == 'captured']
+    if captured:
+        return PAID, captured[0].get('id')
+    if any(p.get('status') in ('created', 'authorized') for p in payments):
+        return None, None  # still in flight
+    return FAILED, payments[-1].get('id') if payments else None
+
+
+def _payment_id_case(pairs):
+    return Case(
+        *[When(order_id=order_id, then=Value(payment_id)) for order_id, payment_id in pairs if payment_id],
+        default=F('payment_id'),
+        output_field=CharField(),
+    )
+
+
+def apply_transitions(paid, failed, send_email=True):
+    """
+    ``paid``/``failed`` map order pk to gateway payment id. Only rows still
+    Pending are touched, so an order confirmed meanwhile by the browser or
+    the webhook is left alone. Paid orders whose stock is gone are
+    cancelled (their payment stays Paid, for refunding); the rest get their
+    confirmation emails queued. Returns the pks moved to Paid, to
+    Cancelled, and paid-but-sold-out.
+    """
+    now = timezone.now()
+    sold_out = []
+    with transaction.atomic():
+        pending = set(
+            Order.objects.select_for_update()
+            .filter(pk__in=[*paid, *failed], status="Pending")
+            .values_list('pk', flat=True)
+        )
+        paid = {pk: payment_id for pk, payment_id in paid.items() if pk in pending}
+        failed = {pk: payment_id for pk, payment_id in failed.items() if pk in pending}
+        if paid:
+            Order.objects.filter(pk__in=paid).update(status="Paid", updated_at=now)
+            Payment.objects.filter(order_id__in=paid).update(status="Paid", payment_id=_payment_id_case(paid.items()))
+            sold_out = _settle(list(paid))
+            if sold_out:
+                Order.objects.filter(pk__in=sold_out).update(status="Cancelled", updated_at=now)
+                paid = {pk: payment_id for pk, payment_id in paid.items() if pk not in sold_out}
+            if send_email and paid:
+                queue_order_confirmations(Order.objects.filter(pk__in=paid).select_related('user'))
+        if failed:
+            Order.objects.filter(pk__in=failed).update(status="Cancelled", updated_at=now)
+            Payment.objects.filter(order_id__in=failed, status="Created").update(
+                status="Failed", payment_id=_payment_id_case(failed.items())
+            )
+    return list(paid), list(failed), sold_out
+
+
+def _settle(order_ids):
+    """
+    Commits stock for the whole chunk at once; if something is short, falls
+    back to one order at a time so only the orders that can't be covered
+    miss out. Returns those.
+    """
+    try:
+        with transaction.atomic():
+            settle_paid_orders(order_ids)
+        return []
+    except OutOfStock:
+        pass
+    sold_out = []
+    for pk in order_ids:
+        try:
+            with transaction.atomic():
+                settle_paid_orders([pk])
+        except OutOfStock:
+            sold_out.append(pk)
+    return sold_out
+
+
+def _fetch(gateway, order):
+    try:
+        return order, gateway.fetch_order_payments(order.razorpay_order_id), None
+    except CircuitOpen:
+        raise
+    except GatewayError as exc:
+        return order, None, exc
+
+
+def reconcile(min_age, give_up_after, after_id=0, chunk_size=500, concurrency=16, send_email=True, on_chunk=None):
+    """
+    Reconciles every pending order older than ``min_age`` (a timedelta).
+    Orders with no captured payment are cancelled once older than
+    ``give_up_after``. ``on_chunk(stats)`` runs after each chunk is written,
+    which is where callers checkpoint ``stats.last_id``. Stops with
+    CircuitOpen if the gateway is refusing calls; the last chunk written is
+    the place to resume from.
+    """
+    gateway = get_gateway()
+    stats = ReconcileStats(last_id=after_id)
+    now = timezone.now()
+    give_up_before = now - give_up_after
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for chunk in stale_orders(now - min_age, after_id, chunk_size):
+            paid, failed = {}, {}
+            for order, payments, error in pool.map(lambda order: _fetch(gateway, order), chunk):
+                if error is not None:
+                    stats.errors += 1
+                    if len(stats.error_samples) < 10:
+                        stats.error_samples.append(f"{order.razorpay_order_id}: {error}")
+                    continue
+                state, payment_id = classify(payments)
+                if state == PAID:
+                    paid[order.pk] = payment_id
+                elif state == FAILED and order.created_at < give_up_before:
+                    failed[order.pk] = payment_id
+
+            paid_ids, cancelled_ids, sold_out_ids = apply_transitions(paid, failed, send_email)
+            stats.checked += len(chunk)
+            stats.paid += len(paid_ids)
+            stats.cancelled += len(cancelled_ids)
+            stats.sold_out += len(sold_out_ids)
+            stats.unchanged += len(chunk) - len(paid_ids) - len(cancelled_ids) - len(sold_out_ids)
+            stats.last_id = chunk[-1].pk
+
+            if on_chunk is not None:
+                on_chunk(stats)
+    return stats
@@ -0,0 +1,214 @@
+"""
+Keeps a slow or failing payment gateway from taking the site down with it.
+
+ResilientGateway wraps any PaymentGateway. Every network call gets an
+overall deadline, transient failures are retried a bounded number of times
+with full-jitter backoff, and a circuit breaker refuses calls outright for
+a while once most recent calls have failed, so workers fail fast instead of
+queueing behind a dead gateway. Latency and outcome counters are kept per
+worker process and served by the gateway-metrics endpoint.
+"""
+import random
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.conf import settings
+
+from payment.gateways import CircuitOpen, GatewayError, GatewayTimeout, get_gateway
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Opens when at least ``min_calls`` of the last ``window`` calls were made
+    and ``failure_ratio`` of them failed. After ``reset_timeout`` seconds one
+    trial call is let through: success closes the circuit, failure reopens it.
+    """
+
+    def __init__(self, window=20, min_calls=10, failure_ratio=0.5, reset_timeout=30):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.outcomes = deque(maxlen=window)
+        self.state = CLOSED
+        self.opened_at = None
+        self.trial_running = False
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return 0
+        return max(0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def allow(self):
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.retry_after() > 0:
+                return False
+            if self.trial_running:
+                return False
+            self.state = HALF_OPEN
+            self.trial_running = True
+            return True
+
+    def record(self, ok):
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.trial_running = False
+                if ok:
+                    self.state, self.opened_at = CLOSED, None
+                    self.outcomes.clear()
+                else:
+                    self.state, self.opened_at = OPEN, time.monotonic()
+                return
+            self.outcomes.append(ok)
+            failures = self.outcomes.count(False)
+            if len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.failure_ratio:
+                self.state, self.opened_at = OPEN, time.monotonic()
+
+    def snapshot(self):
+        with self.lock:
+            calls = len(self.outcomes)
+            return {
+                "state": self.state,
+                "window_calls": calls,
+                "window_failures": self.outcomes.count(False),
+                "retry_after": round(self.retry_after(), 1) if self.state != CLOSED else 0,
+            }
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 2)
+
+
+class GatewayMetrics:
+    """Counters plus the most recent call latencies, per operation."""
+
+    COUNTERS = ('calls', 'ok', 'failed', 'timeouts', 'retries', 'rejected')
+
+    def __init__(self, sample_size=1000):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(lambda: dict.fromkeys(self.COUNTERS, 0))
+        self.latencies = defaultdict(lambda: deque(maxlen=sample_size))
+
+    def count(self, operation, counter):
+        with self.lock:
+            self.counters[operation][counter] += 1
+
+    def observe(self, operation, ms):
+        with self.lock:
+            self.latencies[operation].append(ms)
+
+    def snapshot(self):
+        with self.lock:
+            data = {}
+            for operation, counters in self.counters.items():
+                ordered = sorted(self.latencies[operation])
+                data[operation] = {
+                    **counters,
+                    "error_rate": round(counters['failed'] / counters['calls'], 4) if counters['calls'] else 0.0,
+                    "latency_ms": {
+                        "p50": _percentile(ordered, 0.5),
+                        "p95": _percentile(ordered, 0.95),
+                        "p99": _percentile(ordered, 0.99),
+                        "max": round(ordered[-1], 2) if ordered else None,
+                    },
+                }
+            return data
+
+
+metrics = GatewayMetrics()
+
+
+class ResilientGateway:
+    """
+    ``create_order`` is only retried when the failed attempt can't have
+    reached the gateway, so a timeout never leaves a second order behind;
+    reads are retried on any transient failure. Signature checks are local
+    HMACs and pass straight through.
+    """
+
+    def __init__(self, gateway, breaker=None):
+        self.gateway = gateway
+        self.breaker = breaker or CircuitBreaker(
+            window=settings.PAYMENT_GATEWAY_BREAKER_WINDOW,
+            min_calls=settings.PAYMENT_GATEWAY_BREAKER_MIN_CALLS,
+            failure_ratio=settings.PAYMENT_GATEWAY_BREAKER_FAILURE_RATIO,
+            reset_timeout=settings.PAYMENT_GATEWAY_BREAKER_RESET_TIMEOUT,
+        )
+
+    def __getattr__(self, name):
+        # Anything else (e.g. FakeGateway.capture) goes to the backend untouched.
+        return getattr(self.gateway, name)
+
+    def _call(self, operation, fn, *args, idempotent=False, **kwargs):
+        deadline = time.monotonic() + settings.PAYMENT_GATEWAY_DEADLINE
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                metrics.count(operation, 'rejected')
+                raise CircuitOpen("Payment gateway unavailable", retry_after=max(1, round(self.breaker.retry_after())))
+
+            metrics.count(operation, 'calls')
+            started = time.monotonic()
+            try:
+                result = fn(*args, timeout=max(0.01, deadline - started), **kwargs)
+            except GatewayError as exc:
+                metrics.observe(operation, (time.monotonic() - started) * 1000)
+                metrics.count(operation, 'failed')
+                if isinstance(exc, GatewayTimeout):
+                    metrics.count(operation, 'timeouts')
+                # Rejections such as bad requests say nothing about gateway health.
+                self.breaker.record(not exc.transient)
+                retryable = exc.transient and (idempotent or not exc.maybe_applied)
+                if not retryable or attempt >= settings.PAYMENT_GATEWAY_RETRIES:
+                    raise
+                backoff = random.uniform(0, min(
+                    settings.PAYMENT_GATEWAY_BACKOFF_CAP, settings.PAYMENT_GATEWAY_BACKOFF * 2 ** attempt
+                ))
+                if time.monotonic() + backoff >= deadline:
+                    raise
+                time.sleep(backoff)
+                attempt += 1
+                metrics.count(operation, 'retries')
+                continue
+            except Exception:
+                self.breaker.record(False)
+                raise
+            metrics.observe(operation, (time.monotonic() - started) * 1000)
+            metrics.count(operation, 'ok')
+            self.breaker.record(True)
+            return result
+
+    def create_order(self, amount, currency='INR', receipt=None):
+        return self._call('create_order', self.gateway.create_order, amount, currency=currency, receipt=receipt)
+
+    def fetch_payment(self, payment_id):
+        return self._call('fetch_payment', self.gateway.fetch_payment, payment_id, idempotent=True)
+
+    def fetch_order_payments(self, order_id):
+        return self._call('fetch_order_payments', self.gateway.fetch_order_payments, order_id, idempotent=True)
+
+    def verify_payment_signature(self, order_id, payment_id, signature):
+        return self.gateway.verify_payment_signature(order_id, payment_id, signature)
+
+    def verify_webhook_signature(self, body, signature, secret):
+        return self.gateway.verify_webhook_signature(body, signature, secret)
+
+
+def gateway_metrics():
+    gateway = get_gateway()
+    return {
+        "backend": type(gateway.gateway).__name__,
+        "circuit": gateway.breaker.snapshot(),
+        "operations": metrics.snapshot(),
+    }
@@ -0,0 +1,293 @@
+"""
+Checkout and payment bookkeeping shared by the payment views.
+
+Checkout runs in two short steps around the Razorpay call so no database
+transaction stays open while we wait on the network: ``create_order``
+holds stock and writes the Order, its items and the Payment atomically,
+then ``attach_gateway_order`` (or ``abandon_order`` if Razorpay failed)
+records the outcome.
+
+Confirming a payment (``mark_order_paid``) is shared by the browser
+callback and the webhook worker, and only the first of them to arrive does
+anything. That is also when the order's stock is committed for good and
+its confirmation email is queued (store.outbox), in the same transaction.
+"""
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from payment.models import Payment
+from store.cart import OutOfStock, commit_stock, hold_for_checkout, refresh_summaries
+from store.models import Basket, BasketItem, Order, OrderItem
+from store.outbox import enqueue
+
+
+logger = logging.getLogger(__name__)
+
+ORDER_DETAIL_FIELDS = (
+    'first_name', 'last_name', 'phone_number', 'city', 'state', 'pincode',
+    'shipping_address', 'billing_address', 'notes',
+)
+
+
+def load_cart(user):
+    """The user's active basket and its open items with products and holds, in two queries."""
+    basket = Basket.objects.filter(owner=user, is_active=True).first()
+    if basket is None:
+        return None, []
+    items = list(
+        BasketItem.objects.filter(basket_object=basket, is_active=True, is_order_placed=False)
+        .exclude(product_object=None)
+        .select_related('product_object', 'reservation')
+        .order_by('id')
+    )
+    return basket, items
+
+
+def cart_total(items):
+    return sum((item.product_object.price * item.quantity for item in items), 0)
+
+
+@transaction.atomic
+def create_order(user, items, details):
+    """
+    Holds stock for every item, then creates the Order, its OrderItems (one
+    bulk insert) and the Payment. Raises store.cart.OutOfStock, rolling
+    everything back, if an item can't be covered.
+    """
+    hold_for_checkout(items)
+    total = cart_total(items)
+    order = Order.objects.create(
+        user=user,
+        order_id=get_random_string(12),
+        amount=total,
+        status="Pending",
+        **{field: details.get(field) for field in ORDER_DETAIL_FIELDS},
+    )
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=item.product_object, quantity=item.quantity, price=item.product_object.price)
+        for item in items
+    ])
+    payment = Payment.objects.create(
+        user=user,
+        order=order,
+        amount=total,
+        status="Created",
+        payment_method="online",   # Razorpay
+    )
+    return order, payment
+
+
+def attach_gateway_order(order, payment, gateway_order_id):
+    Order.objects.filter(pk=order.pk).update(razorpay_order_id=gateway_order_id)
+    Payment.objects.filter(pk=payment.pk).update(payment_id=gateway_order_id)
+    order.razorpay_order_id = payment.payment_id = gateway_order_id
+
+
+def abandon_order(order, payment):
+    """The gateway order couldn't be created; the cart and its holds stay as they were."""
+    with transaction.atomic():
+        Order.objects.filter(pk=order.pk).update(status="Cancelled")
+        Payment.objects.filter(pk=payment.pk).update(status="Failed")
+
+
+def mark_order_paid(order, gateway_payment_id):
+    """
+    Moves the order and its payment to Paid, commits the stock it holds,
+    marks the basket items it was made from as placed and queues the
+    confirmation email. Returns False, changing nothing, unless the order
+    is still Pending: a late or repeated capture must not revive an order
+    that was paid already or cancelled (abandoned, or sold out and due a
+    refund).
+
+    If the stock is gone (its holds lapsed and someone else bought it) the
+    payment is still recorded, the order is Cancelled instead and
+    OutOfStock is raised; the money has to be refunded.
+    """
+    sold_out = None
+    with transaction.atomic():
+        updated = Order.objects.filter(pk=order.pk, status="Pending").update(
+            status="Paid", updated_at=timezone.now()
+        )
+        if not updated:
+            if Order.objects.filter(pk=order.pk, status="Cancelled").exists():
+                logger.warning("capture %s for cancelled order %s ignored", gateway_payment_id, order.order_id)
+            return False
+        Payment.objects.filter(order=order).update(payment_id=gateway_payment_id, status="Paid")
+        try:
+            with transaction.atomic():
+                settle_paid_orders([order.pk])
+        except OutOfStock as exc:
+            Order.objects.filter(pk=order.pk).update(status="Cancelled", updated_at=timezone.now())
+            sold_out = exc
+        else:
+            queue_order_confirmations([order])
+    if sold_out is not None:
+        order.status = "Cancelled"
+        logger.warning("order %s paid (%s) but out of stock: %s", order.order_id, gateway_payment_id, sold_out.requested)
+        raise sold_out
+    order.status = "Paid"
+    return True
+
+
+def settle_paid_orders(order_ids):
+    """Commits stock for these paid orders, then places their basket lines."""
+    quantities, owners = {}, set()
+    rows = OrderItem.objects.filter(order_id__in=order_ids).exclude(product=None)
+    for owner_id, product_id, quantity in rows.values_list('order__user_id', 'product_id', 'quantity'):
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+        owners.add(owner_id)
+    commit_stock(quantities, owners)
+    place_ordered_items(order_ids)
+
+
+def place_ordered_items(order_ids):
+    """
+    Marks the open basket lines that went into these orders as placed, i.e.
+    the owner's lines for products on the order. Lines added to the cart
+    after checkout stay in the basket.
+    """
+    ordered = OrderItem.objects.filter(
+        order_id__in=order_ids,
+        order__user_id=OuterRef('basket_object__owner_id'),
+        product_id=OuterRef('product_object_id'),
+    )
+    items = BasketItem.objects.filter(is_active=True, is_order_placed=False).filter(Exists(ordered))
+    owners = set(Order.objects.filter(pk__in=order_ids).values_list('user_id', flat=True))
+    items.update(is_order_placed=True)
+    refresh_summaries(Basket.objects.filter(owner_id__in=owners))
+
+
+def mark_payment_failed(order, gateway_payment_id):
+    return Payment.objects.filter(order=order, status="Created").update(payment_id=gateway_payment_id, status="Failed")
+
+
+def order_confirmation_html(order):
+    html_content = f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+    <style>
+        body {{
+        font-family: Arial, sans-serif;
+        background: #f9f9f9;
+        padding: 20px;
+        color: #333;
+        }}
+        .container {{
+        max-width: 600px;
+        margin: auto;
+        background: #fff;
+        border-radius: 8px;
+        padding: 20px;
+        box-shadow: 0px 2px 8px rgba(0,0,0,0.1);
+        }}
+        h2 {{ color: #2c3e50; }}
+        table {{
+        width: 100%;
+        border-collapse: collapse;
+        margin-top: 15px;
+        }}
+        th, td {{
+        border: 1px solid #ddd;
+        padding: 10px;
+        text-align: left;
+        }}
+        th {{
+        background: #2c3e50;
+        color: #fff;
+        }}
+        tfoot td {{
+        font-weight: bold;
+        }}
+        .address {{
+        margin-top: 20px;
+        background: #f2f2f2;
+        padding: 10px;
+        border-radius: 5px;
+        }}
+        .footer {{
+        margin-top: 20px;
+        font-size: 12px;
+        color: #777;
+        text-align: center;
+        }}
+    </style>
+    </head>
+    <body>
+    <div class="container">
+        <h2>Thank you for your purchase, {order.first_name}!</h2>
+        <p>Your order <strong>{order.order_id}</strong> has been confirmed.</p>
+
+        <h3>Order Details:</h3>
+        <table>
+        <thead>
+            <tr>
+            <th>Product</th>
+            <th>Price (₹)</th>
+            <th>Qty</th>
+            <th>Total (₹)</th>
+            </tr>
+        </thead>
+        <tbody>
+    """
+
+    # Loop through order items
+    for item in order.items.select_related('product'):
+        html_content += f"""
+            <tr>
+            <td>{item.product.name}</td>
+            <td>{item.price}</td>
+            <td>{item.quantity}</td>
+            <td>{item.get_total_price()}</td>
+            </tr>
+        """
+
+    html_content += f"""
+        </tbody>
+        <tfoot>
+            <tr>
+            <td colspan="3">Total</td>
+            <td>{order.amount}</td>
+            </tr>
+        </tfoot>
+        </table>
+
+        <div class="address">
+        <h3>Shipping Address</h3>
+        <p>{order.shipping_address}<br>
+            {order.city}, {order.state} - {order.pincode}<br>
+            Phone: {order.phone_number}
+        </p>
+        </div>
+
+        <div class="footer">
+        <p>HHH Perfumes &copy; {order.created_at.year}</p>
+        </div>
+    </div>
+    </body>
+    </html>
+    """
+    return html_content
+
+
+def order_confirmation(order):
+    email = EmailMessage(
+        subject=f"Order Confirmation - {order.order_id}",
+        body=order_confirmation_html(order),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[order.user.email],
+        cc=["info@hhhperfumes.in"],
+    )
+    email.content_subtype = "html"
+    return email
+
+
+def queue_order_confirmations(orders):
+    """Queues confirmation emails for paid orders (with ``user`` loaded) in one INSERT."""
+    return enqueue(*[order_confirmation(order) for order in orders])
@@ -0,0 +1,127 @@
+"""
+Razorpay webhook ingestion.
+
+The endpoint only verifies the signature and inserts a WebhookEvent, which
+the unique ``event_id`` dedupes, so Razorpay is acknowledged in a couple of
+queries. ``process_pending`` (run by the process_webhook_events worker)
+claims pending events in batches and does the slow part: status changes,
+basket updates and queueing the confirmation email.
+"""
+import hashlib
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from payment.models import WebhookEvent
+from payment.services import mark_order_paid, mark_payment_failed
+from store.cart import OutOfStock
+from store.models import Order
+
+
+logger = logging.getLogger(__name__)
+
+EVENT_ID_HEADER = 'HTTP_X_RAZORPAY_EVENT_ID'
+SIGNATURE_HEADER = 'HTTP_X_RAZORPAY_SIGNATURE'
+PAID_EVENTS = ('payment.captured', 'order.paid')
+FAILED_EVENTS = ('payment.failed',)
+
+
+class RetryLater(Exception):
+    pass
+
+
+def event_id(request, body):
+    # Razorpay sends the id as a header; fall back to the body hash so a
+    # redelivery without it still dedupes.
+    return request.META.get(EVENT_ID_HEADER) or hashlib.sha256(body).hexdigest()
+
+
+def record_event(event_id, payload):
+    """Stores the event unless it was seen before. One INSERT either way."""
+    WebhookEvent.objects.bulk_create(
+        [WebhookEvent(event_id=event_id, event=str(payload.get('event', ''))[:100], payload=payload)],
+        ignore_conflicts=True,
+    )
+
+
+def _entity(payload, name):
+    return ((payload.get('payload') or {}).get(name) or {}).get('entity') or {}
+
+
+def claim_batch(batch_size=None):
+    """
+    Marks up to ``batch_size`` pending events as processing and returns them.
+    Events whose handler failed wait WEBHOOK_RETRY_DELAY before being
+    retried; events claimed by a worker that died are picked up again after
+    WEBHOOK_LOCK_TIMEOUT.
+    """
+    batch_size = batch_size or settings.WEBHOOK_BATCH_SIZE
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.WEBHOOK_LOCK_TIMEOUT)
+    retry = now - timedelta(seconds=settings.WEBHOOK_RETRY_DELAY)
+    due = (
+        Q(status=WebhookEvent.PENDING, locked_at__isnull=True)
+        | Q(status=WebhookEvent.PENDING, locked_at__lt=retry)
+        | Q(status=WebhookEvent.PROCESSING, locked_at__lt=stale)
+    )
+    with transaction.atomic():
+        ids = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(due)
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if ids:
+            WebhookEvent.objects.filter(pk__in=ids).update(
+                status=WebhookEvent.PROCESSING, locked_at=now, attempts=F('attempts') + 1
+            )
+    return list(WebhookEvent.objects.filter(pk__in=ids).order_by('id')) if ids else []
+
+
+def handle_event(event):
+    payment = _entity(event.payload, 'payment')
+    if event.event not in PAID_EVENTS + FAILED_EVENTS:
+        return
+    gateway_order_id = _entity(event.payload, 'order').get('id') or payment.get('order_id')
+    order = Order.objects.filter(razorpay_order_id=gateway_order_id).select_related('user').first()
+    if order is None:
+        # The webhook can beat checkout's attach_gateway_order commit.
+        raise RetryLater(f"no order for {gateway_order_id}")
+
+    if event.event in FAILED_EVENTS:
+        mark_payment_failed(order, payment.get('id'))
+        return
+    try:
+        mark_order_paid(order, payment.get('id'))
+    except OutOfStock:
+        pass  # recorded as paid-but-cancelled; nothing to retry
+
+
+def process_pending(batch_size=None):
+    """Processes one batch and returns the number of events handled."""
+    events = claim_batch(batch_size)
+    if not events:
+        return 0
+
+    now = timezone.now()
+    try:
+        for event in events:
+            try:
+                handle_event(event)
+            except Exception as exc:
+                logger.warning("webhook event %s failed: %s", event.event_id, exc)
+                retry = event.attempts < settings.WEBHOOK_MAX_ATTEMPTS
+                event.status = WebhookEvent.PENDING if retry else WebhookEvent.FAILED
+                event.last_error = str(exc)
+                event.locked_at = now  # retried after WEBHOOK_RETRY_DELAY
+            else:
+                event.status = WebhookEvent.DONE
+                event.processed_at = now
+                event.locked_at = None
+    finally:
+        WebhookEvent.objects.bulk_update(events, ['status', 'last_error', 'locked_at', 'processed_at'])
+    return len(events)
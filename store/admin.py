@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, Product, Category,ProductMedia
+from django.utils import timezone
+from .models import CustomUser, Product, Category,ProductMedia, FlashSale, OutboundEmail
 
 @admin.register(CustomUser)
 class CustomUserAdmin(UserAdmin):
@@ -25,3 +26,23 @@ class CustomUserAdmin(UserAdmin):
 admin.site.register(Product)
 admin.site.register(ProductMedia)
 admin.site.register(Category)
+
+
+@admin.register(FlashSale)
+class FlashSaleAdmin(admin.ModelAdmin):
+    list_display = ['product', 'starts_at', 'ends_at', 'units', 'per_customer_limit', 'committed_units', 'finalized_at']
+    readonly_fields = ['initial_units', 'committed_units', 'finalized_at']
+    list_select_related = ['product']
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'to', 'status', 'attempts', 'send_after', 'sent_at']
+    list_filter = ['status']
+    search_fields = ['subject']
+    readonly_fields = ['attempts', 'last_error', 'locked_at', 'created_at', 'sent_at']
+    actions = ['requeue']
+
+    @admin.action(description="Send again")
+    def requeue(self, request, queryset):
+        queryset.update(status=OutboundEmail.PENDING, attempts=0, send_after=timezone.now(), locked_at=None)
@@ -0,0 +1,281 @@
+"""
+Bulk product writes: streaming import/export as CSV or JSON Lines, and
+set-based stock/price mutations.
+
+Rows are read one at a time, validated in batches and written with
+bulk_create/bulk_update, one transaction per batch, so memory stays flat
+however big the file is. Because bulk writes bypass model signals, the
+search index, facet counts and catalog version are refreshed once at the
+end of an import or mutation rather than once per row.
+"""
+import csv
+import io
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, IntegerField, Value, When
+from django.db.models.functions import Round
+from django.utils import timezone
+
+from store.cache import bump_catalog_version
+from store.cart import refresh_baskets_for_products
+from store.facets import rebuild_facet_counts
+from store.models import Category, Product
+from store.search import index_products
+from store.serializers import TWO_PLACES, ProductImportSerializer
+
+
+FORMATS = ('csv', 'jsonl')
+EXPORT_FIELDS = ('id', 'brand', 'category', 'name', 'description', 'price', 'stock', 'available')
+WRITE_FIELDS = ('brand', 'category', 'name', 'description', 'price', 'stock', 'available')
+DEFAULT_BATCH_SIZE = 500
+UPDATE_CHUNK_SIZE = 500
+
+
+def guess_format(filename, default='csv'):
+    name = (filename or '').lower()
+    if name.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def text_stream(binary):
+    # utf-8-sig drops the BOM spreadsheet exports like to add.
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+
+
+def read_rows(stream, fmt):
+    """Yields ``(line number, row dict or None, parse error or None)``."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            row = {key.strip(): value for key, value in row.items() if key}
+            yield reader.line_num, row, None
+        return
+    for line_no, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield line_no, None, f"invalid JSON: {exc}"
+            continue
+        if not isinstance(row, dict):
+            yield line_no, None, "expected a JSON object"
+            continue
+        yield line_no, row, None
+
+
+class CategoryLookup:
+    """Every category loaded once, addressable by id, slug or name."""
+
+    def __init__(self):
+        self.by_key = {}
+        for category in Category.objects.only('id', 'slug', 'name'):
+            self.by_key[str(category.pk)] = category
+            self.by_key[category.slug.lower()] = category
+            self.by_key.setdefault(category.name.strip().lower(), category)
+
+    def get(self, value):
+        return self.by_key.get(str(value).strip().lower())
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ProductImporter:
+    """
+    Validates and writes rows. A row with an ``id`` updates only the columns
+    it carries on that product, one without creates a new product. Invalid
+    rows are reported through ``on_error(line, errors)`` and skipped; the
+    rest of the batch is written.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, on_error=None):
+        self.batch_size = batch_size
+        self.on_error = on_error
+        self.categories = CategoryLookup()
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+
+    def error(self, line, errors):
+        self.failed += 1
+        if self.on_error is not None:
+            self.on_error(line, errors)
+
+    def run(self, rows):
+        started = timezone.now()
+        for batch in _batches(rows, self.batch_size):
+            self._write(self._validate(batch))
+
+        if self.created or self.updated:
+            touched = Product.objects.filter(updated_at__gte=started)
+            index_products(touched)
+            if self.updated:
+                refresh_baskets_for_products(touched.values('id'))
+            rebuild_facet_counts()
+            bump_catalog_version()
+        return {"created": self.created, "updated": self.updated, "failed": self.failed}
+
+    def _validate(self, batch):
+        context = {'categories': self.categories}
+        ids = set()
+        for line, row, error in batch:
+            if row is not None and str(row.get('id') or '').strip().isdigit():
+                ids.add(int(row['id']))
+        existing = Product.objects.in_bulk(ids) if ids else {}
+
+        valid = []
+        for line, row, error in batch:
+            if error:
+                self.error(line, {"row": [error]})
+                continue
+            # Updates are partial: missing columns keep their value instead
+            # of taking the create defaults.
+            partial = str(row.get('id') or '').strip() != ''
+            serializer = ProductImportSerializer(data=row, context=context, partial=partial)
+            if not serializer.is_valid():
+                self.error(line, serializer.errors)
+                continue
+            data = dict(serializer.validated_data)
+            pk = data.pop('id', None)
+            if pk is not None and pk not in existing:
+                self.error(line, {"id": [f"Product {pk} does not exist."]})
+                continue
+            if pk is not None and not data:
+                self.error(line, {"row": ["Nothing to change."]})
+                continue
+            valid.append((line, existing.get(pk), data))
+        return valid
+
+    @transaction.atomic
+    def _write(self, valid):
+        now = timezone.now()
+        to_create, to_update = [], {}
+        for line, product, data in valid:
+            if product is None:
+                to_create.append(Product(**data))
+                continue
+            for field, value in data.items():
+                setattr(product, field, value)
+            product.updated_at = now  # bulk_update skips auto_now
+            # One UPDATE per column set, so a row never writes columns it didn't send.
+            to_update.setdefault(tuple(sorted(data)), []).append(product)
+
+        if to_create:
+            Product.objects.bulk_create(to_create, batch_size=self.batch_size)
+        for fields, products in to_update.items():
+            Product.objects.bulk_update(products, list(fields) + ['updated_at'], batch_size=self.batch_size)
+        self.created += len(to_create)
+        self.updated += sum(len(products) for products in to_update.values())
+
+
+def export_rows(queryset=None):
+    queryset = queryset if queryset is not None else Product.objects.all()
+    rows = queryset.order_by('id').values_list(
+        'id', 'brand', 'category__slug', 'name', 'description', 'price', 'stock', 'available'
+    )
+    for row in rows.iterator(chunk_size=2000):
+        yield dict(zip(EXPORT_FIELDS, row))
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def export_lines(fmt, queryset=None):
+    """Yields the export one line at a time, header first for CSV."""
+    rows = export_rows(queryset)
+    if fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+        return
+    writer = csv.DictWriter(_Echo(), fieldnames=EXPORT_FIELDS, lineterminator='\n')
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _stock_expression(op):
+    if 'stock' in op:
+        return Value(op['stock'])
+    return F('stock') + Value(op['stock_delta'])
+
+
+def _price_expression(op):
+    if 'price' in op:
+        return Value(op['price'])
+    factor = 1 + op['price_percent'] / 100
+    return Round(F('price') * Value(factor), 2)
+
+
+def _check(op, product):
+    if product is None:
+        return 'not_found'
+    if op.get('stock_delta', 0) < 0 and product.stock + op['stock_delta'] < 0:
+        return 'insufficient_stock'
+    return 'ok'
+
+
+def apply_product_operations(operations, all_or_nothing=False):
+    """
+    Applies validated ProductOperationSerializer rows in one transaction.
+
+    The target rows are locked and read with one query, then each chunk is
+    written with a single UPDATE whose CASE branches use F() expressions.
+    Operations that can't apply (unknown id, stock going negative) are
+    reported and skipped, or abort everything when ``all_or_nothing`` is set.
+    Returns ``(applied, results)`` with one compact result per product.
+    """
+    ids = [op['id'] for op in operations]
+    with transaction.atomic():
+        products = Product.objects.select_for_update().only('id', 'stock').in_bulk(ids)
+        statuses = {op['id']: _check(op, products.get(op['id'])) for op in operations}
+        ok = [op for op in operations if statuses[op['id']] == 'ok']
+
+        if all_or_nothing and len(ok) != len(operations):
+            ok = []
+        now = timezone.now()
+        for start in range(0, len(ok), UPDATE_CHUNK_SIZE):
+            chunk = ok[start:start + UPDATE_CHUNK_SIZE]
+            changes = {'updated_at': Value(now)}
+            stock = [When(pk=op['id'], then=_stock_expression(op)) for op in chunk if {'stock', 'stock_delta'} & op.keys()]
+            price = [When(pk=op['id'], then=_price_expression(op)) for op in chunk if {'price', 'price_percent'} & op.keys()]
+            if stock:
+                changes['stock'] = Case(*stock, default=F('stock'), output_field=IntegerField())
+            if price:
+                changes['price'] = Case(
+                    *price, default=F('price'), output_field=DecimalField(max_digits=10, decimal_places=2)
+                )
+            Product.objects.filter(pk__in=[op['id'] for op in chunk]).update(**changes)
+
+        repriced = [op['id'] for op in ok if {'price', 'price_percent'} & op.keys()]
+        if repriced:
+            refresh_baskets_for_products(repriced)
+        if ok:
+            transaction.on_commit(rebuild_facet_counts)
+            transaction.on_commit(bump_catalog_version)
+
+    applied = {op['id'] for op in ok}
+    current = Product.objects.filter(pk__in=applied).values_list('id', 'stock', 'price') if applied else []
+    values = {pk: (stock, price) for pk, stock, price in current}
+    results = []
+    for pk in ids:
+        result = {"id": pk, "status": statuses[pk] if statuses[pk] != 'ok' or pk in applied else 'skipped'}
+        if pk in values:
+            result["stock"], result["price"] = values[pk][0], str(values[pk][1].quantize(TWO_PLACES))
+        results.append(result)
+    return bool(applied), results
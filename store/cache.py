@@ -0,0 +1,161 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from store.models import Category, HeroSection, Product
+
+
+VERSION_KEY = 'catalog:version'
+MODIFIED_KEY = 'catalog:modified'
+HITS_KEY = 'catalog:stats:hits'
+MISSES_KEY = 'catalog:stats:misses'
+
+
+def get_catalog_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def _initial_version():
+    # Millisecond clock so a lost/evicted counter never restarts below a
+    # version that may still have responses cached against it.
+    return int(time.time() * 1000)
+
+
+def get_catalog_version():
+    cache = get_catalog_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, _initial_version(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """
+    Invalidates every cached catalog response by moving to a new version.
+    Old entries are never read again and age out of the backend.
+    """
+    cache = get_catalog_cache()
+    cache.set(MODIFIED_KEY, int(time.time()), timeout=None)
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        version = _initial_version()
+        cache.set(VERSION_KEY, version, timeout=None)
+        return version
+
+
+def _rows_last_modified():
+    latest = [model.objects.aggregate(latest=Max('updated_at'))['latest'] for model in (Product, Category, HeroSection)]
+    return max((int(value.timestamp()) for value in latest if value is not None), default=0)
+
+
+def get_catalog_last_modified(version=None):
+    """
+    Epoch seconds of the newest catalog change at ``version``: the latest
+    updated_at of the products, categories and hero sections served, or the
+    last version bump if later (deletes, media and stock changes don't move
+    updated_at). Worked out once per version, so it survives losing the
+    bump time to an eviction or restart.
+    """
+    version = version if version is not None else get_catalog_version()
+    cache = get_catalog_cache()
+    key = f'{MODIFIED_KEY}:{version}'
+    modified = cache.get(key)
+    if modified is None:
+        modified = max(_rows_last_modified(), cache.get(MODIFIED_KEY) or 0)
+        cache.set(key, modified, timeout=settings.CATALOG_CACHE_TIMEOUT)
+    return modified
+
+
+def _count(key):
+    cache = get_catalog_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+
+
+def get_cache_stats():
+    cache = get_catalog_cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "backend": settings.CATALOG_CACHE_BACKEND,
+        "version": get_catalog_version(),
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / total, 4) if total else 0.0,
+    }
+
+
+def response_cache_key(request, version=None):
+    if version is None:
+        version = get_catalog_version()
+    digest = hashlib.sha1(request.build_absolute_uri().encode('utf-8')).hexdigest()
+    return f'catalog:response:{version}:{digest}'
+
+
+def catalog_etag(request, version=None):
+    """Strong ETag for one URL and representation at a catalog version."""
+    if version is None:
+        version = get_catalog_version()
+    accept = request.META.get('HTTP_ACCEPT', '')
+    digest = hashlib.sha1(f'{version}|{request.build_absolute_uri()}|{accept}'.encode('utf-8')).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def _set_validators(response, etag, last_modified):
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified)
+    # Browsers must revalidate; otherwise Last-Modified invites heuristic caching.
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def cache_catalog_response(view_method):
+    """
+    Conditional GET plus read-through cache for public catalog handlers.
+
+    The ETag and Last-Modified validators come from the catalog version, so
+    If-None-Match / If-Modified-Since are answered with a 304 before any
+    query or serialization runs. Otherwise responses are stored under the
+    current version; any change to Product, Category, ProductMedia or
+    HeroSection (see store.signals) makes older entries unreachable without
+    needing a TTL.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.method != 'GET' or not settings.CATALOG_CACHE_ENABLED:
+            return view_method(self, request, *args, **kwargs)
+
+        version = get_catalog_version()
+        etag = catalog_etag(request, version)
+        last_modified = get_catalog_last_modified(version)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return _set_validators(not_modified, etag, last_modified)
+
+        cache = get_catalog_cache()
+        key = response_cache_key(request, version)
+        cached = cache.get(key)
+        if cached is not None:
+            _count(HITS_KEY)
+            return _set_validators(Response(cached), etag, last_modified)
+
+        _count(MISSES_KEY)
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == 200 and getattr(response, 'data', None) is not None:
+            cache.set(key, response.data, timeout=settings.CATALOG_CACHE_TIMEOUT)
+            _set_validators(response, etag, last_modified)
+        return response
+
+    return wrapper
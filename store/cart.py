@@ -0,0 +1,531 @@
+"""
+Basket stock holds.
+
+Putting something in a basket reserves stock with a conditional
+``UPDATE ... SET stock = stock - n WHERE stock >= n`` and records the hold
+as a StockReservation with an expiry. Removing the item, lowering its
+quantity or letting the hold expire puts the stock back. Nothing here reads
+stock, changes it in Python and saves it back, so concurrent carts can't
+lose each other's updates. Every mutation also refreshes the basket's
+denormalized item_count/subtotal in the same transaction.
+
+Paying for an order commits the stock (commit_stock): its holds are
+consumed, and anything a lapsed hold no longer covers is taken from stock
+conditionally, so two buyers can't both pay for the last bottle.
+
+Products in a running flash sale are the exception: the reserve/release
+helpers below hand them to store.flash, which counts their stock in the
+cache and flushes it to Product.stock in batches.
+
+Guests have no Basket: their cart is a signed cookie of product ids and
+quantities, priced from Product on read and merged into the user's basket
+at login.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, DecimalField, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from store import flash
+from store.cache import bump_catalog_version
+from store.facets import adjust_facet_count, facet_key
+from store.models import Basket, BasketItem, Product, StockReservation
+
+
+class OutOfStock(Exception):
+    def __init__(self, requested):
+        # {product id: quantity that couldn't be reserved}
+        super().__init__("Not enough stock for product(s) " + ', '.join(str(pk) for pk in requested))
+        self.requested = requested
+
+
+def reservation_expiry(now=None):
+    return (now or timezone.now()) + timedelta(minutes=settings.CART_RESERVATION_MINUTES)
+
+
+def reserve_stock(product_id, quantity):
+    """Takes ``quantity`` off the product's stock if that much is left."""
+    try:
+        if not flash.claim({product_id: quantity}):
+            return True
+    except flash.SoldOut:
+        return False
+    return bool(
+        Product.objects.filter(pk=product_id, stock__gte=quantity).update(stock=F('stock') - quantity)
+    )
+
+
+def release_stock(product_id, quantity):
+    if flash.give_back({product_id: quantity}):
+        Product.objects.filter(pk=product_id).update(stock=F('stock') + quantity)
+
+
+def _per_product(quantities, expression):
+    return Case(
+        *[When(pk=pk, then=expression(quantity)) for pk, quantity in quantities.items()],
+        default=F('stock'), output_field=IntegerField(),
+    )
+
+
+def reserve_many(quantities):
+    """
+    Reserves ``{product id: quantity}`` with a single conditional UPDATE.
+    Either every product had enough stock, or nothing changes and
+    OutOfStock lists the products that were short.
+    """
+    if not quantities:
+        return
+    try:
+        rest = flash.claim(quantities)
+    except flash.SoldOut as exc:
+        raise OutOfStock(exc.short) from None
+    claimed = {pk: quantity for pk, quantity in quantities.items() if pk not in rest}
+    quantities = rest
+    if not quantities:
+        return
+    wanted = _per_product(quantities, lambda quantity: Value(quantity))
+    try:
+        with transaction.atomic():
+            reserved = Product.objects.filter(pk__in=quantities, stock__gte=wanted).update(
+                stock=_per_product(quantities, lambda quantity: F('stock') - quantity)
+            )
+            if reserved != len(quantities):
+                raise OutOfStock({})
+    except OutOfStock:
+        flash.unclaim(claimed)
+        # The savepoint is rolled back, so current stock shows who was short.
+        stocks = dict(Product.objects.filter(pk__in=quantities).values_list('id', 'stock'))
+        short = {pk: quantity for pk, quantity in quantities.items() if stocks.get(pk, 0) < quantity}
+        raise OutOfStock(short or dict(quantities)) from None
+
+
+def release_many(quantities):
+    quantities = flash.give_back(quantities) if quantities else quantities
+    if quantities:
+        Product.objects.filter(pk__in=quantities).update(
+            stock=_per_product(quantities, lambda quantity: F('stock') + quantity)
+        )
+
+
+def stock_changed(products, deltas):
+    """
+    Catalog bookkeeping that Product.save() signals would have done: move
+    facet counts for products whose stock crossed zero and, for those only,
+    bump the catalog version on commit. Other stock moves leave cached
+    catalog responses alone, so the stock counts they show can lag until
+    the next catalog change; whether a product is in stock never does, and
+    the cart checks real stock anyway. ``products`` carry their stock after
+    the change. Products in a running flash sale are skipped; their stock
+    moves when the sale is flushed.
+    """
+    counted = flash.running(deltas)
+    if counted:
+        deltas = {pk: delta for pk, delta in deltas.items() if pk not in counted}
+    record_stock_change(products, deltas)
+
+
+def record_stock_change(products, deltas):
+    crossed = False
+    for product in products:
+        delta = deltas.get(product.pk, 0)
+        if not delta:
+            continue
+        before = facet_key(product.category_id, product.brand, product.price, product.stock - delta)
+        after = facet_key(product.category_id, product.brand, product.price, product.stock)
+        if before != after:
+            adjust_facet_count(before, -1)
+            adjust_facet_count(after, 1)
+            crossed = True
+    if crossed:
+        transaction.on_commit(bump_catalog_version)
+
+
+def refresh_summaries(baskets):
+    """
+    Recomputes item_count and subtotal for a Basket queryset with one UPDATE
+    (correlated subqueries), at current product prices.
+    """
+    items = (
+        BasketItem.objects.filter(
+            basket_object=OuterRef('pk'), is_active=True, is_order_placed=False, product_object__isnull=False
+        )
+        .order_by()
+        .values('basket_object')
+    )
+    count = items.annotate(n=Sum('quantity')).values('n')
+    total = items.annotate(t=Sum(F('quantity') * F('product_object__price'))).values('t')
+    money = DecimalField(max_digits=12, decimal_places=2)
+    return baskets.update(
+        item_count=Coalesce(Subquery(count, output_field=IntegerField()), 0),
+        subtotal=Coalesce(Subquery(total, output_field=money), Value(Decimal('0')), output_field=money),
+    )
+
+
+def refresh_basket(basket_id):
+    refresh_summaries(Basket.objects.filter(pk=basket_id))
+
+
+def refresh_baskets_for_products(product_ids):
+    """After price changes: refresh every open basket holding one of these products."""
+    baskets = BasketItem.objects.filter(
+        product_object_id__in=product_ids, is_active=True, is_order_placed=False
+    ).values('basket_object_id')
+    refresh_summaries(Basket.objects.filter(pk__in=baskets))
+
+
+def _hold(item, delta):
+    # Upsert on the one-to-one: grow/shrink the existing hold or create it.
+    holds = StockReservation.objects.filter(basket_item=item)
+    expires_at = reservation_expiry()
+    if holds.update(quantity=F('quantity') + delta, expires_at=expires_at):
+        holds.filter(quantity=0).delete()
+    elif delta > 0:
+        StockReservation.objects.create(
+            basket_item=item, product_id=item.product_object_id, quantity=delta, expires_at=expires_at
+        )
+
+
+def _open_item(basket, product_id):
+    return (
+        BasketItem.objects.filter(basket_object=basket, product_object_id=product_id, is_order_placed=False)
+        .select_related('product_object')
+    )
+
+
+@transaction.atomic
+def add_to_cart(basket, product_id, quantity=1):
+    """
+    Reserves ``quantity`` and adds it to the basket's open row for the
+    product, creating or reactivating the row as needed. Raises OutOfStock,
+    or Product.DoesNotExist for an unknown product.
+    """
+    if not reserve_stock(product_id, quantity):
+        if not Product.objects.filter(pk=product_id).exists():
+            raise Product.DoesNotExist(product_id)
+        raise OutOfStock({product_id: quantity})
+
+    items = _open_item(basket, product_id)
+    changes = {
+        'quantity': Case(When(is_active=True, then=F('quantity') + quantity), default=Value(quantity)),
+        'is_active': True,
+        'updated_date': timezone.now(),
+    }
+    if not items.update(**changes):
+        try:
+            with transaction.atomic():
+                BasketItem.objects.create(basket_object=basket, product_object_id=product_id, quantity=quantity)
+        except IntegrityError:
+            # A concurrent request created the row first.
+            items.update(**changes)
+
+    item = items.get()
+    _hold(item, quantity)
+    refresh_basket(basket.pk)
+    stock_changed([item.product_object], {item.product_object_id: -quantity})
+    return item
+
+
+@transaction.atomic
+def set_quantity(item, quantity):
+    """Changes an open item's quantity, reserving or releasing the difference."""
+    held = StockReservation.objects.filter(basket_item=item).values_list('quantity', flat=True).first() or 0
+    delta = quantity - held
+    if delta > 0 and not reserve_stock(item.product_object_id, delta):
+        raise OutOfStock({item.product_object_id: delta})
+    if delta < 0:
+        release_stock(item.product_object_id, -delta)
+
+    BasketItem.objects.filter(pk=item.pk).update(quantity=quantity, updated_date=timezone.now())
+    item.quantity = quantity
+    refresh_basket(item.basket_object_id)
+    if delta:
+        _hold(item, delta)
+        product = Product.objects.only('id', 'category_id', 'brand', 'price', 'stock').get(pk=item.product_object_id)
+        stock_changed([product], {product.pk: -delta})
+    return item
+
+
+@transaction.atomic
+def remove_from_cart(item):
+    """Deactivates the item and returns whatever stock it still held."""
+    held = StockReservation.objects.filter(basket_item=item).values_list('quantity', flat=True).first()
+    if held:
+        release_stock(item.product_object_id, held)
+        StockReservation.objects.filter(basket_item=item).delete()
+        product = Product.objects.only('id', 'category_id', 'brand', 'price', 'stock').get(pk=item.product_object_id)
+        stock_changed([product], {product.pk: held})
+    BasketItem.objects.filter(pk=item.pk).update(is_active=False, updated_date=timezone.now())
+    item.is_active = False
+    refresh_basket(item.basket_object_id)
+
+
+@transaction.atomic
+def sync_cart(basket, desired):
+    """
+    Makes the basket's open items match ``{product id: quantity}``; products
+    left out (or with quantity 0) are removed. Stock is reserved/released
+    for the differences only, with one UPDATE each, and item and hold rows
+    are written with bulk operations. Raises OutOfStock without changing
+    anything if any product can't cover its increase.
+    """
+    now = timezone.now()
+    items = {
+        item.product_object_id: item
+        for item in BasketItem.objects.filter(basket_object=basket, is_order_placed=False, product_object__isnull=False)
+        .select_related('reservation')
+    }
+
+    deltas = {}
+    for product_id in set(items) | set(desired):
+        item = items.get(product_id)
+        held = item.reservation.quantity if item is not None and hasattr(item, 'reservation') else 0
+        delta = desired.get(product_id, 0) - held
+        if delta:
+            deltas[product_id] = delta
+    reserve_many({pk: delta for pk, delta in deltas.items() if delta > 0})
+    release_many({pk: -delta for pk, delta in deltas.items() if delta < 0})
+
+    new_items, changed_items = [], []
+    for product_id, quantity in desired.items():
+        item = items.get(product_id)
+        if item is None:
+            if quantity:
+                new_items.append(BasketItem(basket_object=basket, product_object_id=product_id, quantity=quantity))
+        elif quantity and (not item.is_active or item.quantity != quantity):
+            item.quantity, item.is_active, item.updated_date = quantity, True, now
+            changed_items.append(item)
+    for product_id, item in items.items():
+        if not desired.get(product_id) and item.is_active:
+            item.is_active, item.updated_date = False, now
+            changed_items.append(item)
+    BasketItem.objects.bulk_create(new_items)
+    BasketItem.objects.bulk_update(changed_items, ['quantity', 'is_active', 'updated_date'])
+
+    # Holds: one row per item that should hold stock, none for removed items.
+    StockReservation.objects.filter(
+        basket_item__basket_object=basket, basket_item__is_order_placed=False
+    ).exclude(product_id__in=[pk for pk, quantity in desired.items() if quantity]).delete()
+    final = list(
+        BasketItem.objects.filter(basket_object=basket, is_order_placed=False, is_active=True)
+        .select_related('product_object', 'reservation')
+        .order_by('id')
+    )
+    expires_at = reservation_expiry(now)
+    new_holds, changed_holds = [], []
+    for item in final:
+        if hasattr(item, 'reservation'):
+            item.reservation.quantity, item.reservation.expires_at = item.quantity, expires_at
+            changed_holds.append(item.reservation)
+        else:
+            new_holds.append(StockReservation(
+                basket_item=item, product_id=item.product_object_id, quantity=item.quantity, expires_at=expires_at
+            ))
+    StockReservation.objects.bulk_create(new_holds)
+    StockReservation.objects.bulk_update(changed_holds, ['quantity', 'expires_at'])
+    refresh_basket(basket.pk)
+
+    if deltas:
+        products = Product.objects.filter(pk__in=deltas).only('id', 'category_id', 'brand', 'price', 'stock')
+        stock_changed(products, {pk: -delta for pk, delta in deltas.items()})
+    return final
+
+
+def hold_for_checkout(items):
+    """
+    Makes every item hold its full quantity before an order is placed.
+    Holds that expired or fell short are topped up with one conditional
+    UPDATE (reserve_many) and every hold gets a fresh expiry. ``items`` must
+    come with ``product_object`` and ``reservation`` selected; the query
+    count doesn't depend on how many there are.
+    """
+    expires_at = reservation_expiry()
+    shortfall, missing = {}, []
+    for item in items:
+        held = item.reservation.quantity if hasattr(item, 'reservation') else 0
+        if item.quantity > held:
+            shortfall[item.product_object_id] = shortfall.get(item.product_object_id, 0) + item.quantity - held
+        if not hasattr(item, 'reservation'):
+            missing.append(item)
+    reserve_many(shortfall)
+
+    quantity = BasketItem.objects.filter(pk=OuterRef('basket_item_id')).values('quantity')[:1]
+    StockReservation.objects.filter(basket_item__in=[item.pk for item in items]).update(
+        quantity=Subquery(quantity), expires_at=expires_at
+    )
+    StockReservation.objects.bulk_create([
+        StockReservation(basket_item=item, product_id=item.product_object_id, quantity=item.quantity, expires_at=expires_at)
+        for item in missing
+    ])
+
+    if shortfall:
+        products = {item.product_object_id: item.product_object for item in items}
+        for product_id, quantity in shortfall.items():
+            products[product_id].stock -= quantity
+        stock_changed(products.values(), {pk: -quantity for pk, quantity in shortfall.items()})
+
+
+def commit_stock(quantities, owner_ids):
+    """
+    Turns stock held for paid orders into sold stock. ``quantities`` is
+    ``{product id: quantity paid for}`` across the orders of ``owner_ids``.
+    Their baskets' holds on those products are consumed (deleted without
+    giving stock back); a hold that expired or fell short is made up from
+    stock with reserve_many, and a hold bigger than what was paid for
+    returns the excess. Raises OutOfStock, having changed nothing, if the
+    stock isn't there.
+
+    Rows are locked holds first, then products, each in product-id order,
+    so concurrent payments over overlapping products queue rather than
+    deadlock. Must run inside a transaction.
+    """
+    if not quantities:
+        return
+    holds = list(
+        StockReservation.objects.select_for_update(of=('self',))
+        .filter(
+            product_id__in=quantities,
+            basket_item__basket_object__owner_id__in=owner_ids,
+            basket_item__is_order_placed=False,
+        )
+        .order_by('product_id', 'pk')
+        .values_list('pk', 'product_id', 'quantity')
+    )
+    counted = flash.running(quantities)
+    list(
+        Product.objects.select_for_update()
+        .filter(pk__in=[pk for pk in quantities if pk not in counted])
+        .order_by('pk').values_list('pk', flat=True)
+    )
+
+    held = {}
+    for _, product_id, quantity in holds:
+        held[product_id] = held.get(product_id, 0) + quantity
+    shortfall = {pk: quantity - held.get(pk, 0) for pk, quantity in quantities.items() if quantity > held.get(pk, 0)}
+    surplus = {pk: quantity - quantities[pk] for pk, quantity in held.items() if quantity > quantities[pk]}
+
+    reserve_many(shortfall)
+    release_many(surplus)
+    StockReservation.objects.filter(pk__in=[row[0] for row in holds]).delete()
+
+    deltas = {**{pk: -quantity for pk, quantity in shortfall.items()}, **surplus}
+    if deltas:
+        products = Product.objects.filter(pk__in=deltas).only('id', 'category_id', 'brand', 'price', 'stock')
+        stock_changed(products, deltas)
+
+
+def release_expired(batch_size=500, now=None):
+    """
+    Releases expired holds in batches and returns how many were processed.
+    Holds whose item has already been ordered are consumed: dropped
+    without giving the stock back.
+    """
+    now = now or timezone.now()
+    processed = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=now)
+                .order_by('expires_at')
+                .values_list('id', 'product_id', 'quantity', 'basket_item__is_order_placed')[:batch_size]
+            )
+            if not batch:
+                return processed
+
+            totals = {}
+            for _, product_id, quantity, ordered in batch:
+                if not ordered:
+                    totals[product_id] = totals.get(product_id, 0) + quantity
+            if totals:
+                release_many(totals)
+                products = Product.objects.filter(pk__in=totals).only('id', 'category_id', 'brand', 'price', 'stock')
+                stock_changed(products, totals)
+            StockReservation.objects.filter(pk__in=[row[0] for row in batch]).delete()
+        processed += len(batch)
+        if len(batch) < batch_size:
+            return processed
+
+
+GUEST_CART_SALT = 'store.guest_cart'
+
+
+def read_guest_cart(request):
+    """``{product id: quantity}`` from the signed cookie; empty if missing or tampered with."""
+    value = request.get_signed_cookie(
+        settings.GUEST_CART_COOKIE, default=None, salt=GUEST_CART_SALT, max_age=settings.GUEST_CART_MAX_AGE
+    )
+    if not value:
+        return {}
+    cart = {}
+    for line in value.split('|')[:settings.GUEST_CART_MAX_LINES]:
+        product_id, _, quantity = line.partition(':')
+        if product_id.isdigit() and quantity.isdigit() and int(quantity) > 0:
+            cart[int(product_id)] = int(quantity)
+    return cart
+
+
+def write_guest_cart(response, cart):
+    if not cart:
+        return clear_guest_cart(response)
+    # "12:1|40:3" keeps the cookie small; the signature stops edits.
+    value = '|'.join(f'{pk}:{quantity}' for pk, quantity in cart.items() if quantity > 0)
+    response.set_signed_cookie(
+        settings.GUEST_CART_COOKIE, value, salt=GUEST_CART_SALT, max_age=settings.GUEST_CART_MAX_AGE,
+        httponly=True, samesite=settings.GUEST_CART_COOKIE_SAMESITE, secure=settings.GUEST_CART_COOKIE_SECURE,
+    )
+    return response
+
+
+def clear_guest_cart(response):
+    response.delete_cookie(settings.GUEST_CART_COOKIE, samesite=settings.GUEST_CART_COOKIE_SAMESITE)
+    return response
+
+
+def guest_cart_products(cart):
+    """The cart's products in one query, keyed by id; unknown ids are left out."""
+    if not cart:
+        return {}
+    return Product.objects.filter(pk__in=cart).only('id', 'name', 'price', 'image', 'stock', 'available').in_bulk()
+
+
+def merge_guest_cart(basket, cart):
+    """
+    Adds a guest cart to ``basket`` through sync_cart (bulk writes, one
+    transaction), re-reading price and stock for every line with one
+    Product query. Quantities are clamped to what can still be reserved, so
+    logging in never fails on stock. Returns ``(items, ids of products that
+    couldn't be added in full)``.
+    """
+    if not cart:
+        return None, []
+    for attempt in range(2):
+        current = dict(
+            BasketItem.objects.filter(basket_object=basket, is_order_placed=False, is_active=True)
+            .exclude(product_object=None)
+            .values_list('product_object_id', 'quantity')
+        )
+        held = dict(
+            StockReservation.objects.filter(
+                basket_item__basket_object=basket, basket_item__is_order_placed=False, basket_item__is_active=True
+            ).values_list('product_id', 'quantity')
+        )
+        products = Product.objects.filter(pk__in=set(cart) | set(current)).only('id', 'stock', 'available').in_bulk()
+
+        desired, short = {}, []
+        for product_id in set(cart) | set(current):
+            product = products.get(product_id)
+            free = product.stock if product is not None and product.available else 0
+            wanted = current.get(product_id, 0) + cart.get(product_id, 0)
+            desired[product_id] = min(wanted, held.get(product_id, 0) + free)
+            if product_id in cart and desired[product_id] < wanted:
+                short.append(product_id)
+        try:
+            return sync_cart(basket, desired), sorted(short)
+        except OutOfStock:
+            # Stock moved between the read and the reservation; re-read once.
+            if attempt:
+                raise
@@ -0,0 +1,202 @@
+"""
+Faceted filtering for product listings.
+
+Facet counts are read from CatalogFacetCount, a small table holding one row
+per (category, brand, price band, in stock) combination. The table is kept
+up to date incrementally from Product signals, so a request needs a single
+query over it no matter how many facet values are shown.
+"""
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField, Case, CharField, Count, F, Q, Value, When
+
+from store.models import CatalogFacetCount, Product
+
+
+# (key, label, lower bound inclusive, upper bound exclusive)
+PRICE_BANDS = (
+    ('0-500', '₹0–500', Decimal('0'), Decimal('500')),
+    ('500-1000', '₹500–1000', Decimal('500'), Decimal('1000')),
+    ('1000-2000', '₹1000–2000', Decimal('1000'), Decimal('2000')),
+    ('2000-5000', '₹2000–5000', Decimal('2000'), Decimal('5000')),
+    ('5000+', '₹5000+', Decimal('5000'), None),
+)
+PRICE_BAND_LABELS = {key: label for key, label, _, _ in PRICE_BANDS}
+TRUE_VALUES = ('1', 'true', 'yes')
+
+
+def price_band(price):
+    price = Decimal(price or 0)
+    for key, _, lower, upper in PRICE_BANDS:
+        if price >= lower and (upper is None or price < upper):
+            return key
+    return PRICE_BANDS[0][0]
+
+
+def price_band_q(key):
+    for band, _, lower, upper in PRICE_BANDS:
+        if band == key:
+            q = Q(price__gte=lower)
+            if upper is not None:
+                q &= Q(price__lt=upper)
+            return q
+    return None
+
+
+def price_band_expression():
+    whens = []
+    for key, _, lower, upper in PRICE_BANDS:
+        q = Q(price__gte=lower)
+        if upper is not None:
+            q &= Q(price__lt=upper)
+        whens.append(When(q, then=Value(key)))
+    return Case(*whens, default=Value(PRICE_BANDS[0][0]), output_field=CharField())
+
+
+def facet_key(category_id, brand, price, stock):
+    return (category_id, brand or '', price_band(price), bool(stock and stock > 0))
+
+
+def product_facet_key(product):
+    return facet_key(product.category_id, product.brand, product.price, product.stock)
+
+
+def adjust_facet_count(key, delta):
+    category_id, brand, band, in_stock = key
+    cells = CatalogFacetCount.objects.filter(
+        category_id=category_id, brand=brand, price_band=band, in_stock=in_stock
+    )
+    if cells.update(product_count=F('product_count') + delta) or delta < 0:
+        # A missing cell has nothing to take away from; its category may be
+        # mid-cascade (Category delete removes the cells before the products).
+        return
+    try:
+        with transaction.atomic():
+            CatalogFacetCount.objects.create(
+                category_id=category_id, brand=brand, price_band=band, in_stock=in_stock, product_count=delta
+            )
+    except IntegrityError:
+        # Another writer created the cell between our UPDATE and INSERT.
+        cells.update(product_count=F('product_count') + delta)
+
+
+def rebuild_facet_counts(products=None):
+    """
+    Recomputes every cell with one GROUP BY. Used after bulk writes that
+    bypass model signals (queryset.update, bulk_create).
+    """
+    products = products if products is not None else Product.objects.all()
+    rows = (
+        products.annotate(
+            band=price_band_expression(),
+            has_stock=Case(When(stock__gt=0, then=Value(True)), default=Value(False), output_field=BooleanField()),
+        )
+        .values('category_id', 'brand', 'band', 'has_stock')
+        .annotate(n=Count('id'))
+        .order_by()
+    )
+    merged = {}
+    for row in rows:
+        key = (row['category_id'], row['brand'] or '', row['band'], row['has_stock'])
+        merged[key] = merged.get(key, 0) + row['n']
+
+    with transaction.atomic():
+        CatalogFacetCount.objects.all().delete()
+        CatalogFacetCount.objects.bulk_create([
+            CatalogFacetCount(category_id=category_id, brand=brand, price_band=band, in_stock=in_stock, product_count=n)
+            for (category_id, brand, band, in_stock), n in merged.items()
+        ], batch_size=1000)
+
+
+def _split(values):
+    selected = []
+    for value in values:
+        selected += [part.strip() for part in value.split(',') if part.strip()]
+    return selected
+
+
+def parse_filters(query_params):
+    """Reads brand, category, price_band and in_stock from the query string."""
+    filters = {}
+    brands = _split(query_params.getlist('brand'))
+    if brands:
+        filters['brand'] = brands
+    categories = [int(pk) for pk in _split(query_params.getlist('category')) if pk.isdigit()]
+    if categories:
+        filters['category'] = categories
+    bands = [band for band in _split(query_params.getlist('price_band')) if band in PRICE_BAND_LABELS]
+    if bands:
+        filters['price_band'] = bands
+    in_stock = query_params.get('in_stock')
+    if in_stock is not None:
+        filters['in_stock'] = in_stock.lower() in TRUE_VALUES
+    return filters
+
+
+def apply_filters(queryset, filters):
+    if 'brand' in filters:
+        queryset = queryset.filter(brand__in=filters['brand'])
+    if 'category' in filters:
+        queryset = queryset.filter(category_id__in=filters['category'])
+    if 'price_band' in filters:
+        q = Q()
+        for band in filters['price_band']:
+            q |= price_band_q(band)
+        queryset = queryset.filter(q)
+    if 'in_stock' in filters:
+        queryset = queryset.filter(stock__gt=0) if filters['in_stock'] else queryset.filter(stock=0)
+    return queryset
+
+
+def _cell_matches(cell, filters, skip):
+    if skip != 'brand' and 'brand' in filters and cell['brand'] not in filters['brand']:
+        return False
+    if skip != 'category' and 'category' in filters and cell['category_id'] not in filters['category']:
+        return False
+    if skip != 'price_band' and 'price_band' in filters and cell['price_band'] not in filters['price_band']:
+        return False
+    if skip != 'in_stock' and 'in_stock' in filters and cell['in_stock'] != filters['in_stock']:
+        return False
+    return True
+
+
+def facet_counts(filters, category_id=None):
+    """
+    Returns counts for every facet value. Each facet is counted with all the
+    other active filters applied but not its own, so shoppers can still see
+    how many products the sibling values would give them.
+    """
+    cells = CatalogFacetCount.objects.filter(product_count__gt=0)
+    if category_id is not None:
+        cells = cells.filter(category_id=category_id)
+    cells = list(cells.values('category_id', 'category__name', 'brand', 'price_band', 'in_stock', 'product_count'))
+
+    brands, categories, bands, stock = {}, {}, {}, {True: 0, False: 0}
+    category_names = {}
+    for cell in cells:
+        n = cell['product_count']
+        if _cell_matches(cell, filters, 'brand') and cell['brand']:
+            brands[cell['brand']] = brands.get(cell['brand'], 0) + n
+        if _cell_matches(cell, filters, 'category'):
+            categories[cell['category_id']] = categories.get(cell['category_id'], 0) + n
+            category_names[cell['category_id']] = cell['category__name']
+        if _cell_matches(cell, filters, 'price_band'):
+            bands[cell['price_band']] = bands.get(cell['price_band'], 0) + n
+        if _cell_matches(cell, filters, 'in_stock'):
+            stock[cell['in_stock']] += n
+
+    return {
+        "brand": [{"value": brand, "count": n} for brand, n in sorted(brands.items())],
+        "category": [
+            {"value": pk, "label": category_names[pk], "count": n} for pk, n in sorted(categories.items())
+        ],
+        "price_band": [
+            {"value": key, "label": label, "count": bands[key]}
+            for key, label, _, _ in PRICE_BANDS if bands.get(key)
+        ],
+        "in_stock": [
+            {"value": True, "count": stock[True]},
+            {"value": False, "count": stock[False]},
+        ],
+    }
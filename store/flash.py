@@ -0,0 +1,399 @@
+"""
+Flash sales.
+
+While a FlashSale runs, its product's stock is counted in the flash cache
+instead of Product.stock, with counters that only go up: units ``claimed``
+and units ``returned``. A claim is one INCR plus a read, and is undone if
+``claimed - returned`` went past the units the sale started with, so no
+lock or database row is involved. store.cart's reserve/release helpers send
+products with a running sale here. ``flush`` (the flush_flash_sales worker)
+writes the net change into Product.stock with one UPDATE per sale every
+FLASH_SALE_FLUSH_SECONDS, however many people are buying.
+
+Buyers get in through a waiting room. Joining takes the next ticket from a
+counter; tickets are admitted in order, ``admit_burst`` at the start and
+``admit_per_second`` after that, and an admission lasts
+FLASH_SALE_ADMISSION_MINUTES. Only admitted buyers can put the product in a
+cart, so the database sees the admission rate rather than the crowd.
+
+After ``ends_at`` claims are refused and releases go straight to
+Product.stock, so the counters stop moving; the first flush past
+FLASH_SALE_GRACE_SECONDS writes the last of them and finalizes the sale.
+If the counters are lost mid-sale they restart from the last flush, so up
+to one flush interval of sales can be sold again.
+"""
+import math
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, Least
+from django.utils import timezone
+
+from store.models import BasketItem, FlashSale, OrderItem, Product
+
+
+SALES_KEY = 'flash:sales'
+
+
+class SoldOut(Exception):
+    def __init__(self, short):
+        # {product id: quantity that couldn't be claimed}
+        super().__init__("Flash sale sold out for product(s) " + ', '.join(str(pk) for pk in short))
+        self.short = short
+
+
+class FlashSaleError(Exception):
+    """The buyer can't add (more of) a flash-sale product right now."""
+
+    def __init__(self, message, product_id, sale_id):
+        super().__init__(message)
+        self.product_id = product_id
+        self.sale_id = sale_id
+
+
+class NotAdmitted(FlashSaleError):
+    def __init__(self, product_id, sale_id):
+        super().__init__("Join the flash sale's waiting room and wait for your turn", product_id, sale_id)
+
+
+class OverLimit(FlashSaleError):
+    def __init__(self, product_id, sale_id, limit):
+        super().__init__(f"This flash sale allows {limit} per customer", product_id, sale_id)
+        self.limit = limit
+
+
+def get_flash_cache():
+    return caches[settings.FLASH_SALE_CACHE_ALIAS]
+
+
+def _key(sale_id, name):
+    return f'flash:{sale_id}:{name}'
+
+
+def _as_id(pk):
+    # Ids arrive as ints or URL strings; anything else can't be in a sale.
+    try:
+        return int(pk)
+    except (TypeError, ValueError):
+        return None
+
+
+def _by_id(quantities):
+    return {_as_id(pk): quantity for pk, quantity in quantities.items() if _as_id(pk) is not None}
+
+
+def sales():
+    """``{product id: sale dict}`` for every sale not yet finalized; times are epoch seconds."""
+    cache = get_flash_cache()
+    found = cache.get(SALES_KEY)
+    if found is None:
+        found = {}
+        for sale in FlashSale.objects.filter(finalized_at=None).values(
+            'id', 'product_id', 'per_customer_limit', 'starts_at', 'ends_at', 'admit_per_second', 'admit_burst'
+        ):
+            sale['starts_at'] = sale['starts_at'].timestamp()
+            sale['ends_at'] = sale['ends_at'].timestamp()
+            found[sale['product_id']] = sale
+        cache.set(SALES_KEY, found, settings.FLASH_SALE_SALES_TTL)
+    return found
+
+
+def forget_sales():
+    get_flash_cache().delete(SALES_KEY)
+
+
+def sales_for(product_ids):
+    """The open sales of those of ``product_ids`` that have one, keyed by (int) product id."""
+    if not product_ids:
+        return {}
+    found = sales()
+    if not found:
+        return {}
+    return {pk: found[pk] for pk in _by_id(dict.fromkeys(product_ids)) if pk in found}
+
+
+def sale_by_id(sale_id):
+    for sale in sales().values():
+        if str(sale['id']) == str(sale_id):
+            return sale
+    return None
+
+
+def running(product_ids, now=None):
+    """Sales between start and end: their stock is counted here, not in Product.stock."""
+    now = now or time.time()
+    return {pk: sale for pk, sale in sales_for(product_ids).items() if sale['starts_at'] <= now < sale['ends_at']}
+
+
+# Counters
+
+def start(sale_id):
+    """
+    Creates a sale's counters if they are missing. The units it starts with
+    are fixed the first time (the lesser of ``units`` and the product's
+    stock then); ``claimed`` resumes from what was last flushed.
+    """
+    stock = Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('stock')[:1])
+    FlashSale.objects.filter(pk=sale_id, initial_units=None).update(
+        initial_units=Coalesce(Least(F('units'), stock), stock)
+    )
+    initial, committed = FlashSale.objects.filter(pk=sale_id).values_list('initial_units', 'committed_units').get()
+    cache = get_flash_cache()
+    cache.add(_key(sale_id, 'initial'), initial, timeout=None)
+    if cache.add(_key(sale_id, 'claimed'), committed, timeout=None):
+        cache.set(_key(sale_id, 'returned'), 0, timeout=None)
+    else:
+        cache.add(_key(sale_id, 'returned'), 0, timeout=None)
+
+
+def _incr(sale_id, name, delta):
+    cache = get_flash_cache()
+    try:
+        return cache.incr(_key(sale_id, name), delta)
+    except ValueError:
+        start(sale_id)
+        return cache.incr(_key(sale_id, name), delta)
+
+
+def _take(sale_id, quantity):
+    cache = get_flash_cache()
+    claimed = _incr(sale_id, 'claimed', quantity)
+    counts = cache.get_many([_key(sale_id, 'initial'), _key(sale_id, 'returned')])
+    if claimed - counts.get(_key(sale_id, 'returned'), 0) > counts.get(_key(sale_id, 'initial'), 0):
+        cache.decr(_key(sale_id, 'claimed'), quantity)
+        return False
+    return True
+
+
+def _untake(sale_id, quantity):
+    try:
+        get_flash_cache().decr(_key(sale_id, 'claimed'), quantity)
+    except ValueError:
+        pass  # finalized meanwhile
+
+
+def claim(quantities):
+    """
+    Claims ``{product id: quantity}`` for products whose sale has started,
+    all or nothing, and returns the other products' quantities for the
+    database. Raises SoldOut, having claimed nothing; a sale that has ended
+    but isn't finalized yet sells nothing.
+    """
+    found = sales_for(quantities)
+    now = time.time()
+    found = {pk: sale for pk, sale in found.items() if sale['starts_at'] <= now}
+    if not found:
+        return quantities
+
+    rest, taken, short = {}, [], {}
+    for pk, quantity in quantities.items():
+        sale = found.get(_as_id(pk))
+        if sale is None:
+            rest[pk] = quantity
+        elif now < sale['ends_at'] and _take(sale['id'], quantity):
+            taken.append((sale['id'], quantity))
+        else:
+            short[pk] = quantity
+    if short:
+        for sale_id, quantity in taken:
+            _untake(sale_id, quantity)
+        raise SoldOut(short)
+    return rest
+
+
+def unclaim(quantities):
+    """Undoes a claim() whose transaction didn't go through."""
+    for pk, sale in sales_for(quantities).items():
+        quantity = _by_id(quantities)[pk]
+        _untake(sale['id'], quantity)
+
+
+def give_back(quantities):
+    """Returns stock to running sales and the rest ``{product id: quantity}`` for the database."""
+    found = running(quantities)
+    if not found:
+        return quantities
+    rest = {}
+    for pk, quantity in quantities.items():
+        sale = found.get(_as_id(pk))
+        if sale is None:
+            rest[pk] = quantity
+        else:
+            _incr(sale['id'], 'returned', quantity)
+    return rest
+
+
+def available(sale_id):
+    """Units left, or None before the sale's first claim."""
+    keys = [_key(sale_id, name) for name in ('initial', 'claimed', 'returned')]
+    counts = get_flash_cache().get_many(keys)
+    if keys[0] not in counts:
+        return None
+    return max(0, counts[keys[0]] - counts.get(keys[1], 0) + counts.get(keys[2], 0))
+
+
+def flush(now=None):
+    """
+    Writes every started sale's sales since the last flush into
+    Product.stock and finalizes sales that ended over
+    FLASH_SALE_GRACE_SECONDS ago. Returns the units moved.
+    """
+    now = now or timezone.now()
+    moved = 0
+    for sale_id in FlashSale.objects.filter(finalized_at=None, starts_at__lte=now).values_list('id', flat=True):
+        moved += flush_sale(sale_id, now)
+    return moved
+
+
+def flush_sale(sale_id, now=None):
+    from store.cart import record_stock_change
+
+    now = now or timezone.now()
+    cache = get_flash_cache()
+    with transaction.atomic():
+        sale = FlashSale.objects.select_for_update().filter(pk=sale_id, finalized_at=None).first()
+        if sale is None:
+            return 0
+        counts = cache.get_many([_key(sale_id, 'claimed'), _key(sale_id, 'returned')])
+        delta = 0
+        if _key(sale_id, 'claimed') in counts:
+            net = counts[_key(sale_id, 'claimed')] - counts.get(_key(sale_id, 'returned'), 0)
+            delta = net - sale.committed_units
+        if delta:
+            Product.objects.filter(pk=sale.product_id).update(stock=F('stock') - delta)
+            product = Product.objects.only('id', 'category_id', 'brand', 'price', 'stock').get(pk=sale.product_id)
+            record_stock_change([product], {product.pk: -delta})
+
+        final = now >= sale.ends_at + timedelta(seconds=settings.FLASH_SALE_GRACE_SECONDS)
+        FlashSale.objects.filter(pk=sale_id).update(
+            committed_units=F('committed_units') + delta, finalized_at=now if final else None
+        )
+        if final:
+            transaction.on_commit(lambda: _close(sale_id))
+    return delta
+
+
+def _close(sale_id):
+    forget_sales()
+    get_flash_cache().delete_many([_key(sale_id, name) for name in ('initial', 'claimed', 'returned', 'tickets')])
+
+
+# Waiting room
+
+def _ticket_key(sale_id, user_id):
+    return _key(sale_id, f'ticket:{user_id}')
+
+
+def _admitted_at(sale, ticket, issued):
+    """Epoch seconds at which ``ticket`` gets in, or None if it never will."""
+    if ticket <= sale['admit_burst']:
+        wait = 0
+    elif sale['admit_per_second']:
+        wait = (ticket - sale['admit_burst']) / sale['admit_per_second']
+    else:
+        return None
+    return max(issued, sale['starts_at'] + wait)
+
+
+def _iso(epoch):
+    return datetime.fromtimestamp(epoch, tz=dt_timezone.utc).isoformat()
+
+
+def queue_status(sale, user, now=None):
+    """Where the user stands in the sale's waiting room. Reads the cache only."""
+    now = now or time.time()
+    state = {
+        'flash_sale': sale['id'], 'product': sale['product_id'], 'ticket': None, 'position': None,
+        'admitted': False, 'admitted_until': None, 'expired': False, 'retry_after': None,
+        'ended': now >= sale['ends_at'],
+    }
+    entry = get_flash_cache().get(_ticket_key(sale['id'], user.pk))
+    if entry is None:
+        return state
+    ticket, issued = entry
+    served = sale['admit_burst'] + int(max(0, now - sale['starts_at']) * sale['admit_per_second'])
+    state['ticket'] = ticket
+    state['position'] = max(0, ticket - served)
+    admit_at = _admitted_at(sale, ticket, issued)
+    if admit_at is None:
+        return state
+    until = min(admit_at + settings.FLASH_SALE_ADMISSION_MINUTES * 60, sale['ends_at'])
+    if now < admit_at:
+        state['retry_after'] = max(1, math.ceil(admit_at - now))
+    elif now < until:
+        state['admitted'], state['admitted_until'] = True, _iso(until)
+    else:
+        state['expired'] = True
+    return state
+
+
+def join(sale, user, now=None):
+    """
+    Hands the user the next ticket, unless they hold one that is still
+    waiting or admitted, and returns their queue_status. A user whose
+    admission ran out goes to the back of the queue.
+    """
+    now = now or time.time()
+    state = queue_status(sale, user, now)
+    if state['ended'] or (state['ticket'] is not None and not state['expired']):
+        return state
+    cache = get_flash_cache()
+    cache.add(_key(sale['id'], 'tickets'), 0, timeout=None)
+    ticket = cache.incr(_key(sale['id'], 'tickets'))
+    cache.set(_ticket_key(sale['id'], user.pk), (ticket, now), timeout=int(sale['ends_at'] - now) + 3600)
+    return queue_status(sale, user, now)
+
+
+def check_cart(user, wanted, now=None):
+    """
+    ``wanted`` is ``{product id: quantity the cart would hold}`` for lines
+    being added or raised. Raises NotAdmitted unless the user is admitted
+    to each sale involved, or OverLimit if the quantity plus what they have
+    already paid for in the sale is over its per-customer limit.
+    """
+    found = sales_for(wanted)
+    if not found:
+        return
+    now = now or time.time()
+    wanted = _by_id(wanted)
+    for pk, sale in found.items():
+        if not queue_status(sale, user, now)['admitted']:
+            raise NotAdmitted(pk, sale['id'])
+
+    since = Q()
+    for pk, sale in found.items():
+        since |= Q(product_id=pk, order__created_at__gte=datetime.fromtimestamp(sale['starts_at'], tz=dt_timezone.utc))
+    paid = dict(
+        OrderItem.objects.filter(since, order__user=user)
+        .exclude(order__status__in=('Pending', 'Cancelled'))
+        .values('product_id').annotate(n=Sum('quantity')).values_list('product_id', 'n')
+    )
+    for pk, sale in found.items():
+        if wanted[pk] + paid.get(pk, 0) > sale['per_customer_limit']:
+            raise OverLimit(pk, sale['id'], sale['per_customer_limit'])
+
+
+def check_basket(user, basket, quantities, increment=False):
+    """
+    check_cart for a basket change: ``quantities`` are the new quantities,
+    or amounts to add with ``increment``. Only raised lines are checked.
+    """
+    found = sales_for(quantities)
+    if not found:
+        return
+    current = dict(
+        BasketItem.objects.filter(
+            basket_object=basket, product_object_id__in=found, is_active=True, is_order_placed=False
+        ).values_list('product_object_id', 'quantity')
+    )
+    quantities = _by_id(quantities)
+    wanted = {}
+    for pk in found:
+        quantity = current.get(pk, 0) + quantities[pk] if increment else quantities[pk]
+        if quantity > current.get(pk, 0):
+            wanted[pk] = quantity
+    check_cart(user, wanted)
@@ -0,0 +1,142 @@
+"""
+Upload-time image pipeline for product, category, hero and media images.
+
+On upload the original is re-encoded without EXIF (after applying its
+orientation). After save, fixed-width WebP and JPEG derivatives plus a tiny
+base64 LQIP placeholder are saved through the same storage (named after
+the original, or by content hash under ContentAddressedStorage), and their
+names are recorded in the model's ``image_variants`` field.
+"""
+import base64
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+REENCODE_FORMATS = {'JPEG': {'quality': 90, 'optimize': True}, 'PNG': {'optimize': True}, 'WEBP': {'quality': 90}}
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', {'method': 4}),
+    'jpeg': ('JPEG', {'optimize': True, 'progressive': True}),
+}
+
+
+def _open(field_file):
+    field_file.open('rb')
+    field_file.seek(0)
+    image = Image.open(field_file)
+    image.load()
+    return image
+
+
+def strip_metadata(field_file):
+    """
+    Replaces a not-yet-saved upload with an EXIF-free copy. Files already in
+    storage, unreadable files and formats we don't re-encode are left alone.
+    """
+    if not field_file or getattr(field_file, '_committed', True):
+        return
+    try:
+        image = _open(field_file)
+        fmt = image.format
+        if fmt not in REENCODE_FORMATS:
+            return
+        image = ImageOps.exif_transpose(image)
+        options = dict(REENCODE_FORMATS[fmt])
+        if image.info.get('icc_profile'):
+            options['icc_profile'] = image.info['icc_profile']
+        buffer = BytesIO()
+        image.save(buffer, format=fmt, **options)
+    except (UnidentifiedImageError, OSError, ValueError):
+        return
+    field_file.file = ContentFile(buffer.getvalue(), name=field_file.name)
+
+
+def _rgb(image):
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _resize(image, width):
+    if image.width <= width:
+        return image.copy()
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def _encode(image, fmt, quality, **options):
+    buffer = BytesIO()
+    if fmt == 'JPEG':
+        image = _rgb(image)
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    image.save(buffer, format=fmt, quality=quality, **options)
+    return buffer.getvalue()
+
+
+def lqip_data_uri(image):
+    thumb = _resize(image, settings.IMAGE_LQIP_WIDTH)
+    data = _encode(thumb, 'WEBP', 30)
+    return 'data:image/webp;base64,' + base64.b64encode(data).decode('ascii')
+
+
+def generate_variants(field_file):
+    """
+    Writes the derivatives for ``field_file`` and returns the manifest stored
+    in ``image_variants``; an empty dict if the file can't be read as an image.
+    """
+    try:
+        image = ImageOps.exif_transpose(_open(field_file))
+    except (UnidentifiedImageError, OSError, ValueError):
+        return {}
+
+    storage = field_file.storage
+    root = os.path.splitext(field_file.name)[0]
+    widths = sorted({w for w in settings.IMAGE_DERIVATIVE_WIDTHS if w <= image.width}) or [image.width]
+
+    variants = {
+        "source": field_file.name,
+        "width": image.width,
+        "height": image.height,
+        "lqip": lqip_data_uri(image),
+    }
+    for key, (fmt, options) in DERIVATIVE_FORMATS.items():
+        variants[key] = {}
+        for width in widths:
+            content = _encode(_resize(image, width), fmt, settings.IMAGE_DERIVATIVE_QUALITY, **options)
+            name = storage.save(f"{root}__w{width}.{key}", ContentFile(content))
+            variants[key][str(width)] = name
+    return variants
+
+
+def variant_urls(variants, request=None, storage=None):
+    """
+    Public shape of ``image_variants``: srcset strings per format plus the
+    LQIP data URI and intrinsic size, or None when no derivatives exist.
+    """
+    if not variants or not variants.get('source'):
+        return None
+    if storage is None:
+        from django.core.files.storage import default_storage as storage
+
+    def url(name):
+        value = storage.url(name)
+        return request.build_absolute_uri(value) if request is not None else value
+
+    data = {
+        "width": variants.get('width'),
+        "height": variants.get('height'),
+        "lqip": variants.get('lqip'),
+    }
+    for key in DERIVATIVE_FORMATS:
+        names = variants.get(key) or {}
+        data[key] = ', '.join(
+            f"{url(name)} {width}w" for width, name in sorted(names.items(), key=lambda item: int(item[0]))
+        )
+    return data
@@ -0,0 +1,91 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from store.models import Category, Product
+from store.search import SearchResults, get_backend, index_products
+
+
+WORDS = (
+    'oud', 'vanilla', 'musk', 'amber', 'rose', 'jasmine', 'sandalwood', 'citrus', 'bergamot', 'saffron',
+    'leather', 'vetiver', 'patchouli', 'lavender', 'cedar', 'tonka', 'iris', 'neroli', 'incense', 'fig',
+)
+BRANDS = ('Noor', 'Zahra', 'Layali', 'Sultan', 'Majestic', 'Dunes', 'Azure', 'Velvet')
+QUERIES = ('oud', 'vanilla musk', 'rose', 'sultan amber', 'jasm', 'sandalwood leather', 'noor', 'saffron oud rose')
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks /api/products/search/ queries against N synthetic products. "
+        "Data is created inside a transaction and rolled back unless --commit is given "
+        "(MySQL FULLTEXT only sees committed rows, so use --commit on a scratch database there)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100_000)
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--page-size', type=int, default=24)
+        parser.add_argument('--commit', action='store_true')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Search backend: {type(get_backend()).__name__}")
+        if options['commit']:
+            created = self._run(options)
+            Product.objects.filter(pk__in=created['products']).delete()
+            Category.objects.filter(pk__in=created['categories']).delete()
+            return
+        try:
+            with transaction.atomic():
+                self._run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _run(self, options):
+        rng = random.Random(options['seed'])
+        categories = [Category.objects.create(name=f"Bench {name}", slug=f"bench-{name}-{rng.random()}") for name in WORDS[:5]]
+
+        start = time.perf_counter()
+        batch = []
+        created_ids = []
+        for i in range(options['products']):
+            batch.append(Product(
+                brand=rng.choice(BRANDS),
+                category=rng.choice(categories),
+                name=' '.join(rng.sample(WORDS, 2)).title(),
+                description=' '.join(rng.choices(WORDS, k=30)),
+                price=rng.randint(200, 9000),
+                stock=rng.randint(0, 50),
+            ))
+            if len(batch) == 5000:
+                created_ids += [p.pk for p in Product.objects.bulk_create(batch)]
+                batch = []
+        if batch:
+            created_ids += [p.pk for p in Product.objects.bulk_create(batch)]
+        if not all(created_ids):
+            created_ids = list(Product.objects.filter(category__in=categories).values_list('pk', flat=True))
+        index_products(Product.objects.filter(pk__in=created_ids))
+        self.stdout.write(f"Inserted and indexed {len(created_ids)} products in {time.perf_counter() - start:.2f}s")
+
+        for query in QUERIES:
+            timings = []
+            for _ in range(options['repeat']):
+                t0 = time.perf_counter()
+                results = SearchResults(query)
+                total = results.count()
+                results[0:options['page_size']]
+                timings.append((time.perf_counter() - t0) * 1000)
+            timings.sort()
+            p95 = timings[int(len(timings) * 0.95) - 1]
+            self.stdout.write(
+                f"{query!r:>24}: {total:>6} hits  median {statistics.median(timings):7.2f} ms  p95 {p95:7.2f} ms"
+            )
+        return {'products': created_ids, 'categories': [c.pk for c in categories]}
@@ -0,0 +1,94 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+
+from store.models import Category, Product
+from store.serializers import (
+    PRODUCT_FIELDS, ProductListSerializer, ProductSerializer, restrict_product_queryset,
+)
+
+
+GRID_FIELDS = ('id', 'name', 'price', 'image')
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compares product listing serialization time per N products (rolled back afterwards)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _measure(self, label, build, repeat):
+        timings = []
+        for _ in range(repeat):
+            reset_queries()
+            with CaptureQueriesContext(connection) as queries:
+                t0 = time.perf_counter()
+                data = build()
+                timings.append((time.perf_counter() - t0) * 1000)
+        self.stdout.write(
+            f"{label:<40} median {statistics.median(timings):8.2f} ms  "
+            f"min {min(timings):8.2f} ms  queries {len(queries)}  rows {len(data)}"
+        )
+
+    def _run(self, options):
+        rng = random.Random(1)
+        categories = [Category.objects.create(name=f"Bench {i}", slug=f"bench-serializer-{i}") for i in range(5)]
+        Product.objects.bulk_create([
+            Product(
+                brand=f"Brand {i % 7}",
+                category=rng.choice(categories),
+                name=f"Product {i}",
+                description="Long form notes " * 60,
+                price=rng.randint(200, 9000),
+                stock=rng.randint(0, 50),
+                image=f"products/product-{i}.jpg",
+            )
+            for i in range(options['products'])
+        ])
+        products = Product.objects.filter(category__in=categories)
+        repeat = options['repeat']
+        self.stdout.write(f"Serializing {products.count()} products, {repeat} runs each")
+
+        self._measure(
+            "before: ProductSerializer (no select)",
+            lambda: ProductSerializer(products.all(), many=True).data,
+            repeat,
+        )
+        self._measure(
+            "before: ProductSerializer + select_related",
+            lambda: ProductSerializer(products.select_related('category'), many=True).data,
+            repeat,
+        )
+        self._measure(
+            "after: ProductListSerializer (full)",
+            lambda: ProductListSerializer(
+                restrict_product_queryset(products.all(), PRODUCT_FIELDS), many=True,
+                context={'fields': PRODUCT_FIELDS},
+            ).data,
+            repeat,
+        )
+        self._measure(
+            "after: ProductListSerializer (grid)",
+            lambda: ProductListSerializer(
+                restrict_product_queryset(products.all(), GRID_FIELDS), many=True,
+                context={'fields': GRID_FIELDS},
+            ).data,
+            repeat,
+        )
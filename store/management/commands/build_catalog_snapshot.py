@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.cache import get_catalog_version
+from store.snapshot import build_snapshot, is_built
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds the pre-compressed /api/catalog-snapshot/ files for the current catalog version. "
+        "Use --loop to keep rebuilding whenever the version changes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep polling the catalog version instead of exiting.")
+        parser.add_argument('--sleep', type=float, default=5.0, help="Seconds between version checks.")
+
+    def handle(self, *args, **options):
+        while True:
+            version = get_catalog_version()
+            if not options['loop'] or not is_built(version):
+                meta = build_snapshot(version)
+                self.stdout.write(self.style.SUCCESS(
+                    f"Built catalog snapshot v{meta['version']} ({', '.join(meta['encodings'])})"
+                ))
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.recommendations import build_recommendations
+
+
+class Command(BaseCommand):
+    help = "Recomputes 'frequently bought together' from order history. Meant to run nightly."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.RECOMMENDATIONS_WINDOW_DAYS,
+                            help="Order history window; 0 uses every order.")
+        parser.add_argument('--top', type=int, default=settings.RECOMMENDATIONS_TOP_N)
+
+    def handle(self, *args, **options):
+        written = build_recommendations(days=options['days'], n=options['top'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} recommendations."))
@@ -0,0 +1,22 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from store.bulk import FORMATS, export_lines, guess_format
+
+
+class Command(BaseCommand):
+    help = "Streams every product to a CSV or JSONL file (the same columns import_products reads)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="Output file, or - for stdout.")
+        parser.add_argument('--fmt', choices=FORMATS, help="Defaults to the file extension, else csv.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['fmt'] or guess_format(path)
+        if path == '-':
+            sys.stdout.writelines(export_lines(fmt))
+            return
+        with open(path, 'w', newline='', encoding='utf-8') as handle:
+            handle.writelines(export_lines(fmt))
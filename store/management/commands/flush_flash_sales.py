@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.flash import flush
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes flash-sale stock counted in the cache into Product.stock and closes ended sales. "
+        "Run it with --loop for the length of a sale; its interval bounds the product row's write rate."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep flushing instead of exiting after one pass.")
+        parser.add_argument('--interval', type=float, default=settings.FLASH_SALE_FLUSH_SECONDS,
+                            help="Seconds between flushes.")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            total += flush()
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f"Flushed {total} flash-sale units to stock."))
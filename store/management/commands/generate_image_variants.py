@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from store.cache import bump_catalog_version
+from store.images import generate_variants
+from store.models import Category, HeroSection, Product, ProductMedia
+
+
+class Command(BaseCommand):
+    help = "Generates WebP/JPEG derivatives and LQIP placeholders for images uploaded before the pipeline existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Regenerate even when variants are up to date.")
+
+    def handle(self, *args, **options):
+        targets = (
+            (Product.objects.exclude(image=''), 'image'),
+            (Category.objects.exclude(image=''), 'image'),
+            (HeroSection.objects.exclude(image=''), 'image'),
+            (ProductMedia.objects.filter(media_type='image').exclude(file=''), 'file'),
+        )
+        total = 0
+        for queryset, field_name in targets:
+            done = 0
+            for instance in queryset.exclude(**{field_name: None}).iterator(chunk_size=200):
+                field_file = getattr(instance, field_name)
+                if not options['force'] and instance.image_variants.get('source') == field_file.name:
+                    continue
+                variants = generate_variants(field_file)
+                if variants:
+                    queryset.model.objects.filter(pk=instance.pk).update(image_variants=variants)
+                    done += 1
+            self.stdout.write(f"{queryset.model.__name__}: {done} updated")
+            total += done
+        if total:
+            bump_catalog_version()
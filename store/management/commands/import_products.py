@@ -0,0 +1,49 @@
+import csv
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.bulk import DEFAULT_BATCH_SIZE, FORMATS, ProductImporter, guess_format, read_rows, text_stream
+
+
+class Command(BaseCommand):
+    help = "Imports products from a CSV or JSONL file. Rows with an id update that product, others create one."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin.")
+        parser.add_argument('--fmt', choices=FORMATS, help="Defaults to the file extension, else csv.")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--errors', help="Write the per-row error report to this CSV file instead of stderr.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['fmt'] or guess_format(path)
+        report_file = open(options['errors'], 'w', newline='', encoding='utf-8') if options['errors'] else None
+        report = csv.writer(report_file) if report_file else None
+        if report:
+            report.writerow(['line', 'field', 'error'])
+
+        def on_error(line, errors):
+            for field, messages in errors.items():
+                for message in messages:
+                    if report:
+                        report.writerow([line, field, message])
+                    else:
+                        self.stderr.write(f"line {line}: {field}: {message}")
+
+        try:
+            binary = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        except OSError as exc:
+            raise CommandError(exc)
+        try:
+            importer = ProductImporter(batch_size=options['batch_size'], on_error=on_error)
+            result = importer.run(read_rows(text_stream(binary), fmt))
+        finally:
+            if path != '-':
+                binary.close()
+            if report_file:
+                report_file.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['created']} created, {result['updated']} updated, {result['failed']} failed."
+        ))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from store.facets import rebuild_facet_counts
+from store.models import CatalogFacetCount
+
+
+class Command(BaseCommand):
+    help = "Recomputes the precomputed catalog facet counts from the Product table."
+
+    def handle(self, *args, **options):
+        rebuild_facet_counts()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {CatalogFacetCount.objects.count()} facet cells."))
@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.outbox import deliver_batch, purge_sent
+
+
+class Command(BaseCommand):
+    help = "Sends queued emails in batches over one SMTP connection per batch. Use --loop to keep draining."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help="Keep polling instead of exiting when drained.")
+        parser.add_argument('--sleep', type=float, default=2.0, help="Seconds to wait when there is nothing to do.")
+
+    def handle(self, *args, **options):
+        purged = purge_sent()
+        total = 0
+        while True:
+            handled = deliver_batch(options['batch_size'])
+            total += handled
+            if handled:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f"Attempted {total} emails; purged {purged} old sent ones."))
@@ -0,0 +1,65 @@
+from django.db import migrations
+
+# Frozen copy of store.search as of this migration: the app module may change
+# (or go away) without changing what this migration creates.
+SEARCH_TABLE = 'store_product_fts'
+
+CREATE_SQL = {
+    'sqlite': (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+        "name, brand, description, category, tokenize='unicode61 remove_diacritics 2')"
+    ),
+    'mysql': (
+        f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+        "product_id BIGINT NOT NULL PRIMARY KEY, "
+        "name VARCHAR(100) NOT NULL, "
+        "brand VARCHAR(100) NOT NULL, "
+        "description LONGTEXT NOT NULL, "
+        "category VARCHAR(100) NOT NULL, "
+        f"FULLTEXT KEY {SEARCH_TABLE}_ft (name, brand, description, category)"
+        ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+    ),
+}
+
+INSERT_SQL = {
+    'sqlite': f"INSERT INTO {SEARCH_TABLE} (rowid, name, brand, description, category) VALUES (%s, %s, %s, %s, %s)",
+    'mysql': (
+        f"REPLACE INTO {SEARCH_TABLE} (product_id, name, brand, description, category) "
+        "VALUES (%s, %s, %s, %s, %s)"
+    ),
+}
+
+
+def build_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in CREATE_SQL:
+        return
+    Product = apps.get_model('store', 'Product')
+    rows = Product.objects.values_list('id', 'name', 'brand', 'description', 'category__name').iterator(chunk_size=2000)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(CREATE_SQL[vendor])
+        chunk = []
+        for row in rows:
+            chunk.append(tuple('' if value is None else value for value in row))
+            if len(chunk) >= 500:
+                cursor.executemany(INSERT_SQL[vendor], chunk)
+                chunk = []
+        if chunk:
+            cursor.executemany(INSERT_SQL[vendor], chunk)
+
+
+def remove_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_SQL:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_herosection_smalltext'),
+    ]
+
+    operations = [
+        migrations.RunPython(build_index, remove_index),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:07
+
+import django.db.models.deletion
+from decimal import Decimal
+
+from django.db import migrations, models
+
+# Frozen copy of store.facets.PRICE_BANDS: (key, lower inclusive, upper exclusive).
+PRICE_BANDS = (
+    ('0-500', Decimal('0'), Decimal('500')),
+    ('500-1000', Decimal('500'), Decimal('1000')),
+    ('1000-2000', Decimal('1000'), Decimal('2000')),
+    ('2000-5000', Decimal('2000'), Decimal('5000')),
+    ('5000+', Decimal('5000'), None),
+)
+
+
+def price_band(price):
+    price = Decimal(price or 0)
+    for key, lower, upper in PRICE_BANDS:
+        if price >= lower and (upper is None or price < upper):
+            return key
+    return PRICE_BANDS[0][0]
+
+
+def backfill_facet_counts(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    CatalogFacetCount = apps.get_model('store', 'CatalogFacetCount')
+    counts = {}
+    for category_id, brand, price, stock in Product.objects.values_list('category_id', 'brand', 'price', 'stock').iterator():
+        key = (category_id, brand or '', price_band(price), bool(stock and stock > 0))
+        counts[key] = counts.get(key, 0) + 1
+    CatalogFacetCount.objects.bulk_create([
+        CatalogFacetCount(category_id=category_id, brand=brand, price_band=band, in_stock=in_stock, product_count=n)
+        for (category_id, brand, band, in_stock), n in counts.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('brand', models.CharField(blank=True, default='', max_length=100)),
+                ('price_band', models.CharField(max_length=20)),
+                ('in_stock', models.BooleanField(default=True)),
+                ('product_count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facet_counts', to='store.category')),
+            ],
+            options={
+                'unique_together': {('category', 'brand', 'price_band', 'in_stock')},
+            },
+        ),
+        migrations.RunPython(backfill_facet_counts, migrations.RunPython.noop),
+    ]
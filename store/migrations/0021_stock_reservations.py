@@ -0,0 +1,75 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.utils import timezone
+
+
+def merge_duplicate_open_items(apps, schema_editor):
+    # Keep one open row per (basket, product): the active one if any, with
+    # the active quantities summed into it.
+    BasketItem = apps.get_model('store', 'BasketItem')
+    duplicates = (
+        BasketItem.objects.filter(is_order_placed=False)
+        .values('basket_object_id', 'product_object_id')
+        .annotate(n=Count('id'))
+        .filter(n__gt=1)
+    )
+    for row in duplicates:
+        items = list(BasketItem.objects.filter(
+            is_order_placed=False, basket_object_id=row['basket_object_id'], product_object_id=row['product_object_id'],
+        ).order_by('-is_active', 'id'))
+        keep = items[0]
+        if keep.is_active:
+            keep.quantity = sum(item.quantity for item in items if item.is_active)
+            keep.save(update_fields=['quantity'])
+        BasketItem.objects.filter(pk__in=[item.pk for item in items[1:]]).delete()
+
+
+def hold_existing_carts(apps, schema_editor):
+    # Open carts already took their stock off Product.stock. Record those
+    # holds as already expired so the first sweep gives abandoned stock back.
+    BasketItem = apps.get_model('store', 'BasketItem')
+    StockReservation = apps.get_model('store', 'StockReservation')
+    now = timezone.now()
+    items = BasketItem.objects.filter(is_active=True, is_order_placed=False, product_object__isnull=False, quantity__gt=0)
+    StockReservation.objects.bulk_create([
+        StockReservation(basket_item_id=pk, product_id=product_id, quantity=quantity, expires_at=now)
+        for pk, product_id, quantity in items.values_list('id', 'product_object_id', 'quantity').iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_productrecommendation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(merge_duplicate_open_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='basketitem',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_order_placed', False)), fields=('basket_object', 'product_object'), name='unique_open_basket_item'),
+        ),
+        migrations.AddField(
+            model_name='stockreservation',
+            name='basket_item',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='reservation', to='store.basketitem'),
+        ),
+        migrations.AddField(
+            model_name='stockreservation',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='store.product'),
+        ),
+        migrations.RunPython(hold_existing_carts, migrations.RunPython.noop),
+    ]
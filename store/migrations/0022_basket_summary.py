@@ -0,0 +1,48 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:22
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_summaries(apps, schema_editor):
+    # Frozen copy of store.cart.refresh_summaries as of this migration.
+    Basket = apps.get_model('store', 'Basket')
+    BasketItem = apps.get_model('store', 'BasketItem')
+    items = (
+        BasketItem.objects.filter(
+            basket_object=OuterRef('pk'), is_active=True, is_order_placed=False, product_object__isnull=False
+        )
+        .order_by()
+        .values('basket_object')
+    )
+    count = items.annotate(n=Sum('quantity')).values('n')
+    total = items.annotate(t=Sum(F('quantity') * F('product_object__price'))).values('t')
+    money = DecimalField(max_digits=12, decimal_places=2)
+    Basket.objects.update(
+        item_count=Coalesce(Subquery(count, output_field=IntegerField()), 0),
+        subtotal=Coalesce(Subquery(total, output_field=money), Value(Decimal('0')), output_field=money),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0021_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basket',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='basket',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0023_order_status_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FlashSale',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('units', models.PositiveIntegerField(blank=True, help_text='Units on sale; blank for all stock.', null=True)),
+                ('per_customer_limit', models.PositiveIntegerField(default=1)),
+                ('starts_at', models.DateTimeField()),
+                ('ends_at', models.DateTimeField()),
+                ('admit_per_second', models.PositiveIntegerField(default=20, help_text='Waiting-room tickets admitted per second.')),
+                ('admit_burst', models.PositiveIntegerField(default=100, help_text='Tickets admitted the moment the sale starts.')),
+                ('initial_units', models.PositiveIntegerField(blank=True, editable=False, null=True)),
+                ('committed_units', models.IntegerField(default=0, editable=False)),
+                ('finalized_at', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='flash_sales', to='store.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('finalized_at', None)), fields=('product',), name='one_open_flash_sale_per_product')],
+            },
+        ),
+    ]
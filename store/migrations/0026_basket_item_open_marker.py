@@ -0,0 +1,64 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:17
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_open_items(apps, schema_editor):
+    # MySQL never enforced the old partial constraint, so concurrent adds may
+    # have left several open rows per (basket, product). Keep one, as 0021 did.
+    BasketItem = apps.get_model('store', 'BasketItem')
+    StockReservation = apps.get_model('store', 'StockReservation')
+    duplicates = (
+        BasketItem.objects.filter(is_order_placed=False, product_object__isnull=False)
+        .values('basket_object_id', 'product_object_id')
+        .annotate(n=Count('id'))
+        .filter(n__gt=1)
+    )
+    for row in duplicates:
+        items = list(BasketItem.objects.filter(
+            is_order_placed=False, basket_object_id=row['basket_object_id'], product_object_id=row['product_object_id'],
+        ).order_by('-is_active', 'id'))
+        keep = items[0]
+        if keep.is_active:
+            keep.quantity = sum(item.quantity for item in items if item.is_active)
+            keep.save(update_fields=['quantity'])
+        # Holds follow the surviving row rather than vanishing with the duplicate.
+        for item in items[1:]:
+            held = StockReservation.objects.filter(basket_item_id=item.pk).first()
+            if held is None:
+                continue
+            kept = StockReservation.objects.filter(basket_item_id=keep.pk).first()
+            if kept is None:
+                held.basket_item_id = keep.pk
+                held.save(update_fields=['basket_item'])
+            else:
+                kept.quantity += held.quantity
+                kept.expires_at = min(kept.expires_at, held.expires_at)
+                kept.save(update_fields=['quantity', 'expires_at'])
+                held.delete()
+        BasketItem.objects.filter(pk__in=[item.pk for item in items[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0025_outbound_email'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='basketitem',
+            name='unique_open_basket_item',
+        ),
+        migrations.RunPython(merge_duplicate_open_items, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='basketitem',
+            name='open_marker',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(is_order_placed=False, then=models.Value(True)), default=models.Value(None), output_field=models.BooleanField(null=True)), output_field=models.BooleanField(null=True)),
+        ),
+        migrations.AddConstraint(
+            model_name='basketitem',
+            constraint=models.UniqueConstraint(fields=('basket_object', 'product_object', 'open_marker'), name='unique_open_basket_item'),
+        ),
+    ]
@@ -31,6 +31,8 @@ class Category(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(unique=True, blank=True)
     image = models.ImageField(upload_to="categories/", null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
@@ -53,13 +55,58 @@ class Product(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to='products/',null=True,blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     stock = models.PositiveIntegerField()
     available = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.name} ({self.category.name})"
 
 
+# ---------------------------
+# Catalog Facet Counts
+# ---------------------------
+class CatalogFacetCount(models.Model):
+    """
+    Number of products per (category, brand, price band, in stock) cell.
+    Maintained incrementally by store.signals; store.facets sums these cells
+    instead of running COUNT queries per facet value.
+    """
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='facet_counts')
+    brand = models.CharField(max_length=100, blank=True, default='')
+    price_band = models.CharField(max_length=20)
+    in_stock = models.BooleanField(default=True)
+    product_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('category', 'brand', 'price_band', 'in_stock')
+
+    def __str__(self):
+        return f"{self.category_id}/{self.brand}/{self.price_band}/{self.in_stock}: {self.product_count}"
+
+
+# ---------------------------
+# Frequently Bought Together
+# ---------------------------
+class ProductRecommendation(models.Model):
+    """
+    Precomputed top-N co-purchased products, rebuilt in bulk by
+    store.recommendations.build_recommendations.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.PositiveIntegerField(help_text="Orders containing both products.")
+
+    class Meta:
+        unique_together = ('product', 'rank')
+        ordering = ['product', 'rank']
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.recommended_id} (#{self.rank}, {self.score})"
+
+
 # ---------------------------
 # Product Media (Multiple Images/Videos)
 # ---------------------------
@@ -71,6 +118,7 @@ class ProductMedia(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='media')
     media_type=models.CharField(max_length=10,choices=MEDIA_TYPE_CHOICES,null=True,blank=True)
     file=models.FileField(upload_to='product_images/',null=True,blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     def __str__(self):
         return f"Media for {self.product.name}"
 
@@ -97,6 +145,9 @@ class Basket(models.Model):
     created_date = models.DateTimeField(auto_now=True)
     updated_date = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
+    # Open, active items only; kept current by store.cart.refresh_summaries.
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0)
 
     def __str__(self):
         return self.owner.email if self.owner else "Guest Basket"
@@ -107,14 +158,14 @@ class Basket(models.Model):
 
     @property
     def get_cart_total(self):
-        return sum(item.item_total for item in self.get_cart_items)
+        return self.subtotal
 
     def basket_total(self):
-        return sum(item.item_total for item in self.cartitems.filter(is_order_placed=False))
+        return self.subtotal
 
     @property
     def get_basket_total(self):
-        return sum(item.item_total for item in self.get_cart_items)
+        return self.subtotal
 
 
 # ---------------------------
@@ -128,6 +179,18 @@ class BasketItem(models.Model):
     updated_date = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
     is_order_placed = models.BooleanField(default=False)
+    # True while the row is open, NULL once ordered. MySQL ignores partial
+    # unique constraints, but a plain unique index over a nullable column
+    # lets any number of NULLs (ordered rows) through.
+    open_marker = models.GeneratedField(
+        expression=models.Case(
+            models.When(is_order_placed=False, then=models.Value(True)),
+            default=models.Value(None),
+            output_field=models.BooleanField(null=True),
+        ),
+        output_field=models.BooleanField(null=True),
+        db_persist=True,
+    )
 
     @property
     def item_total(self):
@@ -136,6 +199,103 @@ class BasketItem(models.Model):
     def __str__(self):
         return f"{self.quantity} x {self.product_object.name if self.product_object else 'Unknown'} in Basket {self.basket_object.id}"
 
+    class Meta:
+        constraints = [
+            # One open row per product per basket, so add-to-cart can upsert.
+            models.UniqueConstraint(
+                fields=['basket_object', 'product_object', 'open_marker'],
+                name='unique_open_basket_item',
+            ),
+        ]
+
+
+# ---------------------------
+# Stock Reservation (basket holds)
+# ---------------------------
+class StockReservation(models.Model):
+    """
+    Stock held for an open basket item. The quantity has already been taken
+    off Product.stock and goes back when the item is removed or the hold
+    expires (see store.cart.release_expired).
+    """
+    basket_item = models.OneToOneField(BasketItem, on_delete=models.CASCADE, related_name='reservation')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} held until {self.expires_at:%Y-%m-%d %H:%M}"
+
+
+class FlashSale(models.Model):
+    """
+    Puts a product in flash-sale mode (see store.flash). From ``starts_at``
+    its stock is counted in the cache and buyers need a waiting-room
+    admission to add it to a cart; the counts are flushed into
+    Product.stock until the sale is finalized shortly after ``ends_at``.
+    End a sale early by moving ``ends_at``, not by deleting it.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='flash_sales')
+    units = models.PositiveIntegerField(null=True, blank=True, help_text="Units on sale; blank for all stock.")
+    per_customer_limit = models.PositiveIntegerField(default=1)
+    starts_at = models.DateTimeField()
+    ends_at = models.DateTimeField()
+    admit_per_second = models.PositiveIntegerField(default=20, help_text="Waiting-room tickets admitted per second.")
+    admit_burst = models.PositiveIntegerField(default=100, help_text="Tickets admitted the moment the sale starts.")
+    # Written by store.flash: stock the sale started with, units sold so
+    # far that are already taken off Product.stock, and when it was closed.
+    initial_units = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    committed_units = models.IntegerField(default=0, editable=False)
+    finalized_at = models.DateTimeField(null=True, blank=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product'], condition=models.Q(finalized_at=None), name='one_open_flash_sale_per_product'
+            ),
+        ]
+
+    def __str__(self):
+        return f"Flash sale of {self.product_id} {self.starts_at:%Y-%m-%d %H:%M} to {self.ends_at:%H:%M}"
+
+
+class OutboundEmail(models.Model):
+    """
+    An email waiting to be sent. Views insert it in the same transaction as
+    the change it reports and the send_outbox worker delivers it (see
+    store.outbox), so no request waits on SMTP.
+    """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    DEAD = 'dead'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (SENDING, 'Sending'), (SENT, 'Sent'), (DEAD, 'Dead')]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    content_subtype = models.CharField(max_length=20, default='plain')
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    cc = models.JSONField(default=list, blank=True)
+    bcc = models.JSONField(default=list, blank=True)
+    # [[filename, base64 content, mimetype], ...]
+    attachments = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    send_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'send_after'], name='outbox_due_idx')]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)} ({self.status})"
+
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_basket(sender, instance, created, **kwargs):
@@ -184,6 +344,10 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # keyset scans over pending orders (reconcile_payments)
+            models.Index(fields=['status', 'id'], name='order_status_id_idx'),
+        ]
 
 # ---------------------------
 # Order Item
@@ -249,6 +413,7 @@ class HeroSection(models.Model):
     title=models.CharField(max_length=200)
     subtitle=models.CharField(max_length=300,blank=True,null=True)
     image=models.ImageField(upload_to='hero_images/')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     description=models.TextField(blank=True,null=True)
     created_at=models.DateTimeField(auto_now_add=True)
     updated_at=models.DateTimeField(auto_now=True)
@@ -0,0 +1,167 @@
+"""
+Transactional email outbox.
+
+Request code builds an EmailMessage as before and hands it to ``enqueue``
+instead of calling ``send()``: that is one INSERT into OutboundEmail, made in
+the caller's transaction, so an email exists exactly when the change it
+reports was committed. ``send_mail`` is a drop-in for Django's.
+
+The send_outbox worker claims due rows in batches (``deliver_batch``) and
+sends each batch over one SMTP connection. A failed message is retried
+with exponential backoff; after OUTBOX_MAX_ATTEMPTS it is marked dead and
+left for someone to look at in the admin. If the server can't be reached
+at all, the rest of the batch backs off with it rather than reconnecting
+once per message. Delivery is at least once: a
+worker that dies mid-batch has its rows picked up again after
+OUTBOX_LOCK_TIMEOUT.
+"""
+import base64
+import logging
+from datetime import timedelta
+from smtplib import SMTPAuthenticationError, SMTPConnectError, SMTPException, SMTPServerDisconnected
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from store.models import OutboundEmail
+
+
+logger = logging.getLogger(__name__)
+
+
+def _row(message):
+    attachments = []
+    for attachment in message.attachments:
+        filename, content, mimetype = attachment
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        attachments.append([filename, base64.b64encode(content).decode('ascii'), mimetype])
+    return OutboundEmail(
+        subject=message.subject[:255],
+        body=message.body,
+        content_subtype=message.content_subtype,
+        from_email=message.from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(message.to),
+        cc=list(message.cc),
+        bcc=list(message.bcc),
+        attachments=attachments,
+    )
+
+
+def enqueue(*messages):
+    """Queues EmailMessages for the worker with a single INSERT."""
+    return OutboundEmail.objects.bulk_create([_row(message) for message in messages])
+
+
+def send_mail(subject, message, from_email, recipient_list):
+    """Queued version of django.core.mail.send_mail (plain text)."""
+    return enqueue(EmailMessage(subject=subject, body=message, from_email=from_email, to=recipient_list))
+
+
+def to_message(row, connection=None):
+    message = EmailMessage(
+        subject=row.subject, body=row.body, from_email=row.from_email,
+        to=row.to, cc=row.cc, bcc=row.bcc, connection=connection,
+    )
+    message.content_subtype = row.content_subtype
+    for filename, content, mimetype in row.attachments:
+        message.attach(filename, base64.b64decode(content), mimetype)
+    return message
+
+
+def retry_delay(attempts):
+    return min(settings.OUTBOX_RETRY_MAX_DELAY, settings.OUTBOX_RETRY_DELAY * 2 ** max(0, attempts - 1))
+
+
+def claim_batch(batch_size=None):
+    """Marks up to ``batch_size`` due emails as sending and returns them, oldest first."""
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.OUTBOX_LOCK_TIMEOUT)
+    due = (
+        Q(status=OutboundEmail.PENDING, send_after__lte=now)
+        | Q(status=OutboundEmail.SENDING, locked_at__lt=stale)
+    )
+    with transaction.atomic():
+        ids = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(due)
+            .order_by('send_after', 'id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if ids:
+            OutboundEmail.objects.filter(pk__in=ids).update(
+                status=OutboundEmail.SENDING, locked_at=now, attempts=F('attempts') + 1
+            )
+    return list(OutboundEmail.objects.filter(pk__in=ids).order_by('send_after', 'id')) if ids else []
+
+
+def _unreachable(exc):
+    # Socket errors and a refused or dropped session, as opposed to the
+    # server rejecting this particular message.
+    if isinstance(exc, (SMTPConnectError, SMTPServerDisconnected, SMTPAuthenticationError)):
+        return True
+    return isinstance(exc, OSError) and not isinstance(exc, SMTPException)
+
+
+def _failed(row, exc, now):
+    row.last_error = str(exc)
+    if row.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        row.status = OutboundEmail.DEAD
+    else:
+        row.status = OutboundEmail.PENDING
+        row.send_after = now + timedelta(seconds=retry_delay(row.attempts))
+
+
+def _open(connection):
+    """Opens the SMTP session; returns the error if the server can't be reached."""
+    try:
+        connection.open()
+    except Exception as exc:
+        logger.warning("outbox could not connect: %s", exc)
+        return exc
+    return None
+
+
+def deliver_batch(batch_size=None):
+    """Sends one batch over a single connection and returns how many were attempted."""
+    rows = claim_batch(batch_size)
+    if not rows:
+        return 0
+
+    # Opened up front: a connection that isn't open is opened and closed
+    # again by every send().
+    connection = get_connection()
+    now = timezone.now()
+    down = _open(connection)
+    try:
+        for row in rows:
+            row.locked_at = None
+            if down is not None:
+                _failed(row, down, now)
+                continue
+            try:
+                to_message(row, connection).send()
+            except Exception as exc:
+                # Drop the session and start a fresh one for the next message.
+                connection.close()
+                logger.warning("outbox email %s failed (attempt %s): %s", row.pk, row.attempts, exc)
+                _failed(row, exc, now)
+                down = exc if _unreachable(exc) else _open(connection)
+            else:
+                row.status = OutboundEmail.SENT
+                row.sent_at = now
+    finally:
+        connection.close()
+        OutboundEmail.objects.bulk_update(rows, ['status', 'last_error', 'send_after', 'locked_at', 'sent_at'])
+    return len(rows)
+
+
+def purge_sent(older_than=None):
+    """Deletes emails sent more than OUTBOX_KEEP_DAYS ago; dead ones are kept."""
+    older_than = older_than or timezone.now() - timedelta(days=settings.OUTBOX_KEEP_DAYS)
+    deleted, _ = OutboundEmail.objects.filter(status=OutboundEmail.SENT, sent_at__lt=older_than).delete()
+    return deleted
@@ -0,0 +1,54 @@
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class ProductCursorPagination(CursorPagination):
+    """
+    Opt-in keyset pagination for product listings.
+
+    A request is paginated when it sends ``cursor`` or ``page_size`` (or when
+    PRODUCT_LIST_PAGINATE_BY_DEFAULT is on). ``?paginate=false`` always
+    returns the old unpaginated list so existing frontends keep working.
+    """
+    page_size = settings.PRODUCT_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.PRODUCT_MAX_PAGE_SIZE
+    ordering_query_param = 'ordering'
+
+    # Every ordering ends on the primary key so the keyset is stable.
+    orderings = {
+        'id': ('id',),
+        '-id': ('-id',),
+        'price': ('price', 'id'),
+        '-price': ('-price', '-id'),
+    }
+    ordering = orderings['id']
+
+    def is_requested(self, request):
+        flag = request.query_params.get('paginate')
+        if flag is not None:
+            return flag.lower() not in ('0', 'false', 'no')
+        if self.cursor_query_param in request.query_params or self.page_size_query_param in request.query_params:
+            return True
+        return settings.PRODUCT_LIST_PAGINATE_BY_DEFAULT
+
+    def get_ordering(self, request, queryset, view):
+        key = request.query_params.get(self.ordering_query_param)
+        if key is None:
+            return self.ordering
+        if key not in self.orderings:
+            raise ValidationError({self.ordering_query_param: [f"Must be one of: {', '.join(self.orderings)}."]})
+        return self.orderings[key]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class SearchPagination(PageNumberPagination):
+    """Page-number pagination for relevance-ranked search results."""
+    page_size = settings.PRODUCT_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.PRODUCT_MAX_PAGE_SIZE
@@ -0,0 +1,100 @@
+"""
+"Frequently bought together" recommendations.
+
+A batch job builds a sparse orders x products matrix from OrderItem rows.
+Multiplying it by its own transpose gives, for every pair of products, the
+number of orders that contain both. The top N partners of each product are
+written to ProductRecommendation, so serving them takes one indexed lookup.
+numpy/scipy are only imported by the batch job, never by web requests.
+"""
+from datetime import timedelta
+from itertools import chain
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from store.cache import bump_catalog_version
+from store.models import OrderItem, ProductRecommendation
+
+
+def order_product_pairs(since=None):
+    items = OrderItem.objects.exclude(order__status='Cancelled')
+    if since is not None:
+        items = items.filter(order__created_at__gte=since)
+    return items.values_list('order_id', 'product_id').order_by()
+
+
+def cooccurrence(pairs):
+    """
+    Returns ``(product_ids, matrix)`` where ``matrix[i, j]`` counts the
+    orders containing both ``product_ids[i]`` and ``product_ids[j]``.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    pairs = np.fromiter(chain.from_iterable(pairs), dtype=np.int64).reshape(-1, 2)
+    if not len(pairs):
+        return np.empty(0, dtype=np.int64), sparse.csr_matrix((0, 0), dtype=np.int32)
+
+    order_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+    product_ids, cols = np.unique(pairs[:, 1], return_inverse=True)
+    baskets = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.int32), (rows, cols)), shape=(len(order_ids), len(product_ids))
+    )
+    # The same product twice in one order still counts once.
+    baskets.data[:] = 1
+
+    matrix = (baskets.T @ baskets).tocsr()
+    matrix.setdiag(0)
+    matrix.eliminate_zeros()
+    return product_ids, matrix
+
+
+def top_n(product_ids, matrix, n):
+    """
+    Top ``n`` partners per product as ``(product, recommended, rank, score)``
+    arrays, highest score first and ties broken by product id.
+    """
+    import numpy as np
+
+    matrix = matrix.tocoo()
+    rows, cols, scores = matrix.row, matrix.col, matrix.data
+    order = np.lexsort((cols, -scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+
+    # Position of each entry within its row: index minus where the row starts.
+    starts = np.searchsorted(rows, rows, side='left')
+    ranks = np.arange(len(rows)) - starts + 1
+    keep = ranks <= n
+    return product_ids[rows[keep]], product_ids[cols[keep]], ranks[keep], scores[keep]
+
+
+def build_recommendations(days=None, n=None):
+    """Recomputes the whole table and returns the number of rows written."""
+    days = days if days is not None else settings.RECOMMENDATIONS_WINDOW_DAYS
+    n = n if n is not None else settings.RECOMMENDATIONS_TOP_N
+    since = timezone.now() - timedelta(days=days) if days else None
+
+    product_ids, matrix = cooccurrence(order_product_pairs(since).iterator(chunk_size=10000))
+    products, recommended, ranks, scores = top_n(product_ids, matrix, n)
+    rows = [
+        ProductRecommendation(product_id=p, recommended_id=r, rank=rank, score=score)
+        for p, r, rank, score in zip(products.tolist(), recommended.tolist(), ranks.tolist(), scores.tolist())
+    ]
+
+    with transaction.atomic():
+        ProductRecommendation.objects.all().delete()
+        ProductRecommendation.objects.bulk_create(rows, batch_size=2000)
+        transaction.on_commit(bump_catalog_version)
+    return len(rows)
+
+
+def related_products(product_id, limit=None):
+    limit = limit or settings.RECOMMENDATIONS_TOP_N
+    recommendations = (
+        ProductRecommendation.objects.filter(product_id=product_id, recommended__available=True)
+        .select_related('recommended__category')
+        .order_by('rank')[:limit]
+    )
+    return [recommendation.recommended for recommendation in recommendations]
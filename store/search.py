@@ -0,0 +1,243 @@
+"""
+Full-text product search.
+
+Each product has one document row in ``store_product_fts`` holding its name,
+brand, description and category name. On SQLite that table is an FTS5
+virtual table ranked with bm25(); on MySQL it is an InnoDB table with a
+FULLTEXT index ranked with MATCH ... AGAINST. Other databases fall back to
+an unranked icontains scan. Rows are kept in sync by store.signals.
+"""
+import re
+
+from django.db import connection as default_connection
+
+
+SEARCH_TABLE = 'store_product_fts'
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+DOCUMENT_FIELDS = ('id', 'name', 'brand', 'description', 'category__name')
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query or '')[:10]
+
+
+def document_rows(queryset):
+    return queryset.values_list(*DOCUMENT_FIELDS)
+
+
+def _chunks(rows, size=500):
+    chunk = []
+    for row in rows:
+        chunk.append(tuple('' if value is None else value for value in row))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class SQLiteFTSBackend:
+    vendor = 'sqlite'
+    ranked = True
+
+    def create(self, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            "name, brand, description, category, tokenize='unicode61 remove_diacritics 2')"
+        )
+
+    def drop(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def index(self, cursor, rows):
+        for chunk in _chunks(rows):
+            ids = [row[0] for row in chunk]
+            placeholders = ','.join(['%s'] * len(ids))
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})", ids)
+            cursor.executemany(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, name, brand, description, category) VALUES (%s, %s, %s, %s, %s)",
+                chunk,
+            )
+
+    def remove(self, cursor, ids):
+        if ids:
+            placeholders = ','.join(['%s'] * len(ids))
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})", list(ids))
+
+    def match_expression(self, terms):
+        return ' '.join('"%s"*' % term for term in terms)
+
+    def count(self, cursor, terms):
+        cursor.execute(
+            f"SELECT COUNT(*) FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s",
+            [self.match_expression(terms)],
+        )
+        return cursor.fetchone()[0]
+
+    def search(self, cursor, terms, limit, offset):
+        # Column weights: name, brand, description, category.
+        cursor.execute(
+            f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s "
+            f"ORDER BY bm25({SEARCH_TABLE}, 10.0, 5.0, 1.0, 3.0), rowid LIMIT %s OFFSET %s",
+            [self.match_expression(terms), limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class MySQLFullTextBackend:
+    vendor = 'mysql'
+    ranked = True
+
+    def create(self, cursor):
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+            "product_id BIGINT NOT NULL PRIMARY KEY, "
+            "name VARCHAR(100) NOT NULL, "
+            "brand VARCHAR(100) NOT NULL, "
+            "description LONGTEXT NOT NULL, "
+            "category VARCHAR(100) NOT NULL, "
+            f"FULLTEXT KEY {SEARCH_TABLE}_ft (name, brand, description, category)"
+            ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+        )
+
+    def drop(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def index(self, cursor, rows):
+        for chunk in _chunks(rows):
+            cursor.executemany(
+                f"REPLACE INTO {SEARCH_TABLE} (product_id, name, brand, description, category) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                chunk,
+            )
+
+    def remove(self, cursor, ids):
+        if ids:
+            placeholders = ','.join(['%s'] * len(ids))
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE product_id IN ({placeholders})", list(ids))
+
+    def match_expression(self, terms):
+        return ' '.join('+%s*' % term for term in terms)
+
+    def count(self, cursor, terms):
+        cursor.execute(
+            f"SELECT COUNT(*) FROM {SEARCH_TABLE} "
+            "WHERE MATCH (name, brand, description, category) AGAINST (%s IN BOOLEAN MODE)",
+            [self.match_expression(terms)],
+        )
+        return cursor.fetchone()[0]
+
+    def search(self, cursor, terms, limit, offset):
+        cursor.execute(
+            f"SELECT product_id, MATCH (name, brand, description, category) AGAINST (%s IN BOOLEAN MODE) AS score "
+            f"FROM {SEARCH_TABLE} "
+            "WHERE MATCH (name, brand, description, category) AGAINST (%s IN BOOLEAN MODE) "
+            "ORDER BY score DESC, product_id LIMIT %s OFFSET %s",
+            [self.match_expression(terms), self.match_expression(terms), limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class FallbackBackend:
+    """Unranked icontains search for databases without a supported index."""
+    vendor = None
+    ranked = False
+
+    def create(self, cursor):
+        pass
+
+    def drop(self, cursor):
+        pass
+
+    def index(self, cursor, rows):
+        pass
+
+    def remove(self, cursor, ids):
+        pass
+
+    def _queryset(self, terms):
+        from django.db.models import Q
+        from store.models import Product
+
+        queryset = Product.objects.all()
+        for term in terms:
+            queryset = queryset.filter(
+                Q(name__icontains=term) | Q(brand__icontains=term)
+                | Q(description__icontains=term) | Q(category__name__icontains=term)
+            )
+        return queryset
+
+    def count(self, cursor, terms):
+        return self._queryset(terms).count()
+
+    def search(self, cursor, terms, limit, offset):
+        return list(self._queryset(terms).order_by('id').values_list('id', flat=True)[offset:offset + limit])
+
+
+BACKENDS = {backend.vendor: backend for backend in (SQLiteFTSBackend(), MySQLFullTextBackend())}
+
+
+def get_backend(connection=None):
+    connection = connection or default_connection
+    return BACKENDS.get(connection.vendor, FallbackBackend())
+
+
+def create_search_index(connection, queryset):
+    backend = get_backend(connection)
+    with connection.cursor() as cursor:
+        backend.create(cursor)
+        backend.index(cursor, document_rows(queryset).iterator(chunk_size=2000))
+
+
+def drop_search_index(connection):
+    with connection.cursor() as cursor:
+        get_backend(connection).drop(cursor)
+
+
+def index_products(queryset):
+    with default_connection.cursor() as cursor:
+        get_backend().index(cursor, document_rows(queryset).iterator(chunk_size=2000))
+
+
+def remove_products(ids):
+    with default_connection.cursor() as cursor:
+        get_backend().remove(cursor, list(ids))
+
+
+class SearchResults:
+    """
+    Lazy, relevance-ordered result set that Django's Paginator can slice.
+    Only the requested page of ids is fetched; products come back in rank order.
+    """
+
+    def __init__(self, query, queryset=None):
+        from store.models import Product
+
+        self.terms = tokenize(query)
+        self.queryset = queryset if queryset is not None else Product.objects.select_related('category')
+        self.backend = get_backend()
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            if not self.terms:
+                self._count = 0
+            else:
+                with default_connection.cursor() as cursor:
+                    self._count = self.backend.count(cursor, self.terms)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError('SearchResults only supports slicing')
+        offset = key.start or 0
+        limit = (key.stop if key.stop is not None else self.count()) - offset
+        if not self.terms or limit <= 0:
+            return []
+        with default_connection.cursor() as cursor:
+            ids = self.backend.search(cursor, self.terms, limit, offset)
+        products = self.queryset.in_bulk(ids)
+        return [products[pk] for pk in ids if pk in products]
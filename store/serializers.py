@@ -1,23 +1,41 @@
+from decimal import Decimal
+
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 User = get_user_model()
 from .models import CustomUser, HeroSection
 
-from .models import Category, Product, Contact, Order, OrderItem, Basket, BasketItem, ProductMedia,Wishlist
+from .models import Category, Product, Contact, Order, OrderItem, Basket, BasketItem, ProductMedia,Wishlist, FlashSale
+from .images import variant_urls
+from . import flash
+
+
+class ImageVariantsField(serializers.Field):
+    """Exposes ``image_variants`` as srcset-ready URLs (see store.images)."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return variant_urls(value, self.context.get('request'))
 
 
 # Category Serializer
 class CategorySerializer(serializers.ModelSerializer):
     image = serializers.ImageField(required=False, allow_null=True, use_url=True)
+    image_variants = ImageVariantsField()
     class Meta:
         model = Category
         fields = '__all__'
 
 # ProductMedia Serializer
 class ProductMediaSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = ProductMedia
-        fields = ['id', 'product', 'media_type','file']
+        fields = ['id', 'product', 'media_type','file', 'image_variants']
 
 
 # Product Serializer (WITH IMAGE & CATEGORY DETAILS)
@@ -26,10 +44,159 @@ class ProductSerializer(serializers.ModelSerializer):
     category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all())
     category_detail = CategorySerializer(source='category', read_only=True)
     image = serializers.ImageField(required=False, allow_null=True, use_url=True)
+    image_variants = ImageVariantsField()
     # media=ProductMediaSerializer(many=True,read_only=True)
     class Meta:
         model = Product
-        fields = ['id', 'brand','name','price', 'description', 'stock', 'category', 'category_detail', 'image']
+        fields = ['id', 'brand','name','price', 'description', 'stock', 'category', 'category_detail', 'image', 'image_variants']
+
+
+TWO_PLACES = Decimal('0.01')
+PRODUCT_FIELDS = (
+    'id', 'brand', 'name', 'price', 'description', 'stock', 'category', 'category_detail', 'image', 'image_variants',
+)
+PRODUCT_COLUMNS = {
+    'id': ('id',),
+    'brand': ('brand',),
+    'name': ('name',),
+    'price': ('price',),
+    'description': ('description',),
+    'stock': ('stock',),
+    'category': ('category',),
+    'category_detail': ('category',),
+    'image': ('image',),
+    'image_variants': ('image_variants',),
+}
+
+
+def product_fieldset(request):
+    """
+    Fields requested with ``?fields=id,name,price,image``; ``?expand=`` adds
+    to that list (e.g. ``expand=category_detail``). Without ``fields`` the
+    full ProductSerializer shape is returned.
+    """
+    if request is None:
+        return PRODUCT_FIELDS
+    params = request.query_params
+    requested = [f.strip() for f in params.get('fields', '').split(',') if f.strip() in PRODUCT_FIELDS]
+    if not requested:
+        return PRODUCT_FIELDS
+    expand = [f.strip() for f in params.get('expand', '').split(',') if f.strip() in PRODUCT_FIELDS]
+    return tuple(f for f in PRODUCT_FIELDS if f in requested or f in expand)
+
+
+def restrict_product_queryset(queryset, fields):
+    """Loads only the columns the fieldset needs, so grids never read description."""
+    columns = {'id', 'price'}  # price is always needed for (price, id) cursors
+    for field in fields:
+        columns.update(PRODUCT_COLUMNS[field])
+    if 'category_detail' in fields:
+        queryset = queryset.select_related('category')
+    else:
+        queryset = queryset.select_related(None)
+    return queryset.only(*columns)
+
+
+class ProductListSerializer(serializers.BaseSerializer):
+    """
+    Read-only fast path for product listings. Builds plain dicts instead of
+    running ModelSerializer fields, and only emits ``context['fields']``
+    (defaults to the full ProductSerializer shape).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._categories = {}
+
+    def _url(self, file):
+        if not file:
+            return None
+        url = file.url
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def _category(self, category):
+        # Few categories, many products: serialize each category once.
+        if category.pk not in self._categories:
+            self._categories[category.pk] = CategorySerializer(category, context=self.context).data
+        return self._categories[category.pk]
+
+    def to_representation(self, instance):
+        fields = self.context.get('fields', PRODUCT_FIELDS)
+        data = {}
+        for field in fields:
+            if field == 'price':
+                data['price'] = str(instance.price.quantize(TWO_PLACES))
+            elif field == 'category':
+                data['category'] = instance.category_id
+            elif field == 'category_detail':
+                data['category_detail'] = self._category(instance.category)
+            elif field == 'image':
+                data['image'] = self._url(instance.image)
+            elif field == 'image_variants':
+                data['image_variants'] = variant_urls(instance.image_variants, self.context.get('request'))
+            else:
+                data[field] = getattr(instance, field)
+        return data
+
+
+class ProductImportSerializer(serializers.Serializer):
+    """
+    One row of a bulk import. ``category`` may be an id, slug or name and is
+    resolved against ``context['categories']`` (a store.bulk.CategoryLookup)
+    instead of querying per row.
+    """
+    id = serializers.IntegerField(required=False, allow_null=True, min_value=1)
+    brand = serializers.CharField(max_length=100, required=False, allow_blank=True, allow_null=True)
+    category = serializers.CharField()
+    name = serializers.CharField(max_length=100)
+    description = serializers.CharField(required=False, allow_blank=True, default='')
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'))
+    stock = serializers.IntegerField(min_value=0)
+    available = serializers.BooleanField(required=False, default=True)
+
+    def to_internal_value(self, data):
+        # CSV cells are always strings; treat empty optional cells as absent.
+        data = {key: value for key, value in data.items() if not (value == '' and key in ('id', 'available'))}
+        return super().to_internal_value(data)
+
+    def validate_category(self, value):
+        category = self.context['categories'].get(value)
+        if category is None:
+            raise serializers.ValidationError(f"Unknown category '{value}'.")
+        return category
+
+
+class ProductOperationSerializer(serializers.Serializer):
+    """
+    One change in a bulk catalog mutation: ``stock`` (absolute) or
+    ``stock_delta``, and/or ``price`` (absolute) or ``price_percent``.
+    """
+    id = serializers.IntegerField(min_value=1)
+    stock = serializers.IntegerField(required=False, min_value=0)
+    stock_delta = serializers.IntegerField(required=False)
+    price = serializers.DecimalField(required=False, max_digits=10, decimal_places=2, min_value=Decimal('0'))
+    price_percent = serializers.DecimalField(required=False, max_digits=6, decimal_places=2, min_value=Decimal('-100'))
+
+    def validate(self, attrs):
+        if 'stock' in attrs and 'stock_delta' in attrs:
+            raise serializers.ValidationError("Send either stock or stock_delta, not both.")
+        if 'price' in attrs and 'price_percent' in attrs:
+            raise serializers.ValidationError("Send either price or price_percent, not both.")
+        if len(attrs) == 1:
+            raise serializers.ValidationError("Nothing to change.")
+        return attrs
+
+
+class BulkProductUpdateSerializer(serializers.Serializer):
+    operations = ProductOperationSerializer(many=True, allow_empty=False, max_length=1000)
+    all_or_nothing = serializers.BooleanField(required=False, default=False)
+
+    def validate_operations(self, value):
+        ids = [op['id'] for op in value]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError("Each product id may appear only once.")
+        return value
 
 
 # User Registration Serializer
@@ -103,6 +270,25 @@ class CartItemSerializer(serializers.ModelSerializer):
         }
 
 
+class CartSyncItemSerializer(serializers.Serializer):
+    # Plain ids: products are checked in one query by the view, not per row.
+    product = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=0, max_value=1000)
+
+
+class FlashSaleSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.name', read_only=True)
+    # Live count from the flash cache; None until the first unit is claimed.
+    available = serializers.SerializerMethodField()
+
+    class Meta:
+        model = FlashSale
+        fields = ['id', 'product', 'product_name', 'units', 'per_customer_limit', 'starts_at', 'ends_at', 'available']
+
+    def get_available(self, obj):
+        return flash.available(obj.pk)
+
+
 class CartSerializer(serializers.ModelSerializer):
     cartitems = CartItemSerializer(many=True, read_only=True)
     get_basket_total = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
@@ -177,6 +363,8 @@ class CustomUserSerializer(serializers.ModelSerializer):
 
 # Hero Section Serializer
 class HeroSectionSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = HeroSection
         fields = '__all__'
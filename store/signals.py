@@ -0,0 +1,124 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from store import flash
+from store.cache import bump_catalog_version
+from store.cart import refresh_basket, refresh_baskets_for_products
+from store.facets import adjust_facet_count, facet_key, product_facet_key
+from store.images import generate_variants, strip_metadata
+from store.models import BasketItem, Category, FlashSale, HeroSection, Product, ProductMedia
+from store.search import index_products, remove_products
+
+
+CATALOG_MODELS = (Product, Category, ProductMedia, HeroSection)
+
+
+def catalog_changed(sender, **kwargs):
+    # Bump after commit so a concurrent reader can't re-cache the old rows
+    # under the new version.
+    transaction.on_commit(bump_catalog_version)
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(catalog_changed, sender=model, dispatch_uid=f'catalog_save_{model.__name__}')
+    post_delete.connect(catalog_changed, sender=model, dispatch_uid=f'catalog_delete_{model.__name__}')
+
+
+@receiver(post_save, sender=FlashSale, dispatch_uid='flash_sale_saved')
+@receiver(post_delete, sender=FlashSale, dispatch_uid='flash_sale_deleted')
+def flash_sales_changed(sender, **kwargs):
+    # Workers re-read the sale list from the database on their next request.
+    transaction.on_commit(flash.forget_sales)
+
+
+@receiver(post_save, sender=Product, dispatch_uid='search_index_product')
+def index_product(sender, instance, **kwargs):
+    index_products(Product.objects.filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=Product, dispatch_uid='search_remove_product')
+def unindex_product(sender, instance, **kwargs):
+    remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Category, dispatch_uid='search_index_category')
+def index_category_products(sender, instance, created, **kwargs):
+    if not created:
+        index_products(Product.objects.filter(category=instance))
+
+
+@receiver(pre_save, sender=Product, dispatch_uid='facet_remember_product')
+def remember_facet_key(sender, instance, **kwargs):
+    instance._facet_key_before = None
+    instance._price_before = None
+    if instance.pk:
+        before = Product.objects.filter(pk=instance.pk).values_list('category_id', 'brand', 'price', 'stock').first()
+        if before:
+            instance._facet_key_before = facet_key(*before)
+            instance._price_before = before[2]
+
+
+@receiver(post_save, sender=Product, dispatch_uid='facet_count_product')
+def count_product_facets(sender, instance, **kwargs):
+    before = getattr(instance, '_facet_key_before', None)
+    after = product_facet_key(instance)
+    if before == after:
+        return
+    if before is not None:
+        adjust_facet_count(before, -1)
+    adjust_facet_count(after, 1)
+
+
+@receiver(post_delete, sender=Product, dispatch_uid='facet_uncount_product')
+def uncount_product_facets(sender, instance, **kwargs):
+    adjust_facet_count(product_facet_key(instance), -1)
+
+
+@receiver(post_save, sender=Product, dispatch_uid='basket_reprice_product')
+def reprice_baskets(sender, instance, created, **kwargs):
+    before = getattr(instance, '_price_before', None)
+    if not created and before is not None and before != instance.price:
+        refresh_baskets_for_products([instance.pk])
+
+
+def basket_item_changed(sender, instance, raw=False, **kwargs):
+    # Saves/deletes through the ORM; store.cart refreshes after its own UPDATEs.
+    if not raw and instance.basket_object_id:
+        refresh_basket(instance.basket_object_id)
+
+
+post_save.connect(basket_item_changed, sender=BasketItem, dispatch_uid='basket_summary_save')
+post_delete.connect(basket_item_changed, sender=BasketItem, dispatch_uid='basket_summary_delete')
+
+
+IMAGE_FIELDS = {Product: 'image', Category: 'image', HeroSection: 'image', ProductMedia: 'file'}
+
+
+def _is_image(instance):
+    return not isinstance(instance, ProductMedia) or instance.media_type == 'image'
+
+
+def strip_uploaded_image_metadata(sender, instance, **kwargs):
+    if _is_image(instance):
+        strip_metadata(getattr(instance, IMAGE_FIELDS[sender]))
+
+
+def build_image_variants(sender, instance, raw=False, **kwargs):
+    if raw or not _is_image(instance):
+        return
+    field_file = getattr(instance, IMAGE_FIELDS[sender])
+    if not field_file:
+        variants = {}
+    elif instance.image_variants.get('source') == field_file.name:
+        return
+    else:
+        variants = generate_variants(field_file)
+    if variants != instance.image_variants:
+        sender.objects.filter(pk=instance.pk).update(image_variants=variants)
+        instance.image_variants = variants
+
+
+for model in IMAGE_FIELDS:
+    pre_save.connect(strip_uploaded_image_metadata, sender=model, dispatch_uid=f'image_strip_{model.__name__}')
+    post_save.connect(build_image_variants, sender=model, dispatch_uid=f'image_variants_{model.__name__}')
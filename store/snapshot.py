@@ -0,0 +1,179 @@
+"""
+Pre-compressed catalog snapshot for the storefront's first paint.
+
+The snapshot is one JSON document with every category, every available
+product (with its primary media) and the hero sections. It is built once
+per catalog version (see store.cache) by the build_catalog_snapshot command
+(run with --loop it rebuilds whenever the version moves) and written to
+CATALOG_SNAPSHOT_DIR as plain, gzip and brotli files. Serving it never
+builds: it streams the newest snapshot on disk, which can trail the catalog
+by one poll interval.
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+import brotli
+from django.conf import settings
+from django.db.models import Prefetch
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from store.cache import get_catalog_version
+from store.models import Category, HeroSection, Product, ProductMedia
+from store.serializers import (
+    PRODUCT_FIELDS, CategorySerializer, HeroSectionSerializer, ProductListSerializer, ProductMediaSerializer,
+)
+
+# Preferred first when the client accepts several.
+ENCODINGS = ('br', 'gzip', 'identity')
+SUFFIXES = {'br': '.json.br', 'gzip': '.json.gz', 'identity': '.json'}
+
+
+def snapshot_dir():
+    return settings.CATALOG_SNAPSHOT_DIR
+
+
+def _path(version, encoding):
+    return os.path.join(snapshot_dir(), f'catalog-{version}{SUFFIXES[encoding]}')
+
+
+def _meta_path(version):
+    return os.path.join(snapshot_dir(), f'catalog-{version}.meta')
+
+
+def _write_atomic(path, content):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as handle:
+        handle.write(content)
+    os.replace(tmp, path)
+
+
+def build_document(version):
+    media = Prefetch(
+        'media',
+        queryset=ProductMedia.objects.filter(media_type='image').order_by('id'),
+        to_attr='image_media',
+    )
+    products = Product.objects.filter(available=True).select_related('category').prefetch_related(media).order_by('id')
+    serializer = ProductListSerializer(context={'fields': PRODUCT_FIELDS})
+
+    product_data = []
+    for product in products:
+        data = serializer.to_representation(product)
+        primary = product.image_media[0] if product.image_media else None
+        data['primary_media'] = ProductMediaSerializer(primary).data if primary else None
+        product_data.append(data)
+
+    return {
+        "version": version,
+        "generated_at": timezone.now().isoformat(),
+        "categories": CategorySerializer(Category.objects.order_by('id'), many=True).data,
+        "products": product_data,
+        "hero_sections": HeroSectionSerializer(HeroSection.objects.order_by('id'), many=True).data,
+    }
+
+
+def build_snapshot(version=None):
+    """Renders and writes every encoding for ``version``; returns its metadata."""
+    version = version if version is not None else get_catalog_version()
+    os.makedirs(snapshot_dir(), exist_ok=True)
+
+    body = JSONRenderer().render(build_document(version))
+    bodies = {
+        'identity': body,
+        'gzip': gzip.compress(body, compresslevel=9, mtime=0),
+        'br': brotli.compress(body, quality=11),
+    }
+
+    for encoding, content in bodies.items():
+        _write_atomic(_path(version, encoding), content)
+
+    meta = {
+        "version": version,
+        "etag": '"%s"' % hashlib.sha256(body).hexdigest()[:32],
+        "encodings": sorted(bodies),
+    }
+    # Written last: its presence means every encoding is in place.
+    _write_atomic(_meta_path(version), json.dumps(meta).encode('utf-8'))
+    _remove_older_versions(keep=version)
+    return meta
+
+
+def _built_versions():
+    try:
+        names = os.listdir(snapshot_dir())
+    except FileNotFoundError:
+        return []
+    versions = []
+    for name in names:
+        version = name[len('catalog-'):].split('.', 1)[0]
+        if name.startswith('catalog-') and version.isdigit():
+            versions.append((int(version), name))
+    return versions
+
+
+def _remove_older_versions(keep):
+    for version, name in _built_versions():
+        if version < keep:
+            try:
+                os.remove(os.path.join(snapshot_dir(), name))
+            except FileNotFoundError:
+                pass
+
+
+_loaded = {}
+
+
+def load_meta(version):
+    if version in _loaded:
+        return _loaded[version]
+    try:
+        with open(_meta_path(version), 'rb') as handle:
+            meta = json.loads(handle.read())
+    except (FileNotFoundError, ValueError):
+        return None
+    _loaded.clear()
+    _loaded[version] = meta
+    return meta
+
+
+def is_built(version):
+    return os.path.exists(_meta_path(version))
+
+
+def get_snapshot():
+    """
+    Metadata for the snapshot to serve: the current version's if it has been
+    built, else the newest one on disk while the builder catches up. None if
+    nothing has been built yet.
+    """
+    meta = load_meta(get_catalog_version())
+    if meta is not None:
+        return meta
+    for version in sorted({version for version, name in _built_versions() if name.endswith('.meta')}, reverse=True):
+        meta = load_meta(version)
+        if meta is not None:
+            return meta
+    return None
+
+
+def snapshot_path(meta, encoding):
+    return _path(meta['version'], encoding)
+
+
+def snapshot_etag(meta, encoding):
+    # Each encoding is a different byte stream, so each gets its own strong tag.
+    if encoding == 'identity':
+        return meta['etag']
+    return '"%s-%s"' % (meta['etag'].strip('"'), encoding)
+
+
+def choose_encoding(meta, accept_encoding):
+    accepted = {part.split(';')[0].strip().lower() for part in (accept_encoding or '').split(',')}
+    for encoding in ENCODINGS:
+        if encoding == 'identity' or (encoding in accepted and encoding in meta['encodings']):
+            return encoding
+    return 'identity'
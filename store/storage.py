@@ -0,0 +1,61 @@
+import hashlib
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
+
+
+HASHED_NAME_RE = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.[A-Za-z0-9]+)?$')
+SHARD_SUFFIX_RE = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{2}$')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores every upload under the SHA-256 of its content:
+
+        <upload_to>/<h[0:2]>/<h[2:4]>/<h><ext>
+
+    The two-level prefix keeps directories small. Re-uploading identical bytes
+    returns the existing name without writing anything, and because a name
+    can never point at different content, its URL can be cached forever.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            from django.core.files import File
+            content = File(content, name)
+
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+
+        # Names derived from a stored file (e.g. image derivatives) carry its
+        # shard; drop it so they are sharded by their own hash instead.
+        directory = SHARD_SUFFIX_RE.sub('', posixpath.dirname(name.replace('\\', '/')))
+        extension = os.path.splitext(name)[1].lower()
+        hashed = posixpath.join(directory, digest[:2], digest[2:4], digest + extension)
+        if self.exists(hashed):
+            return hashed
+        return super().save(hashed, content, max_length=max_length)
+
+
+def is_immutable_name(name):
+    return bool(HASHED_NAME_RE.search(name))
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """
+    django.views.static.serve, plus a one-year immutable Cache-Control for
+    content-addressed names. Legacy flat names keep default caching.
+    """
+    response = serve(request, path, document_root=document_root, show_indexes=show_indexes)
+    if response.status_code == 200 and is_immutable_name(path):
+        patch_cache_control(response, public=True, max_age=settings.MEDIA_IMMUTABLE_MAX_AGE, immutable=True)
+    return response
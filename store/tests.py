@@ -1,3 +1,1213 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from smtplib import SMTPException, SMTPRecipientsRefused
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+
+from django.conf import settings
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.test import APIClient
+
+from payment.gateways import CircuitOpen, GatewayError, GatewayTimeout, get_gateway
+from payment.resilience import GatewayMetrics, gateway_metrics as collect_gateway_metrics
+from payment.models import IdempotencyKey, Payment, WebhookEvent
+from payment.reconcile import reconcile
+from payment.webhooks import process_pending
+from store.cache import get_cache_stats, get_catalog_cache, get_catalog_last_modified, get_catalog_version
+
+from store import cart, flash, outbox
+from store.models import (
+    Basket, BasketItem, CatalogFacetCount, Category, CustomUser, FlashSale, Order, OrderItem, OutboundEmail, Product,
+    ProductRecommendation, StockReservation,
+)
+from store.outbox import deliver_batch
+from store.search import SearchResults
+from store.storage import ContentAddressedStorage, is_immutable_name
+
+
+class CheckoutQueryCountTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Attar")
+        self.client = APIClient()
+
+    def checkout_queries(self, n_items, expire_holds=False):
+        user = CustomUser.objects.create_user(username=f"u{n_items}{expire_holds}", email=f"u{n_items}{expire_holds}@x.com", password="x")
+        basket = Basket.objects.get(owner=user)
+        for i in range(n_items):
+            product = Product.objects.create(
+                category=self.category, name=f"P{n_items}-{i}", description="", price=100, stock=50
+            )
+            cart.add_to_cart(basket, product.pk, quantity=2)
+        if expire_holds:
+            StockReservation.objects.filter(basket_item__basket_object=basket).delete()
+
+        self.client.force_authenticate(user)
+        gateway = mock.Mock()
+        gateway.create_order.return_value = {"id": f"order_rzp_{n_items}"}
+        with mock.patch('payment.views.get_gateway', return_value=gateway), CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/payments/user-cart-checkout/', {"first_name": "A"}, format='json')
+
+        self.assertEqual(response.status_code, 200, response.data)
+        order = Order.objects.get(order_id=response.data["order_id"])
+        self.assertEqual(order.items.count(), n_items)
+        self.assertEqual(order.razorpay_order_id, f"order_rzp_{n_items}")
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        self.assertEqual(self.checkout_queries(1), self.checkout_queries(8))
+
+    def test_query_count_constant_when_holds_expired(self):
+        self.assertEqual(self.checkout_queries(1, expire_holds=True), self.checkout_queries(8, expire_holds=True))
+
+    def test_out_of_stock_rolls_back(self):
+        user = CustomUser.objects.create_user(username="oos", email="oos@x.com", password="x")
+        basket = Basket.objects.get(owner=user)
+        product = Product.objects.create(category=self.category, name="Last one", description="", price=10, stock=1)
+        cart.add_to_cart(basket, product.pk)
+        StockReservation.objects.all().delete()
+        Product.objects.filter(pk=product.pk).update(stock=0)
+
+        self.client.force_authenticate(user)
+        gateway = mock.Mock()
+        with mock.patch('payment.views.get_gateway', return_value=gateway):
+            response = self.client.post('/payments/user-cart-checkout/', {}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Order.objects.filter(user=user).exists())
+        gateway.create_order.assert_not_called()
+
+
+class CheckoutIdempotencyTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Attar")
+        self.user = CustomUser.objects.create_user(username="idem", email="idem@x.com", password="x")
+        product = Product.objects.create(category=category, name="Oud", description="", price=100, stock=5)
+        cart.add_to_cart(Basket.objects.get(owner=self.user), product.pk)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def checkout(self, key, data=None):
+        gateway = mock.Mock()
+        gateway.create_order.return_value = {"id": "order_rzp_idem"}
+        with mock.patch('payment.views.get_gateway', return_value=gateway):
+            response = self.client.post(
+                '/payments/user-cart-checkout/', data or {"first_name": "A"}, format='json', HTTP_IDEMPOTENCY_KEY=key
+            )
+        return response, gateway
+
+    def test_retry_replays_stored_response(self):
+        first, _ = self.checkout("k1")
+        with CaptureQueriesContext(connection) as queries:
+            second, gateway = self.checkout("k1")
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data["order_id"], first.data["order_id"])
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+        gateway.create_order.assert_not_called()
+        self.assertLessEqual(len(queries), 5)  # failed claim (savepoint + insert) and one read
+
+    def test_key_reused_with_different_body(self):
+        self.checkout("k2")
+        response, _ = self.checkout("k2", {"first_name": "B"})
+        self.assertEqual(response.status_code, 422)
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0)
+    def test_duplicate_while_in_flight(self):
+        self.checkout("k3")
+        record = IdempotencyKey.objects.get(user=self.user, key="k3")
+        IdempotencyKey.objects.filter(pk=record.pk).update(status=IdempotencyKey.PROCESSING, created_at=timezone.now())
+        response, gateway = self.checkout("k3")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response["Retry-After"], "1")
+        gateway.create_order.assert_not_called()
+
+
+@override_settings(RAZORPAY_WEBHOOK_SECRET="whsec")
+class WebhookTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Attar")
+        self.user = CustomUser.objects.create_user(username="hook", email="hook@x.com", password="x")
+        product = Product.objects.create(category=category, name="Musk", description="", price=50, stock=5)
+        cart.add_to_cart(Basket.objects.get(owner=self.user), product.pk)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        gateway = mock.Mock()
+        gateway.create_order.return_value = {"id": "order_rzp_hook"}
+        with mock.patch('payment.views.get_gateway', return_value=gateway):
+            self.client.post('/payments/user-cart-checkout/', {"first_name": "A"}, format='json')
+        self.client.force_authenticate(None)
+
+    def deliver(self, event_id, event="payment.captured", secret="whsec"):
+        body = json.dumps({
+            "event": event,
+            "payload": {"payment": {"entity": {"id": "pay_1", "order_id": "order_rzp_hook"}}},
+        }).encode()
+        signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return self.client.post(
+            '/payments/webhook/', body, content_type='application/json',
+            HTTP_X_RAZORPAY_SIGNATURE=signature, HTTP_X_RAZORPAY_EVENT_ID=event_id,
+        )
+
+    def test_redelivery_is_recorded_once_and_applied_once(self):
+        self.assertEqual(self.deliver("evt_1").status_code, 200)
+        self.assertEqual(self.deliver("evt_1").status_code, 200)
+        self.assertEqual(self.deliver("evt_2", event="order.paid").status_code, 200)
+        self.assertEqual(WebhookEvent.objects.count(), 2)
+
+        self.assertEqual(process_pending(), 2)
+        order = Order.objects.get(user=self.user)
+        self.assertEqual(order.status, "Paid")
+        self.assertEqual(Payment.objects.get(order=order).payment_id, "pay_1")
+        self.assertEqual(Basket.objects.get(owner=self.user).item_count, 0)
+        self.assertEqual(len(mail.outbox), 0)  # queued, not sent in-process
+        self.assertEqual(deliver_batch(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(set(WebhookEvent.objects.values_list('status', flat=True)), {WebhookEvent.DONE})
+
+    def test_capture_for_cancelled_order_changes_nothing(self):
+        order = Order.objects.get(user=self.user)
+        Order.objects.filter(pk=order.pk).update(status="Cancelled")
+        stock = Product.objects.get().stock
+        self.assertEqual(self.deliver("evt_4").status_code, 200)
+        self.assertEqual(self.deliver("evt_5", event="order.paid").status_code, 200)
+        self.assertEqual(process_pending(), 2)
+
+        self.assertEqual(Order.objects.get(pk=order.pk).status, "Cancelled")
+        self.assertEqual(Payment.objects.get(order=order).status, "Created")
+        self.assertEqual(Product.objects.get().stock, stock)
+        self.assertTrue(StockReservation.objects.exists())
+        self.assertFalse(OutboundEmail.objects.exists())
+
+    def test_bad_signature_rejected(self):
+        self.assertEqual(self.deliver("evt_3", secret="wrong").status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+
+@override_settings(PAYMENT_GATEWAY='fake')
+class FakeGatewayCheckoutTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Attar")
+        self.user = CustomUser.objects.create_user(username="fake", email="fake@x.com", password="x")
+        product = Product.objects.create(category=category, name="Amber", description="", price=75, stock=5)
+        cart.add_to_cart(Basket.objects.get(owner=self.user), product.pk, quantity=2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_checkout_and_payment_status(self):
+        response = self.client.post('/payments/user-cart-checkout/', {"first_name": "A"}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        gateway_order = response.data["razorpay_order"]
+        self.assertEqual(gateway_order["amount"], 15000)
+
+        paid = get_gateway().capture(gateway_order["id"])
+        response = self.client.post('/payments/payment-status/', paid, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(Order.objects.get(user=self.user).status, "Paid")
+        self.assertEqual(get_gateway().fetch_payment(paid["razorpay_payment_id"])["status"], "captured")
+
+    def test_forged_signature_rejected(self):
+        response = self.client.post('/payments/user-cart-checkout/', {"first_name": "A"}, format='json')
+        paid = get_gateway().capture(response.data["razorpay_order"]["id"])
+        paid["razorpay_signature"] = "0" * 64
+        response = self.client.post('/payments/payment-status/', paid, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.get(user=self.user).status, "Pending")
+
+    @override_settings(PAYMENT_GATEWAY_FAKE_ERROR_RATE=1)
+    def test_gateway_failure_abandons_order(self):
+        response = self.client.post('/payments/user-cart-checkout/', {"first_name": "A"}, format='json')
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(Order.objects.get(user=self.user).status, "Cancelled")
+
+
+@override_settings(
+    PAYMENT_GATEWAY='fake', PAYMENT_GATEWAY_BACKOFF=0, PAYMENT_GATEWAY_BREAKER_MIN_CALLS=3,
+    PAYMENT_GATEWAY_BREAKER_WINDOW=3,
+)
+class GatewayResilienceTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('payment.resilience.metrics', GatewayMetrics())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_slow_gateway_hits_deadline_without_retrying_create(self):
+        with override_settings(PAYMENT_GATEWAY_FAKE_LATENCY=1, PAYMENT_GATEWAY_DEADLINE=0.05):
+            gateway = get_gateway()
+            with self.assertRaises(GatewayTimeout):
+                gateway.create_order(100, receipt="r1")
+            self.assertEqual(gateway.gateway.orders, {})
+
+    def test_transient_failures_retried_then_circuit_opens(self):
+        with override_settings(PAYMENT_GATEWAY_FAKE_ERROR_RATE=1, PAYMENT_GATEWAY_RETRIES=2):
+            gateway = get_gateway()
+            with self.assertRaises(GatewayError):
+                gateway.create_order(100)
+            self.assertEqual(gateway.breaker.state, 'open')
+            with self.assertRaises(CircuitOpen):
+                gateway.create_order(100)
+            stats = collect_gateway_metrics()["operations"]["create_order"]
+            self.assertEqual((stats["calls"], stats["retries"]), (3, 2))
+            self.assertGreaterEqual(stats["rejected"], 1)
+
+
+@override_settings(PAYMENT_GATEWAY='fake')
+class ReconcileTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Attar")
+        self.user = CustomUser.objects.create_user(username="rec", email="rec@x.com", password="x")
+        self.product = Product.objects.create(category=category, name="Rose", description="", price=20, stock=5)
+        cart.add_to_cart(Basket.objects.get(owner=self.user), self.product.pk)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def checkout(self):
+        response = self.client.post('/payments/user-cart-checkout/', {"first_name": "A"}, format='json')
+        order = Order.objects.get(order_id=response.data["order_id"])
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=2))
+        return order
+
+    def test_captured_order_paid_and_abandoned_cancelled(self):
+        paid = self.checkout()
+        abandoned = self.checkout()
+        capture = get_gateway().capture(paid.razorpay_order_id)
+
+        stats = reconcile(min_age=timedelta(minutes=30), give_up_after=timedelta(hours=24), chunk_size=1)
+        self.assertEqual((stats.checked, stats.paid, stats.cancelled), (2, 1, 1))
+        self.assertEqual(Order.objects.get(pk=paid.pk).status, "Paid")
+        self.assertEqual(Payment.objects.get(order=paid).payment_id, capture["razorpay_payment_id"])
+        self.assertEqual(Order.objects.get(pk=abandoned.pk).status, "Cancelled")
+        self.assertEqual(Payment.objects.get(order=abandoned).status, "Failed")
+        self.assertEqual(Basket.objects.get(owner=self.user).item_count, 0)
+        self.assertEqual(len(mail.outbox), 0)  # queued, not sent in-process
+        self.assertEqual(deliver_batch(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_resume_skips_checkpointed_orders(self):
+        first, second = self.checkout(), self.checkout()
+        stats = reconcile(
+            min_age=timedelta(minutes=30), give_up_after=timedelta(hours=24), after_id=first.pk, send_email=False
+        )
+        self.assertEqual(stats.checked, 1)
+        self.assertEqual(Order.objects.get(pk=first.pk).status, "Pending")
+        self.assertEqual(Order.objects.get(pk=second.pk).status, "Cancelled")
+
+
+@override_settings(PAYMENT_GATEWAY='fake')
+class PaymentStockCommitTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Attar")
+        self.product = Product.objects.create(category=category, name="Last bottle", description="", price=90, stock=1)
+
+    def buyer(self, name):
+        user = CustomUser.objects.create_user(username=name, email=f"{name}@x.com", password="x")
+        client = APIClient()
+        client.force_authenticate(user)
+        return user, client
+
+    def checkout_and_lapse(self, user, client):
+        cart.add_to_cart(Basket.objects.get(owner=user), self.product.pk)
+        response = client.post('/payments/user-cart-checkout/', {"first_name": "A"}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        cart.release_expired()
+        return get_gateway().capture(response.data["razorpay_order"]["id"])
+
+    def test_two_buyers_cannot_both_pay_for_the_last_bottle(self):
+        first = self.buyer("first")
+        second = self.buyer("second")
+        first_payment = self.checkout_and_lapse(*first)
+        second_payment = self.checkout_and_lapse(*second)
+
+        self.assertEqual(first[1].post('/payments/payment-status/', first_payment, format='json').status_code, 200)
+        response = second[1].post('/payments/payment-status/', second_payment, format='json')
+        self.assertEqual(response.status_code, 409)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(Order.objects.get(user=second[0]).status, "Cancelled")
+        self.assertEqual(Payment.objects.get(order__user=second[0]).status, "Paid")
+
+    def test_live_hold_is_consumed_not_released(self):
+        user, client = self.buyer("held")
+        cart.add_to_cart(Basket.objects.get(owner=user), self.product.pk)
+        response = client.post('/payments/user-cart-checkout/', {"first_name": "A"}, format='json')
+        payment = get_gateway().capture(response.data["razorpay_order"]["id"])
+        self.assertEqual(client.post('/payments/payment-status/', payment, format='json').status_code, 200)
+        self.assertFalse(StockReservation.objects.exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+
+
+class FlashSaleTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Oud")
+        self.product = Product.objects.create(category=category, name="Drop", description="", price=500, stock=10)
+        now = timezone.now()
+        self.sale = FlashSale.objects.create(
+            product=self.product, units=3, per_customer_limit=1, admit_burst=2, admit_per_second=0,
+            starts_at=now - timedelta(minutes=1), ends_at=now + timedelta(hours=1),
+        )
+        flash.get_flash_cache().clear()
+        # The sale list is cached outside the test transaction.
+        self.addCleanup(flash.get_flash_cache().clear)
+
+    def buyer(self, name):
+        client = APIClient()
+        client.force_authenticate(CustomUser.objects.create_user(username=name, email=f"{name}@x.com", password="x"))
+        return client
+
+    def add(self, client):
+        return client.post(f'/api/basket-items/{self.product.pk}/add-to-cart/')
+
+    def test_waiting_room_admits_in_ticket_order(self):
+        first, second, third = self.buyer("a"), self.buyer("b"), self.buyer("c")
+        self.assertEqual(self.add(first).status_code, 429)
+
+        queue = f'/api/flash-sales/{self.sale.pk}/queue/'
+        self.assertTrue(first.post(queue).data["admitted"])
+        self.assertEqual(first.post(queue).data["ticket"], 1)  # joining again keeps the ticket
+        self.assertTrue(second.post(queue).data["admitted"])
+        waiting = third.post(queue).data
+        self.assertEqual((waiting["ticket"], waiting["position"], waiting["admitted"]), (3, 1, False))
+        self.assertEqual(self.add(third).status_code, 429)
+
+        self.assertEqual(self.add(first).status_code, 201)
+        self.assertEqual(self.add(first).status_code, 400)  # per-customer limit
+
+    def test_stock_is_counted_in_cache_and_flushed_in_batches(self):
+        buyers = [self.buyer(name) for name in ("a", "b")]
+        for client in buyers:
+            client.post(f'/api/flash-sales/{self.sale.pk}/queue/')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.add(buyers[0]).status_code, 201)
+        self.assertFalse([q for q in queries if 'UPDATE "store_product"' in q['sql']])
+        self.assertEqual(self.add(buyers[1]).status_code, 201)
+        self.assertEqual(flash.available(self.sale.pk), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+
+        self.assertEqual(flash.flush(), 2)
+        self.assertEqual(flash.flush(), 0)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 8)
+
+        buyers[1].delete(f'/api/basket-items/{Basket.objects.get(owner__username="b").cartitems.get().pk}/remove-from-cart/')
+        self.assertEqual(flash.available(self.sale.pk), 2)
+        self.assertEqual(flash.flush(), -1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 9)
+
+    def test_units_run_out_then_sale_is_finalized(self):
+        FlashSale.objects.filter(pk=self.sale.pk).update(units=1)
+        first, second = self.buyer("a"), self.buyer("b")
+        for client in (first, second):
+            client.post(f'/api/flash-sales/{self.sale.pk}/queue/')
+        self.assertEqual(self.add(first).status_code, 201)
+        self.assertEqual(self.add(second).status_code, 400)
+
+        FlashSale.objects.filter(pk=self.sale.pk).update(ends_at=timezone.now() - timedelta(minutes=1))
+        flash.forget_sales()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(flash.flush(), 1)
+        self.sale.refresh_from_db()
+        self.assertIsNotNone(self.sale.finalized_at)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 9)
+
+        # Afterwards the product sells from Product.stock again.
+        self.assertEqual(self.add(second).status_code, 201)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 8)
+
+
+class OutboxTests(TestCase):
+    def test_request_only_queues_and_worker_sends_batch_on_one_connection(self):
+        CustomUser.objects.create_user(username="otp", email="otp@x.com", password="x")
+        response = APIClient().post('/api/forgot-password/', {"email": "otp@x.com"}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)
+
+        invoice = mail.EmailMessage("Invoice", "Thanks", "shop@x.com", ["otp@x.com"])
+        invoice.attach("Invoice_1.pdf", b"%PDF-1.4", "application/pdf")
+        outbox.enqueue(invoice)
+        self.assertEqual(deliver_batch(), 2)
+        self.assertEqual([message.subject for message in mail.outbox], ["Password Reset OTP", "Invoice"])
+        self.assertEqual(mail.outbox[1].attachments[0][1], b"%PDF-1.4")
+        self.assertEqual(set(OutboundEmail.objects.values_list('status', flat=True)), {OutboundEmail.SENT})
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend')
+    def test_batch_reuses_one_smtp_session(self):
+        for n in range(3):
+            outbox.send_mail(f"Hello {n}", "Body", "shop@x.com", [f"{n}@x.com"])
+        with mock.patch('django.core.mail.backends.smtp.smtplib.SMTP') as smtp:
+            self.assertEqual(deliver_batch(), 3)
+        self.assertEqual(smtp.call_count, 1)
+        self.assertEqual(smtp.return_value.sendmail.call_count, 3)
+        self.assertEqual(set(OutboundEmail.objects.values_list('status', flat=True)), {OutboundEmail.SENT})
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend')
+    def test_rejected_message_reopens_session_for_the_rest(self):
+        for n in range(3):
+            outbox.send_mail(f"Hello {n}", "Body", "shop@x.com", [f"{n}@x.com"])
+        with mock.patch('django.core.mail.backends.smtp.smtplib.SMTP') as smtp:
+            smtp.return_value.sendmail.side_effect = [None, SMTPRecipientsRefused({"1@x.com": (550, b"no")}), None]
+            self.assertEqual(deliver_batch(), 3)
+        self.assertEqual(smtp.call_count, 2)
+        self.assertEqual(
+            list(OutboundEmail.objects.order_by('id').values_list('status', flat=True)),
+            [OutboundEmail.SENT, OutboundEmail.PENDING, OutboundEmail.SENT],
+        )
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=2)
+    def test_failures_back_off_then_go_dead(self):
+        outbox.send_mail("Hello", "Body", "shop@x.com", ["a@x.com"])
+        with mock.patch('django.core.mail.EmailMessage.send', side_effect=SMTPException("421 try later")):
+            self.assertEqual(deliver_batch(), 1)
+            email = OutboundEmail.objects.get()
+            self.assertEqual((email.status, email.attempts), (OutboundEmail.PENDING, 1))
+            self.assertGreater(email.send_after, timezone.now())
+            self.assertEqual(deliver_batch(), 0)  # not due yet
+
+            OutboundEmail.objects.update(send_after=timezone.now())
+            self.assertEqual(deliver_batch(), 1)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.DEAD, 2))
+        self.assertIn("421", email.last_error)
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class CartStockTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Attar")
+        self.product = Product.objects.create(category=self.category, name="Amber", description="", price=40, stock=2)
+        self.user = CustomUser.objects.create_user(username="ledger", email="ledger@x.com", password="x")
+        self.basket = Basket.objects.get(owner=self.user)
+
+    def test_only_stock_crossing_zero_bumps_catalog_version(self):
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            cart.add_to_cart(self.basket, self.product.pk)
+        self.assertEqual(get_catalog_version(), version)
+        with self.captureOnCommitCallbacks(execute=True):
+            cart.add_to_cart(self.basket, self.product.pk)
+        self.assertNotEqual(get_catalog_version(), version)
+
+    def stock(self, product=None):
+        return Product.objects.get(pk=(product or self.product).pk).stock
+
+    def test_over_reservation_is_refused(self):
+        cart.add_to_cart(self.basket, self.product.pk, quantity=2)
+        self.assertEqual(self.stock(), 0)
+        with self.assertRaises(cart.OutOfStock):
+            cart.add_to_cart(self.basket, self.product.pk)
+        item = self.basket.cartitems.get()
+        self.assertEqual((item.quantity, item.reservation.quantity), (2, 2))
+        with self.assertRaises(cart.OutOfStock):
+            cart.set_quantity(item, 3)
+        self.assertEqual(self.stock(), 0)
+
+        self.basket.refresh_from_db()
+        self.assertEqual((self.basket.item_count, self.basket.subtotal), (2, 80))
+
+    def test_expired_holds_release_stock(self):
+        cart.add_to_cart(self.basket, self.product.pk)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(cart.release_expired(), 1)
+        self.assertEqual(self.stock(), 2)
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(cart.release_expired(), 0)
+
+    def test_sync_replaces_lines_and_holds(self):
+        other = Product.objects.create(category=self.category, name="Oud", description="", price=100, stock=5)
+        cart.add_to_cart(self.basket, self.product.pk, quantity=2)
+        items = cart.sync_cart(self.basket, {other.pk: 3})
+        self.assertEqual([(item.product_object_id, item.quantity) for item in items], [(other.pk, 3)])
+        self.assertEqual((self.stock(), self.stock(other)), (2, 2))
+        self.assertEqual(list(StockReservation.objects.values_list('product_id', 'quantity')), [(other.pk, 3)])
+        self.basket.refresh_from_db()
+        self.assertEqual((self.basket.item_count, self.basket.subtotal), (3, 300))
+
+    def test_one_open_row_per_product_is_enforced_without_a_partial_index(self):
+        cart.add_to_cart(self.basket, self.product.pk)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            BasketItem.objects.create(basket_object=self.basket, product_object=self.product)
+
+        # Ordered rows drop out of the index, so the product can be added again.
+        BasketItem.objects.filter(basket_object=self.basket).update(is_order_placed=True)
+        cart.add_to_cart(self.basket, self.product.pk)
+        self.assertEqual(
+            sorted(BasketItem.objects.filter(basket_object=self.basket).values_list('is_order_placed', 'open_marker')),
+            [(False, True), (True, None)],
+        )
+
+    def test_out_of_stock_rolls_back_partial_holds(self):
+        other = Product.objects.create(category=self.category, name="Oud", description="", price=100, stock=5)
+        with self.assertRaises(cart.OutOfStock) as caught:
+            cart.reserve_many({other.pk: 1, self.product.pk: 3})
+        self.assertEqual(caught.exception.requested, {self.product.pk: 3})
+        self.assertEqual((self.stock(), self.stock(other)), (2, 5))
+
+        cart.add_to_cart(self.basket, other.pk)
+        with self.assertRaises(cart.OutOfStock):
+            cart.sync_cart(self.basket, {other.pk: 4, self.product.pk: 3})
+        self.assertEqual((self.stock(), self.stock(other)), (2, 4))
+        self.assertEqual(list(StockReservation.objects.values_list('product_id', 'quantity')), [(other.pk, 1)])
+        self.assertEqual([item.quantity for item in self.basket.cartitems.all()], [1])
+
+
+class CatalogSnapshotTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overridden = override_settings(CATALOG_SNAPSHOT_DIR=directory.name)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        category = Category.objects.create(name="Oud")
+        Product.objects.create(category=category, name="Smoke", description="", price=90, stock=3)
+        self.client = APIClient()
+
+    def test_request_never_builds(self):
+        response = self.client.get('/api/catalog-snapshot/')
+        self.assertEqual(response.status_code, 503)
+
+    def test_serves_built_files_and_newest_until_rebuilt(self):
+        call_command('build_catalog_snapshot', stdout=StringIO())
+        response = self.client.get('/api/catalog-snapshot/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        built = response.headers['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(category=Category.objects.get(), name="Rose", description="", price=50, stock=1)
+        response = self.client.get('/api/catalog-snapshot/', HTTP_ACCEPT_ENCODING='br')
+        self.assertEqual(response.headers['ETag'], built)
+
+        call_command('build_catalog_snapshot', stdout=StringIO())
+        response = self.client.get('/api/catalog-snapshot/', HTTP_ACCEPT_ENCODING='br')
+        self.assertNotEqual(response.headers['ETag'], built)
+
+
+class GuestCartTests(TestCase):
+    def setUp(self):
+        flash.get_flash_cache().clear()
+        self.addCleanup(flash.get_flash_cache().clear)
+        category = Category.objects.create(name="Musk")
+        self.amber = Product.objects.create(category=category, name="Amber", description="", price=40, stock=5)
+        self.rose = Product.objects.create(category=category, name="Rose", description="", price=30, stock=1)
+        self.user = CustomUser.objects.create_user(username="guest", email="guest@x.com", password="pw")
+        self.client = APIClient()
+
+    def put(self, lines):
+        response = self.client.put(
+            '/api/guest-cart/', [{"product": pk, "quantity": quantity} for pk, quantity in lines.items()], format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def login(self):
+        response = self.client.post('/api/login/', {"email": "guest@x.com", "password": "pw"}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def basket(self):
+        return dict(Basket.objects.get(owner=self.user).cartitems.values_list('product_object_id', 'quantity'))
+
+    def assertCleared(self, response):
+        self.assertEqual(response.cookies['guest_cart'].value, '')
+
+    def test_signed_cookie_round_trip(self):
+        self.put({self.amber.pk: 2, self.rose.pk: 1})
+        items = self.client.get('/api/guest-cart/').data["items"]
+        self.assertEqual([(line["product"]["id"], line["quantity"]) for line in items], [(self.amber.pk, 2), (self.rose.pk, 1)])
+
+    def test_tampered_cookie_is_ignored(self):
+        self.put({self.amber.pk: 2})
+        signed = self.client.cookies['guest_cart'].value
+        self.assertIn(f'{self.amber.pk}:2:', signed)
+        self.client.cookies['guest_cart'] = signed.replace(f'{self.amber.pk}:2:', f'{self.amber.pk}:9:')
+        self.assertEqual(self.client.get('/api/guest-cart/').data["items"], [])
+
+    def test_login_merges_and_reports_short_lines(self):
+        self.put({self.amber.pk: 2, self.rose.pk: 1})
+        Product.objects.filter(pk=self.rose.pk).update(stock=0)
+        response = self.login()
+        self.assertEqual(response.data["guest_cart"], {"merged": True, "short": [self.rose.pk], "flash_sale": []})
+        self.assertEqual(self.basket(), {self.amber.pk: 2})
+        self.assertCleared(response)
+
+    def test_merge_retries_once_when_stock_moves(self):
+        self.put({self.amber.pk: 2})
+        sync_cart, calls = cart.sync_cart, []
+
+        def flaky(basket, desired):
+            calls.append(desired)
+            if len(calls) == 1:
+                raise cart.OutOfStock({self.amber.pk: 2})
+            return sync_cart(basket, desired)
+
+        with mock.patch.object(cart, 'sync_cart', side_effect=flaky):
+            response = self.login()
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(response.data["guest_cart"]["merged"])
+        self.assertEqual(self.basket(), {self.amber.pk: 2})
+        self.assertCleared(response)
+
+    def test_cookie_is_kept_when_merge_keeps_failing(self):
+        self.put({self.amber.pk: 2})
+        with mock.patch.object(cart, 'sync_cart', side_effect=cart.OutOfStock({self.amber.pk: 2})):
+            response = self.login()
+        self.assertEqual(response.data["guest_cart"], {"merged": False})
+        self.assertNotIn('guest_cart', response.cookies)
+
+    def test_flash_sale_lines_are_dropped_and_cookie_cleared(self):
+        now = timezone.now()
+        FlashSale.objects.create(
+            product=self.amber, units=3, per_customer_limit=1, admit_burst=2, admit_per_second=0,
+            starts_at=now - timedelta(minutes=1), ends_at=now + timedelta(hours=1),
+        )
+        self.put({self.amber.pk: 1})
+        response = self.login()
+        self.assertEqual(response.data["guest_cart"], {"merged": True, "short": [], "flash_sale": [self.amber.pk]})
+        self.assertEqual(self.basket(), {})
+        self.assertCleared(response)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        get_catalog_cache().clear()
+        self.addCleanup(get_catalog_cache().clear)
+        self.product = Product.objects.create(
+            category=Category.objects.create(name="Citrus"), name="Neroli", description="", price=60, stock=4
+        )
+        self.client = APIClient()
+
+    def stats(self):
+        stats = get_cache_stats()
+        return stats["hits"], stats["misses"]
+
+    def test_second_get_is_a_hit(self):
+        self.assertEqual(self.client.get('/api/products/').status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stats(), (1, 1))
+
+    def test_product_save_moves_version_and_misses(self):
+        self.client.get('/api/products/')
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = "Neroli Intense"
+            self.product.save()
+        self.assertNotEqual(get_catalog_version(), version)
+
+        response = self.client.get('/api/products/')
+        self.assertEqual(self.stats(), (0, 2))
+        self.assertEqual(response.data[0]["name"], "Neroli Intense")
+
+    def test_if_none_match_is_answered_without_queries(self):
+        etag = self.client.get('/api/products/').headers['ETag']
+        get_catalog_version()
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+
+    def test_last_modified_comes_from_updated_at_after_eviction(self):
+        edited = timezone.now() - timedelta(days=3)
+        Product.objects.filter(pk=self.product.pk).update(updated_at=edited)
+        Category.objects.update(updated_at=edited - timedelta(days=1))
+        expected = http_date(int(edited.timestamp()))
+        for _ in range(2):
+            get_catalog_cache().clear()  # restart: the bump time is gone
+            response = self.client.get('/api/products/')
+            self.assertEqual(response.headers['Last-Modified'], expected)
+        response = self.client.get('/api/products/', HTTP_IF_MODIFIED_SINCE=expected)
+        self.assertEqual(response.status_code, 304)
+
+    def test_accept_header_gets_its_own_etag(self):
+        json_etag = self.client.get('/api/products/', HTTP_ACCEPT='application/json').headers['ETag']
+        indented = self.client.get('/api/products/', HTTP_ACCEPT='application/json; indent=2')
+        self.assertNotEqual(indented.headers['ETag'], json_etag)
+        response = self.client.get('/api/products/', HTTP_ACCEPT='application/json; indent=2', HTTP_IF_NONE_MATCH=json_etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        get_catalog_cache().clear()
+        self.addCleanup(get_catalog_cache().clear)
+        self.category = Category.objects.create(name="Woody")
+        self.client = APIClient()
+
+    def found(self, query):
+        return [product.pk for product in SearchResults(query)[:10]]
+
+    def test_index_follows_product_changes(self):
+        product = Product.objects.create(category=self.category, name="Velvet Oud", description="", price=80, stock=1)
+        self.assertEqual(self.found("velvet"), [product.pk])
+
+        product.name = "Silk Rose"
+        product.save()
+        self.assertEqual(self.found("velvet"), [])
+        self.assertEqual(self.found("silk"), [product.pk])
+
+        product.delete()
+        self.assertEqual(SearchResults("silk").count(), 0)
+
+    def test_endpoint_ranks_name_matches_first_and_paginates(self):
+        in_description = Product.objects.create(
+            category=self.category, name="Nights", description="a warm amber base", price=50, stock=1
+        )
+        in_name = Product.objects.create(category=self.category, name="Amber", description="", price=70, stock=1)
+
+        first = self.client.get('/api/products/search/', {"q": "amber", "page_size": 1}).data
+        self.assertEqual(first["count"], 2)
+        self.assertEqual([row["id"] for row in first["results"]], [in_name.pk])
+        self.assertIsNotNone(first["next"])
+
+        second = self.client.get('/api/products/search/', {"q": "amber", "page_size": 1, "page": 2}).data
+        self.assertEqual([row["id"] for row in second["results"]], [in_description.pk])
+        self.assertIsNone(second["next"])
+
+        self.assertEqual(self.client.get('/api/products/search/', {"q": " "}).status_code, 400)
+
+
+class BulkImportExportTests(TestCase):
+    def setUp(self):
+        get_catalog_cache().clear()
+        self.addCleanup(get_catalog_cache().clear)
+        self.category = Category.objects.create(name="Floral")
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create_superuser(username="admin", email="admin@x.com", password="x"))
+
+    def upload(self, name, content):
+        response = self.client.post(
+            '/api/import-products/', {"file": SimpleUploadedFile(name, content.encode('utf-8'))}, format='multipart'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def export(self, fmt):
+        response = self.client.get('/api/export-products/', {"fmt": fmt})
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv_import_reports_bad_rows_by_line(self):
+        report = self.upload('products.csv', (
+            "name,category,price,stock,brand\n"
+            "Jasmine,floral,45.50,3,Ajmal\n"
+            "Lily,floral,abc,3,\n"
+            "Orchid,Citrus,20,1,\n"
+        ))
+        self.assertEqual((report["created"], report["updated"], report["failed"]), (1, 0, 2))
+        self.assertEqual([(error["line"], sorted(error["errors"])) for error in report["errors"]], [(3, ["price"]), (4, ["category"])])
+        self.assertEqual(Product.objects.get().name, "Jasmine")
+
+    def test_jsonl_import_updates_and_reports_bad_lines(self):
+        product = Product.objects.create(category=self.category, name="Gardenia", description="", price=30, stock=1)
+        report = self.upload('products.jsonl', "\n".join([
+            json.dumps({"id": product.pk, "name": "Gardenia", "category": self.category.pk, "price": "35", "stock": 9}),
+            "{not json",
+            "",
+            json.dumps({"id": 99999, "name": "Ghost", "category": "floral", "price": "1", "stock": 1}),
+            json.dumps(["a list"]),
+        ]))
+        self.assertEqual((report["created"], report["updated"], report["failed"]), (0, 1, 3))
+        self.assertEqual([error["line"] for error in report["errors"]], [2, 4, 5])
+        product.refresh_from_db()
+        self.assertEqual((product.price, product.stock), (35, 9))
+
+    def test_update_rows_only_write_the_columns_they_carry(self):
+        hidden = Product.objects.create(
+            category=self.category, name="Vetiver", brand="Rasasi", description="earthy", price=80, stock=1, available=False,
+        )
+        shown = Product.objects.create(category=self.category, name="Neroli", description="bright", price=60, stock=1)
+        report = self.upload('stock.csv', f"id,stock\n{hidden.pk},7\n{shown.pk},\n")
+        self.assertEqual((report["updated"], report["failed"]), (1, 1))
+        self.assertEqual(report["errors"][0]["line"], 3)
+
+        report = self.upload('price.jsonl', json.dumps({"id": shown.pk, "price": "65"}))
+        self.assertEqual(report["updated"], 1)
+
+        hidden.refresh_from_db()
+        shown.refresh_from_db()
+        self.assertEqual(
+            (hidden.stock, hidden.description, hidden.available, hidden.brand, hidden.price), (7, "earthy", False, "Rasasi", 80)
+        )
+        self.assertEqual((shown.stock, shown.price, shown.description, shown.available), (1, 65, "bright", True))
+
+    def test_export_round_trip(self):
+        Product.objects.create(category=self.category, name="Tuberose", brand="Rasasi", description='say "hi", twice', price=99, stock=2)
+        Product.objects.create(category=self.category, name="Iris", description="", price=12.5, stock=0, available=False)
+        for fmt in ('csv', 'jsonl'):
+            exported = self.export(fmt)
+            report = self.upload(f'products.{fmt}', exported)
+            self.assertEqual((report["created"], report["updated"], report["failed"]), (0, 2, 0))
+            self.assertEqual(self.export(fmt), exported)
+
+
+class BulkUpdateTests(TestCase):
+    def setUp(self):
+        get_catalog_cache().clear()
+        self.addCleanup(get_catalog_cache().clear)
+        category = Category.objects.create(name="Spice")
+        self.saffron = Product.objects.create(category=category, name="Saffron", description="", price=100, stock=5)
+        self.clove = Product.objects.create(category=category, name="Clove", description="", price=40, stock=2)
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create_superuser(username="admin", email="admin@x.com", password="x"))
+
+    def bulk_update(self, operations, **options):
+        return self.client.post('/api/products/bulk-update/', {"operations": operations, **options}, format='json')
+
+    def stock_and_price(self):
+        return {pk: (stock, str(price)) for pk, stock, price in Product.objects.values_list('id', 'stock', 'price')}
+
+    def test_all_or_nothing_rolls_back_with_409(self):
+        before = self.stock_and_price()
+        response = self.bulk_update(
+            [{"id": self.saffron.pk, "stock_delta": 3, "price_percent": "-10"}, {"id": self.clove.pk, "stock_delta": -3}],
+            all_or_nothing=True,
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(response.data["applied"])
+        self.assertEqual(
+            [(result["id"], result["status"]) for result in response.data["results"]],
+            [(self.saffron.pk, "skipped"), (self.clove.pk, "insufficient_stock")],
+        )
+        self.assertEqual(self.stock_and_price(), before)
+
+    def test_negative_stock_is_refused_and_the_rest_applied(self):
+        response = self.bulk_update([
+            {"id": self.saffron.pk, "stock_delta": -5, "price_percent": "-10"},
+            {"id": self.clove.pk, "stock_delta": -3},
+            {"id": 99999, "stock": 1},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["applied"])
+        self.assertEqual(
+            [(result["id"], result["status"]) for result in response.data["results"]],
+            [(self.saffron.pk, "ok"), (self.clove.pk, "insufficient_stock"), (99999, "not_found")],
+        )
+        self.assertEqual(self.stock_and_price(), {self.saffron.pk: (0, "90.00"), self.clove.pk: (2, "40.00")})
+
+
+class ProductCursorPaginationTests(TestCase):
+    def setUp(self):
+        get_catalog_cache().clear()
+        self.addCleanup(get_catalog_cache().clear)
+        category = Category.objects.create(name="Fresh")
+        # Several products share a price so the keyset has to fall back on id.
+        for i, price in enumerate((30, 20, 30, 30, 20, 10, 30)):
+            Product.objects.create(category=category, name=f"Fresh {i}", description="", price=price, stock=1)
+        self.client = APIClient()
+
+    def walk(self, **params):
+        seen, url, pages = [], '/api/view-products/', 0
+        while url:
+            response = self.client.get(url, params if not pages else None)
+            self.assertEqual(response.status_code, 200)
+            seen += [(row["price"], row["id"]) for row in response.data["results"]]
+            url, pages = response.data["next"], pages + 1
+        return seen, pages
+
+    def test_traversal_is_stable_across_equal_prices(self):
+        rows = list(Product.objects.values_list('price', 'id'))
+        for ordering, reverse in (('price', False), ('-price', True)):
+            seen, pages = self.walk(ordering=ordering, page_size=2)
+            self.assertEqual(pages, 4)
+            self.assertEqual(
+                [(Decimal(price), pk) for price, pk in seen], sorted(rows, reverse=reverse)
+            )
+
+    def test_unknown_ordering_is_rejected(self):
+        response = self.client.get('/api/view-products/', {"ordering": "name", "page_size": 2})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("ordering", response.data)
+
+
+class ProductFieldsetTests(TestCase):
+    def setUp(self):
+        get_catalog_cache().clear()
+        self.addCleanup(get_catalog_cache().clear)
+        category = Category.objects.create(name="Aquatic")
+        for name in ("Tide", "Reef"):
+            Product.objects.create(category=category, name=name, description="long copy", price=25, stock=1)
+        get_catalog_last_modified()  # worked out once per catalog version, not per listing
+        self.client = APIClient()
+
+    def product_selects(self, url, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data, [q['sql'] for q in queries if 'FROM "store_product"' in q['sql']]
+
+    def test_fields_limit_keys_and_columns(self):
+        for url in ('/api/view-products/', '/api/products/'):
+            data, selects = self.product_selects(url, {"fields": "id,name,bogus"})
+            self.assertEqual([sorted(row) for row in data], [["id", "name"]] * 2)
+            self.assertEqual(len(selects), 1)
+            self.assertNotIn('"store_product"."description"', selects[0])
+            self.assertNotIn('store_category', selects[0])
+
+    def test_expand_joins_category_in_the_same_query(self):
+        data, selects = self.product_selects('/api/view-products/', {"fields": "name", "expand": "category_detail"})
+        self.assertEqual(sorted(data[0]), ["category_detail", "name"])
+        self.assertEqual(data[0]["category_detail"]["name"], "Aquatic")
+        self.assertEqual(len(selects), 1)
+        self.assertIn('INNER JOIN "store_category"', selects[0])
+        self.assertNotIn('"store_product"."description"', selects[0])
+
+
+class FacetCountTests(TestCase):
+    def setUp(self):
+        get_catalog_cache().clear()
+        self.addCleanup(get_catalog_cache().clear)
+        self.category = Category.objects.create(name="Gourmand")
+        self.client = APIClient()
+
+    def cells(self):
+        return {
+            (brand, band, in_stock): n
+            for brand, band, in_stock, n in CatalogFacetCount.objects.exclude(product_count=0)
+            .values_list('brand', 'price_band', 'in_stock', 'product_count')
+        }
+
+    def test_counts_follow_product_create_update_delete(self):
+        product = Product.objects.create(category=self.category, name="Vanilla", brand="Ajmal", description="", price=300, stock=2)
+        self.assertEqual(self.cells(), {("Ajmal", "0-500", True): 1})
+
+        product.price = 700
+        product.save()
+        self.assertEqual(self.cells(), {("Ajmal", "500-1000", True): 1})
+
+        product.stock = 0
+        product.save()
+        self.assertEqual(self.cells(), {("Ajmal", "500-1000", False): 1})
+
+        product.delete()
+        self.assertEqual(self.cells(), {})
+
+    def test_deleting_a_category_with_products(self):
+        for name in ("Praline", "Cocoa"):
+            Product.objects.create(category=self.category, name=name, description="", price=90, stock=1)
+        self.category.delete()
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(CatalogFacetCount.objects.exists())
+
+    def test_each_facet_ignores_only_its_own_filter(self):
+        for name, brand, price in (("Honey", "Ajmal", 300), ("Caramel", "Ajmal", 1500), ("Tonka", "Rasasi", 300)):
+            Product.objects.create(category=self.category, name=name, brand=brand, description="", price=price, stock=1)
+
+        data = self.client.get('/api/view-products/', {"facets": "true", "brand": "Ajmal", "price_band": "0-500"}).data
+        self.assertEqual([row["name"] for row in data["results"]], ["Honey"])
+        facets = data["facets"]
+        self.assertEqual(facets["brand"], [{"value": "Ajmal", "count": 1}, {"value": "Rasasi", "count": 1}])
+        self.assertEqual([(band["value"], band["count"]) for band in facets["price_band"]], [("0-500", 1), ("1000-2000", 1)])
+        self.assertEqual(facets["category"], [{"value": self.category.pk, "label": "Gourmand", "count": 1}])
+
+
+def jpeg_bytes(width, height, orientation=None, color=(200, 40, 40)):
+    exif = Image.Exif()
+    exif[0x010F] = "PhoneMaker"
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, format='JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overridden = override_settings(MEDIA_ROOT=directory.name)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        self.category = Category.objects.create(name="Leather")
+
+    def create(self, content):
+        return Product.objects.create(
+            category=self.category, name="Saddle", description="", price=70, stock=1,
+            image=SimpleUploadedFile("saddle.jpg", content, content_type="image/jpeg"),
+        )
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), settings.MEDIA_ROOT)
+            for root, _, names in os.walk(settings.MEDIA_ROOT) for name in names
+        )
+
+    def open(self, name):
+        with default_storage.open(name, 'rb') as handle:
+            image = Image.open(handle)
+            image.load()
+        return image
+
+    def test_upload_is_stripped_and_gets_sized_variants(self):
+        product = self.create(jpeg_bytes(1200, 800, orientation=6))  # stored sideways
+        original = self.open(product.image.name)
+        self.assertEqual(dict(original.getexif()), {})
+        self.assertEqual(original.size, (800, 1200))
+
+        variants = Product.objects.get(pk=product.pk).image_variants
+        self.assertEqual((variants["source"], variants["width"], variants["height"]), (product.image.name, 800, 1200))
+        self.assertTrue(variants["lqip"].startswith("data:image/webp;base64,"))
+        for key, fmt in (("webp", "WEBP"), ("jpeg", "JPEG")):
+            self.assertEqual(sorted(variants[key], key=int), ["320", "640"])  # never upscaled to 1024
+            for width, name in variants[key].items():
+                image = self.open(name)
+                self.assertEqual((image.format, image.width), (fmt, int(width)))
+                self.assertEqual(dict(image.getexif()), {})
+
+    def test_rerunning_the_command_is_a_no_op(self):
+        product = self.create(jpeg_bytes(700, 500))
+        Product.objects.filter(pk=product.pk).update(image_variants={})  # uploaded before the pipeline
+
+        out = StringIO()
+        call_command('generate_image_variants', stdout=out)
+        self.assertIn("Product: 1 updated", out.getvalue())
+        variants = Product.objects.get(pk=product.pk).image_variants
+        stored = self.stored_files()
+
+        out = StringIO()
+        call_command('generate_image_variants', stdout=out)
+        self.assertIn("Product: 0 updated", out.getvalue())
+        self.assertEqual(Product.objects.get(pk=product.pk).image_variants, variants)
+        self.assertEqual(self.stored_files(), stored)
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = ContentAddressedStorage(location=directory.name)
+
+    def files(self):
+        return [os.path.join(root, name) for root, _, names in os.walk(self.storage.location) for name in names]
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.storage.save("products/front.JPG", ContentFile(b"same bytes"))
+        second = self.storage.save("products/copy of front.jpg", ContentFile(b"same bytes"))
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.files()), 1)
+
+        other = self.storage.save("products/back.jpg", ContentFile(b"other bytes"))
+        self.assertNotEqual(other, first)
+        self.assertEqual(len(self.files()), 2)
+
+    def test_hashed_path_is_stable(self):
+        digest = hashlib.sha256(b"stable").hexdigest()
+        expected = f"products/{digest[:2]}/{digest[2:4]}/{digest}.jpg"
+        self.assertEqual(self.storage.save("products/a.JPG", ContentFile(b"stable")), expected)
+        self.assertEqual(self.storage.save("products/b.jpg", ContentFile(b"stable")), expected)
+        self.assertTrue(is_immutable_name(expected))
+
+        # Derivatives named after a stored file are sharded by their own hash.
+        derived = hashlib.sha256(b"derived").hexdigest()
+        name = self.storage.save(f"{expected[:-4]}__w320.webp", ContentFile(b"derived"))
+        self.assertEqual(name, f"products/{derived[:2]}/{derived[2:4]}/{derived}.webp")
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        get_catalog_cache().clear()
+        self.addCleanup(get_catalog_cache().clear)
+        category = Category.objects.create(name="Chypre")
+        self.a, self.b, self.c, self.d = (
+            Product.objects.create(category=category, name=name, description="", price=10, stock=5) for name in "ABCD"
+        )
+        self.user = CustomUser.objects.create_user(username="buyer", email="buyer@x.com", password="x")
+        self.client = APIClient()
+
+    def order(self, *products, status="Paid"):
+        order = Order.objects.create(user=self.user, amount=10, status=status)
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=product, quantity=1, price=10) for product in products])
+
+    def related(self, product):
+        response = self.client.get(f'/api/products/{product.pk}/related/')
+        self.assertEqual(response.status_code, 200)
+        return [row["id"] for row in response.data]
+
+    def test_related_falls_back_to_empty_without_history(self):
+        call_command('build_recommendations', stdout=StringIO())
+        self.assertFalse(ProductRecommendation.objects.exists())
+        self.assertEqual(self.related(self.a), [])
+
+    def test_build_ranks_partners_by_shared_orders(self):
+        self.order(self.a, self.b)
+        self.order(self.a, self.b, self.b)  # a repeated line still counts once
+        self.order(self.a, self.c)
+        self.order(self.b, self.c)
+        self.order(self.a, self.d, status="Cancelled")
+
+        call_command('build_recommendations', stdout=StringIO())
+        self.assertEqual(
+            list(ProductRecommendation.objects.filter(product=self.a).values_list('recommended', 'rank', 'score')),
+            [(self.b.pk, 1, 2), (self.c.pk, 2, 1)],
+        )
+        self.assertEqual(self.related(self.a), [self.b.pk, self.c.pk])
+        self.assertEqual(self.related(self.c), [self.a.pk, self.b.pk])  # tie broken by id
+        self.assertEqual(self.related(self.d), [])
+
+        get_catalog_cache().clear()
+        Product.objects.filter(pk=self.b.pk).update(available=False)
+        self.assertEqual(self.related(self.a), [self.c.pk])
+
+        call_command('build_recommendations', top=1, stdout=StringIO())
+        self.assertEqual(list(ProductRecommendation.objects.filter(product=self.a).values_list('recommended', flat=True)), [self.b.pk])
+
+
+class BasketSummaryTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Resin")
+        self.amber = Product.objects.create(category=category, name="Amber", description="", price=40, stock=10)
+        self.myrrh = Product.objects.create(category=category, name="Myrrh", description="", price=25, stock=10)
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create_user(username="badge", email="badge@x.com", password="x"))
+
+    def summary(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get('/api/basket-items/summary/').data
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('store_basketitem', queries[0]['sql'])
+        return data["item_count"], data["subtotal"]
+
+    def add(self, product):
+        response = self.client.post(f'/api/basket-items/{product.pk}/add-to-cart/')
+        self.assertEqual(response.status_code, 201)
+        return response.data["id"]
+
+    def test_totals_follow_add_update_remove_and_reprice(self):
+        self.assertEqual(self.summary(), (0, "0.00"))
+        amber = self.add(self.amber)
+        self.add(self.amber)
+        myrrh = self.add(self.myrrh)
+        self.assertEqual(self.summary(), (3, "105.00"))
+
+        self.client.patch(f'/api/basket-items/{myrrh}/update-quantity/', {"quantity": 3}, format='json')
+        self.assertEqual(self.summary(), (5, "155.00"))
+
+        self.client.delete(f'/api/basket-items/{amber}/remove-from-cart/')
+        self.assertEqual(self.summary(), (3, "75.00"))
+
+        self.myrrh.refresh_from_db()
+        self.myrrh.price = 30
+        self.myrrh.save()
+        self.assertEqual(self.summary(), (3, "90.00"))
@@ -15,6 +15,7 @@ from .views import (
     CategoryViewSet,
     ProductViewSet,
     BasketItemViewSet,
+    FlashSaleViewSet,
     OrderViewSet,
     #InvoiceViewSet,
     ContactView,
@@ -41,6 +42,7 @@ router = DefaultRouter()
 router.register(r'categories', CategoryViewSet, basename='category')
 router.register(r'products', ProductViewSet, basename='product')
 router.register(r'basket-items', BasketItemViewSet, basename='basketitem')
+router.register(r'flash-sales', FlashSaleViewSet, basename='flash-sale')
 router.register(r'orders', OrderViewSet, basename='order')
 router.register(r'invoices', InvoiceViewSet, basename='invoice')
 router.register(r'contact', ContactView, basename='contact')
@@ -59,6 +61,7 @@ urlpatterns = [
     path('register/', register_view, name='register'),
     path('login/', login_view, name='login'),
     path('admin-login/', admin_login_view, name='admin-login'),
+    path('guest-cart/', views.guest_cart, name='guest-cart'),
 
     # Contact form API
     # path('contact/', ContactView.as_view(), name='contact'),
@@ -74,6 +77,10 @@ urlpatterns = [
     # product insert
     path('create-product/', ProductCreateAPIView.as_view(), name='product-create'),
 
+    # bulk product import / export (CSV or JSONL)
+    path('import-products/', views.ProductImportAPIView.as_view(), name='product-import'),
+    path('export-products/', views.ProductExportAPIView.as_view(), name='product-export'),
+
     # single product view
      path('view-product/<int:pk>/', ProductDetailAPIView.as_view(), name='product-detail'),
 
@@ -101,6 +108,8 @@ urlpatterns = [
 
     #############################ADMIN DASHBOARD####################################
     path('dashboard-stats/',dashboard_stats, name='dashboard_stats'),
+    path('catalog-cache-stats/', views.catalog_cache_stats, name='catalog_cache_stats'),
+    path('catalog-snapshot/', views.catalog_snapshot, name='catalog_snapshot'),
 
     path("forgot-password/",views.forgot_password,name="forgot_password"),
     path("request-reset-password/",views.request_password_reset,name="request_reset_password"),
@@ -7,6 +7,7 @@ from django.core.mail import EmailMessage,send_mail
 from django.conf import settings
 import random
 from django.conf import settings
+from store import outbox
 
 def render_to_pdf(template_src, context_dict=None):
     """
@@ -27,7 +28,7 @@ def render_to_pdf(template_src, context_dict=None):
 
 def send_payment_confirmation_emails(Order, customer_email, admin_email):
     """
-    Sends payment confirmation emails to both the customer and admin
+    Queues payment confirmation emails to both the customer and admin
     with a PDF invoice attached.
     """
     context = {'Order': Order}
@@ -50,8 +51,6 @@ def send_payment_confirmation_emails(Order, customer_email, admin_email):
         )
         email_cust.content_subtype = 'html'
         email_cust.attach(f"Invoice_{Order.order_id}.pdf", pdf, "application/pdf")
-        email_cust.send()
-        print("✅ Customer email sent.")
 
         # 2️⃣ Admin Email
         admin_subject = f"📥 New Paid Order - #{Order.order_id}"
@@ -68,8 +67,8 @@ def send_payment_confirmation_emails(Order, customer_email, admin_email):
         )
         email_admin.content_subtype = 'html'
         email_admin.attach(f"Invoice_{Order.order_id}.pdf", pdf, "application/pdf")
-        email_admin.send()
-        print("✅ Admin email sent.")
+        outbox.enqueue(email_cust, email_admin)
+        print("✅ Confirmation emails queued.")
 
         return True
 
@@ -83,11 +82,10 @@ def generate_otp():
 def send_verification_email(user,code):
     subject="Password ResetVerification Code"
     message=f"Hi{user.username},\n\n Otp for Password reset code is:{code}\nThis code will expire once used.\n\nIf you didn’t request this, please ignore."
-    send_mail(
+    outbox.send_mail(
         subject,
         message,
         settings.EMAIL_HOST_USER,
         [user.email],
-        fail_silently=False,
     )
     
\ No newline at end of file
@@ -1,4 +1,5 @@
 import datetime
+from decimal import Decimal
 from itertools import product
 from random import random
 import string
@@ -17,6 +18,7 @@ from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.generics import RetrieveAPIView, CreateAPIView,ListAPIView, DestroyAPIView
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from django.db import transaction
 from django.db.models import Sum, Count
 from django.db.models.functions import TruncMonth
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
@@ -29,7 +31,7 @@ from store.models import (
     Category, CustomUser, Product, Contact,
     Order, OrderItem,
     Basket, BasketItem, ProductMedia,Wishlist,PasswordReset,EmailVerificationCode,OTPVerification,
-    HeroSection
+    HeroSection, FlashSale
 )
 from payment.models import Invoice            
 
@@ -38,11 +40,23 @@ from store.serializers import (
     UserRegistrationSerializer, OrderSerializer, OrderItemSerializer,
     CartItemSerializer, ProductMediaSerializer,WishListSerializer,
     CustomUserSerializer,
-    HeroSectionSerializer
+    HeroSectionSerializer,
+    ProductListSerializer, product_fieldset, restrict_product_queryset,
+    BulkProductUpdateSerializer, CartSyncItemSerializer, TWO_PLACES, FlashSaleSerializer,
 )
 from payment.serializers import InvoiceSerializer   
 
 from store.forms import ProductForm
+from store.pagination import ProductCursorPagination, SearchPagination
+from store import cart, flash, outbox
+from store.search import SearchResults
+from store.facets import TRUE_VALUES, apply_filters, facet_counts, parse_filters
+from store.cache import cache_catalog_response, get_cache_stats
+from store.recommendations import related_products
+from store.snapshot import choose_encoding, get_snapshot, snapshot_etag, snapshot_path
+from store.bulk import (
+    FORMATS as BULK_FORMATS, ProductImporter, apply_product_operations, export_lines, guess_format, read_rows, text_stream,
+)
 from store.utils import render_to_pdf,send_mail
 from django.core.mail import send_mail
 from rest_framework import status
@@ -51,7 +65,9 @@ from .utils import generate_otp, send_verification_email
 from datetime import timedelta
 from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import make_password
-from django.http import JsonResponse
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import require_GET
 from django.views.decorators.csrf import csrf_exempt
 from .models import CustomUser 
 
@@ -84,29 +100,105 @@ class CategoryViewSet(viewsets.ModelViewSet):
             return [permissions.AllowAny()]  
         return [IsSuperUser()] 
 
+    @cache_catalog_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_catalog_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     @action(detail=True, methods=["get"])
+    @cache_catalog_response
     def products(self, request, pk=None):
         category = self.get_object()
-        products = Product.objects.filter(category=category)
-        serializer = ProductSerializer(products, many=True)
+        fields = product_fieldset(request)
+        products = restrict_product_queryset(Product.objects.filter(category=category), fields)
+        paginator = ProductCursorPagination()
+        page = paginator.paginate_queryset(products, request, view=self)
+        if page is not None:
+            serializer = ProductListSerializer(page, many=True, context={'fields': fields})
+            return paginator.get_paginated_response(serializer.data)
+        serializer = ProductListSerializer(products, many=True, context={'fields': fields})
         return Response(serializer.data)
 
 
 class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.all()
+    queryset = Product.objects.select_related('category')
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
 
     def get_permissions(self):
         """
         Allow everyone (authenticated) to view products,
         but only superusers can create, update, or delete.
         """
-        if self.action in ["list", "retrieve"]:  # GET requests
+        if self.action in ["list", "retrieve", "search", "related"]:  # GET requests
             permission_classes = [permissions.AllowAny]  # anyone can view
         else:  # POST, PATCH, PUT, DELETE
             permission_classes = [permissions.IsAuthenticated, IsSuperUser]
         return [permission() for permission in permission_classes]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ["list", "search"]:
+            queryset = restrict_product_queryset(queryset, product_fieldset(self.request))
+        return queryset
+
+    def get_serializer_class(self):
+        # Listings take the lean read-only path; writes keep full validation.
+        if self.action in ["list", "search"]:
+            return ProductListSerializer
+        return ProductSerializer
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = product_fieldset(self.request)
+        return context
+
+    @cache_catalog_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_catalog_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'], url_path='search')
+    @cache_catalog_response
+    def search(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"error": "Query parameter 'q' is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(SearchResults(query, self.get_queryset()), request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'], url_path='related')
+    @cache_catalog_response
+    def related(self, request, pk=None):
+        """Frequently bought together, precomputed by build_recommendations."""
+        products = related_products(pk)
+        serializer = ProductListSerializer(products, many=True, context=self.get_serializer_context())
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['post'], url_path='bulk-update')
+    def bulk_update(self, request):
+        """
+        Many stock/price changes in one transaction, e.g.
+        {"operations": [{"id": 4, "stock_delta": 12}, {"id": 9, "price_percent": "-10"}]}
+        """
+        serializer = BulkProductUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        applied, results = apply_product_operations(
+            serializer.validated_data['operations'], serializer.validated_data['all_or_nothing']
+        )
+        failed = any(result['status'] not in ('ok', 'skipped') for result in results)
+        code = status.HTTP_409_CONFLICT if failed and not applied else status.HTTP_200_OK
+        return Response({"applied": applied, "results": results}, status=code)
+
 
 class ContactView(viewsets.ViewSet):
     def create(self, request):
@@ -142,14 +234,86 @@ def login_view(request):
 
   
         refresh = RefreshToken.for_user(user)
-        return Response({
+        data = {
             "message": "Login successful",
             "email": user.email,
             "access": str(refresh.access_token),
             "refresh": str(refresh)
-        }, status=status.HTTP_200_OK)
+        }
+
+        # Fold the guest cookie cart into the user's basket. Flash-sale
+        # products are dropped: they have to come in through the waiting room.
+        guest = cart.read_guest_cart(request)
+        processed = False
+        if guest:
+            on_sale = flash.sales_for(guest)
+            data["guest_cart"] = {"merged": True, "short": [], "flash_sale": sorted(on_sale)}
+            processed = True
+            to_merge = {pk: quantity for pk, quantity in guest.items() if pk not in on_sale}
+            if to_merge:
+                basket, _ = Basket.objects.get_or_create(owner=user)
+                try:
+                    _, data["guest_cart"]["short"] = cart.merge_guest_cart(basket, to_merge)
+                except cart.OutOfStock:
+                    # Keep the cookie so the next login can try again.
+                    data["guest_cart"] = {"merged": False}
+                    processed = False
+        response = Response(data, status=status.HTTP_200_OK)
+        if processed:
+            cart.clear_guest_cart(response)
+        return response
     return Response({"error": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
 
+# Guest cart (signed cookie, no DB writes)
+def _guest_cart_response(guest, products=None):
+    if products is None:
+        products = cart.guest_cart_products(guest)
+    lines, count, subtotal = [], 0, Decimal('0')
+    for product_id, quantity in guest.items():
+        product = products.get(product_id)
+        if product is None:
+            continue
+        total = product.price * quantity
+        lines.append({
+            "product": {
+                "id": product.id,
+                "name": product.name,
+                "price": str(product.price),
+                "image": product.image.url if product.image else None,
+            },
+            "quantity": quantity,
+            "item_total": str(total.quantize(TWO_PLACES)),
+        })
+        count += quantity
+        subtotal += total
+    response = Response({"items": lines, "item_count": count, "subtotal": str(subtotal.quantize(TWO_PLACES))})
+    return cart.write_guest_cart(response, {line["product"]["id"]: line["quantity"] for line in lines})
+
+
+@api_view(['GET', 'PUT', 'DELETE'])
+@permission_classes([AllowAny])
+def guest_cart(request):
+    if request.method == 'GET':
+        return _guest_cart_response(cart.read_guest_cart(request))
+    if request.method == 'DELETE':
+        return cart.clear_guest_cart(Response(status=status.HTTP_204_NO_CONTENT))
+
+    serializer = CartSyncItemSerializer(data=request.data, many=True)
+    serializer.is_valid(raise_exception=True)
+    desired = {entry['product']: entry['quantity'] for entry in serializer.validated_data if entry['quantity']}
+    if len(desired) > settings.GUEST_CART_MAX_LINES:
+        return Response({'detail': f'At most {settings.GUEST_CART_MAX_LINES} products'}, status=status.HTTP_400_BAD_REQUEST)
+
+    products = cart.guest_cart_products(desired)
+    missing = sorted(pk for pk in desired if pk not in products or not products[pk].available)
+    if missing:
+        return Response({'detail': 'Product not found', 'products': missing}, status=status.HTTP_404_NOT_FOUND)
+    short = sorted(pk for pk, quantity in desired.items() if products[pk].stock < quantity)
+    if short:
+        return Response({'detail': 'Not enough stock', 'products': short}, status=status.HTTP_409_CONFLICT)
+    return _guest_cart_response(desired, products)
+
+
 @api_view(['POST'])
 def admin_login_view(request):
     email = request.data.get('email')
@@ -227,6 +391,13 @@ def product_delete_view(request, pk):
 # -------------------------------------------
 # CART / BASKET API
 # -------------------------------------------
+def _flash_sale_refusal(exc):
+    data = {'detail': str(exc), 'product': exc.product_id, 'flash_sale': exc.sale_id}
+    if isinstance(exc, flash.OverLimit):
+        return Response({**data, 'limit': exc.limit}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(data, status=status.HTTP_429_TOO_MANY_REQUESTS)
+
+
 class BasketItemViewSet(viewsets.ModelViewSet):
     serializer_class = CartItemSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -244,61 +415,27 @@ class BasketItemViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'], url_path='add-to-cart')
     def add_to_cart(self, request, pk=None):
+        basket, _ = Basket.objects.get_or_create(owner=request.user)
         try:
-            product = Product.objects.get(pk=pk)
+            flash.check_basket(request.user, basket, {pk: 1}, increment=True)
+            item = cart.add_to_cart(basket, pk)
+        except flash.FlashSaleError as exc:
+            return _flash_sale_refusal(exc)
         except Product.DoesNotExist:
             return Response({'error': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
-
-        if product.stock < 1:
+        except cart.OutOfStock:
             return Response({'error': 'Product is out of stock'}, status=status.HTTP_400_BAD_REQUEST)
 
-        basket, _ = Basket.objects.get_or_create(owner=request.user)
-
-        item = BasketItem.objects.filter(
-            product_object=product,
-            basket_object=basket,
-            is_order_placed=False
-        ).first()
-
-        if item:
-            if not item.is_active:
-                item.is_active = True
-                item.quantity = 1
-                product.stock -= 1
-                product.save()
-            else:
-                if product.stock < 1:
-                    return Response({'error': 'No more stock available'}, status=status.HTTP_400_BAD_REQUEST)
-                item.quantity += 1
-                product.stock -= 1
-                product.save()
-            item.save()
-        else:
-            product.stock -= 1
-            product.save()
-            item = BasketItem.objects.create(
-                product_object=product,
-                basket_object=basket,
-                quantity=1,
-                is_active=True,
-                is_order_placed=False
-            )
-
         return Response(CartItemSerializer(item).data, status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['delete'], url_path='remove-from-cart')
     def remove_from_cart(self, request, pk=None):
         try:
             item = BasketItem.objects.get(pk=pk, basket_object__owner=request.user, is_order_placed=False)
-            product = item.product_object
-            product.stock += item.quantity
-            product.save()
-
-            item.is_active = False
-            item.save()
-            return Response({'detail': 'Item removed from cart'}, status=status.HTTP_204_NO_CONTENT)
         except BasketItem.DoesNotExist:
             return Response({'detail': 'Item not found'}, status=status.HTTP_404_NOT_FOUND)
+        cart.remove_from_cart(item)
+        return Response({'detail': 'Item removed from cart'}, status=status.HTTP_204_NO_CONTENT)
 
 
     @action(detail=True, methods=['patch'], url_path='update-quantity')
@@ -312,12 +449,59 @@ class BasketItemViewSet(viewsets.ModelViewSet):
             return Response({'detail': 'Quantity must be an integer >= 1'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            item = BasketItem.objects.get(pk=pk, basket_object__owner=request.user, is_order_placed=False)
-            item.quantity = quantity
-            item.save()
-            return Response(CartItemSerializer(item).data)
+            item = BasketItem.objects.select_related('product_object').get(
+                pk=pk, basket_object__owner=request.user, is_order_placed=False
+            )
         except BasketItem.DoesNotExist:
             return Response({'detail': 'Item not found'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            if quantity > item.quantity:
+                flash.check_cart(request.user, {item.product_object_id: quantity})
+            cart.set_quantity(item, quantity)
+        except flash.FlashSaleError as exc:
+            return _flash_sale_refusal(exc)
+        except cart.OutOfStock:
+            return Response({'detail': 'No more stock available'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(CartItemSerializer(item).data)
+
+    @action(detail=False, methods=['put'], url_path='sync')
+    def sync(self, request):
+        """Replaces the cart with [{"product": id, "quantity": n}, ...] in one transaction."""
+        serializer = CartSyncItemSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        desired = {}
+        for entry in serializer.validated_data:
+            if entry['product'] in desired:
+                return Response({'detail': f"Product {entry['product']} is listed twice"}, status=status.HTTP_400_BAD_REQUEST)
+            desired[entry['product']] = entry['quantity']
+
+        missing = set(desired) - set(Product.objects.filter(pk__in=desired).values_list('id', flat=True))
+        if missing:
+            return Response({'detail': 'Product not found', 'products': sorted(missing)}, status=status.HTTP_404_NOT_FOUND)
+
+        basket, _ = Basket.objects.get_or_create(owner=request.user)
+        try:
+            flash.check_basket(request.user, basket, desired)
+            items = cart.sync_cart(basket, desired)
+        except flash.FlashSaleError as exc:
+            return _flash_sale_refusal(exc)
+        except cart.OutOfStock as exc:
+            return Response(
+                {'detail': 'Not enough stock', 'products': sorted(exc.requested)}, status=status.HTTP_409_CONFLICT
+            )
+        return Response(CartItemSerializer(items, many=True).data)
+
+    @action(detail=False, methods=['get'], url_path='summary')
+    def summary(self, request):
+        """Cart badge: the basket's stored count and subtotal, one indexed lookup."""
+        basket = Basket.objects.filter(owner=request.user).values('id', 'item_count', 'subtotal').first()
+        if not basket:
+            return Response({'basket': None, 'item_count': 0, 'subtotal': '0.00'})
+        return Response({
+            'basket': basket['id'],
+            'item_count': basket['item_count'],
+            'subtotal': str(basket['subtotal'].quantize(TWO_PLACES)),
+        })
 
     @action(detail=False, methods=['get'], url_path='view-cart')
     def view_cart(self, request):
@@ -329,6 +513,38 @@ class BasketItemViewSet(viewsets.ModelViewSet):
         return Response(CartItemSerializer(items, many=True).data)
 
 
+class FlashSaleViewSet(viewsets.ReadOnlyModelViewSet):
+    """Open and upcoming flash sales, with their waiting rooms."""
+    queryset = FlashSale.objects.filter(finalized_at=None).select_related('product').order_by('starts_at')
+    serializer_class = FlashSaleSerializer
+
+    def get_permissions(self):
+        if self.action == 'queue':
+            return [permissions.IsAuthenticated()]
+        return [permissions.AllowAny()]
+
+    @action(detail=True, methods=['get', 'post'], url_path='queue')
+    def queue(self, request, pk=None):
+        """
+        POST joins the waiting room (again only once an admission has run
+        out); GET polls the caller's place. Served from the flash cache, so
+        the crowd polling here never reaches the database.
+        """
+        sale = flash.sale_by_id(pk)
+        if sale is None:
+            return Response({'detail': 'Flash sale not found'}, status=status.HTTP_404_NOT_FOUND)
+        if request.method == 'POST':
+            state = flash.join(sale, request.user)
+            if state['ended']:
+                return Response({**state, 'detail': 'Flash sale has ended'}, status=status.HTTP_409_CONFLICT)
+        else:
+            state = flash.queue_status(sale, request.user)
+        response = Response(state)
+        if state['retry_after']:
+            response['Retry-After'] = str(state['retry_after'])
+        return response
+
+
 # -------------------------------------------
 # ORDER API
 # -------------------------------------------
@@ -375,7 +591,7 @@ class OrderViewSet(viewsets.ModelViewSet):
             )
             filename = f"Invoice_{order.id}.pdf"
             email.attach(filename, pdf, 'application/pdf')
-            email.send()
+            outbox.enqueue(email)
             return True
         except Exception as e:
             print(f"Email sending failed: {e}")
@@ -421,17 +637,80 @@ class ProductCreateAPIView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+# Bulk product import (CSV / JSONL upload)
+class ProductImportAPIView(APIView):
+    parser_classes = [MultiPartParser, FormParser]
+    permission_classes = [IsAuthenticated, IsSuperUser]
+    max_reported_errors = 1000
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"error": "Upload the rows as 'file'."}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.data.get('fmt') or guess_format(upload.name)
+        if fmt not in BULK_FORMATS:
+            return Response({"error": f"fmt must be one of {', '.join(BULK_FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        errors = []
+
+        def on_error(line, detail):
+            if len(errors) < self.max_reported_errors:
+                errors.append({"line": line, "errors": detail})
+
+        importer = ProductImporter(on_error=on_error)
+        report = importer.run(read_rows(text_stream(upload.file), fmt))
+        report["errors"] = errors
+        return Response(report, status=status.HTTP_200_OK)
+
+# Bulk product export, streamed
+class ProductExportAPIView(APIView):
+    permission_classes = [IsAuthenticated, IsSuperUser]
+
+    def get(self, request):
+        # Not ?format=, which DRF reserves for renderer selection.
+        fmt = request.query_params.get('fmt', 'csv')
+        if fmt not in BULK_FORMATS:
+            return Response({"error": f"fmt must be one of {', '.join(BULK_FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(export_lines(fmt), content_type=f'{content_type}; charset=utf-8')
+        response.headers['Content-Disposition'] = f'attachment; filename="products.{fmt}"'
+        return response
+
 # Single product view
 class ProductDetailAPIView(RetrieveAPIView):
-    queryset = Product.objects.all()
+    queryset = Product.objects.select_related('category')
     serializer_class = ProductSerializer
 
+    @cache_catalog_response
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
 # Get all products
 class ProductListAPIView(APIView):
-    def get(self, request):
-        products = Product.objects.all()
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
+    @cache_catalog_response
+    def get(self, request, category_id=None):
+        fields = product_fieldset(request)
+        products = restrict_product_queryset(Product.objects.all(), fields)
+        if category_id is not None:
+            products = products.filter(category_id=category_id)
+        filters = parse_filters(request.query_params)
+        products = apply_filters(products, filters)
+
+        paginator = ProductCursorPagination()
+        page = paginator.paginate_queryset(products, request, view=self)
+        if page is not None:
+            serializer = ProductListSerializer(page, many=True, context={'fields': fields})
+            response = paginator.get_paginated_response(serializer.data)
+        else:
+            serializer = ProductListSerializer(products, many=True, context={'fields': fields})
+            response = Response(serializer.data)
+
+        # ?facets=true wraps the plain list as {"results": [...]} and adds counts.
+        if request.query_params.get('facets', '').lower() in TRUE_VALUES:
+            data = response.data if isinstance(response.data, dict) else {"results": response.data}
+            data["facets"] = facet_counts(filters, category_id=category_id)
+            response = Response(data)
+        return response
     
 # Delete product
 class ProductDeleteAPIView(APIView):
@@ -453,6 +732,11 @@ class ProductMediaDeleteView(DestroyAPIView):
 # fetch single product media
 class SingleProductMediaById(ListAPIView):
     serializer_class = ProductMediaSerializer
+
+    @cache_catalog_response
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
     def get_queryset(self):
         product_id = self.kwargs.get('product_id')
         try:
@@ -517,6 +801,39 @@ def dashboard_stats(request):
             for p in top_products
         ],
     })
+
+# Full catalog snapshot (pre-built, pre-compressed)
+@require_GET
+def catalog_snapshot(request):
+    meta = get_snapshot()
+    if meta is None:
+        # build_catalog_snapshot hasn't run yet; the client falls back to the API.
+        response = HttpResponse(status=503)
+        response.headers['Retry-After'] = '30'
+        return response
+    encoding = choose_encoding(meta, request.META.get('HTTP_ACCEPT_ENCODING'))
+    etag = snapshot_etag(meta, encoding)
+
+    if etag in [tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(open(snapshot_path(meta, encoding), 'rb'), content_type='application/json')
+        del response.headers['Content-Disposition']
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.headers['ETag'] = etag
+    patch_vary_headers(response, ['Accept-Encoding'])
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+# Catalog cache hit/miss counters
+@api_view(['GET'])
+@permission_classes([IsSuperUser])
+def catalog_cache_stats(request):
+    return Response(get_cache_stats())
+
+
 class WishListViewSet(viewsets.ModelViewSet):
     serializer_class=WishListSerializer
     permission_classes=[IsAuthenticated]
@@ -579,14 +896,14 @@ def forgot_password(request):
     except User.DoesNotExist:
         return Response({"error":"Email not registered"},status=status.HTTP_404_NOT_FOUND)
     otp=generate_otp()
-    PasswordReset.objects.create(user=user,otp=otp)
-
-    send_mail(
-        subject="Password Reset OTP",
-        message=f"Your OTP for password reset is: {otp}.Valid for 5 minutes.",
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=[email],
-    )
+    with transaction.atomic():
+        PasswordReset.objects.create(user=user,otp=otp)
+        outbox.send_mail(
+            subject="Password Reset OTP",
+            message=f"Your OTP for password reset is: {otp}.Valid for 5 minutes.",
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            recipient_list=[email],
+        )
     return Response({"message":"OTP sent to your email"},status=status.HTTP_200_OK)
 
 
@@ -666,14 +983,14 @@ def send_verification_email(request):
     except User.DoesNotExist:
         return Response({"error":"Email not registered"},status=status.HTTP_404_NOT_FOUND)
     code=generate_otp()
-    EmailVerificationCode.objects.create(user=user,code=code)
-
-    send_mail(
-        subject="Email Verification Code",
-        message=f"Hi {user.username},\n\nYour verification code is: {code}\nThis code will expire once used.\n\nIf you didn’t request this, please ignore.",
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=[email],
-    )
+    with transaction.atomic():
+        EmailVerificationCode.objects.create(user=user,code=code)
+        outbox.send_mail(
+            subject="Email Verification Code",
+            message=f"Hi {user.username},\n\nYour verification code is: {code}\nThis code will expire once used.\n\nIf you didn’t request this, please ignore.",
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            recipient_list=[email],
+        )
     return Response({"message":"Verification code sent to your email"},status=status.HTTP_200_OK)
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -718,15 +1035,14 @@ def send_otp(request):
         return Response({"error": "User with this email does not exist"}, status=status.HTTP_404_NOT_FOUND)
 
     otp = "".join(random.choices(string.digits, k=6))  
-    OTPVerification.objects.create(user=user, otp=otp)
-
-    send_mail(
-        "Your OTP Code",
-        f"Your OTP is {otp}. It will expire in 5 minutes.",
-        "noreply@example.com",
-        [email],
-        fail_silently=False,
-    )
+    with transaction.atomic():
+        OTPVerification.objects.create(user=user, otp=otp)
+        outbox.send_mail(
+            "Your OTP Code",
+            f"Your OTP is {otp}. It will expire in 5 minutes.",
+            "noreply@example.com",
+            [email],
+        )
 
     return Response({"message": "OTP sent to email."})
 
@@ -906,4 +1222,12 @@ class HeroSectionViewSet(viewsets.ModelViewSet):
         """
         if self.action in ["list", "retrieve"]:
             return [permissions.AllowAny()]
-        return [IsSuperUser()]
\ No newline at end of file
+        return [IsSuperUser()]
+
+    @cache_catalog_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_catalog_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)